@@ -1,11 +1,17 @@
 #! /usr/bin/env python3
 
 import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             "neo4j_loader"))
+from readers import open_input
 
 
 def get_key_freq(path):
     key_freq = dict()
-    with open(path, "r") as inf:
+    with open_input(path) as inf:
         for line in inf:
             j = json.loads(line.strip())
             for key in j:
@@ -13,10 +19,17 @@ def get_key_freq(path):
                     key_freq[key] += 1
                 else:
                     key_freq[key] = 1
+    if path.endswith(".gz"):
+        path = path[:-len(".gz")]
     with open(path+".key_freq", "w") as outf:
         for k, v in key_freq.items():
             outf.write(f"{k} {v}\n")
 
 
-get_key_freq("All_Amazon_Review.json")
-get_key_freq("All_Amazon_Meta.json")
+def input_path(name):
+    """ Use the compressed file if the decompressed one does not exist. """
+    return name if os.path.exists(name) else name + ".gz"
+
+
+get_key_freq(input_path("All_Amazon_Review.json"))
+get_key_freq(input_path("All_Amazon_Meta.json"))
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+"""
+A compact set of ASINs.
+
+ASINs are 10-character codes of digits and upper-case letters, so each one is
+packed into a uint64 as a base-36 number and kept in a sorted NumPy array, at
+8 bytes per ASIN instead of the ~100 bytes of a str in a Python set. The
+base-36 order of the codes is the string order of the ASINs. New ASINs are
+buffered in a small Python set and merged into the array in batches. The odd
+values that are not such codes, e.g. an empty string, are kept in a Python set.
+
+A lookup in an AsinSet is a binary search of the array, much slower than in a
+Python set, so the passes keep their ASINs in a Python set unless
+NEO4J_LOADER_COMPACT_ASINS is set, see `new_asin_set`.
+"""
+
+import heapq
+import os
+import re
+
+import numpy as np
+
+ASIN_LENGTH = 10
+ASIN_PATTERN = re.compile(r"[0-9A-Z]{10}")
+_DIGITS = np.frombuffer(b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", dtype=np.uint8)
+
+# merge the buffer into the array once it holds this fraction of the array
+PENDING_FRACTION = 8
+MIN_PENDING = 1 << 16
+COMPACT = os.getenv("NEO4J_LOADER_COMPACT_ASINS") is not None
+
+
+def encode(asin):
+    """ @returns The base-36 code of an ASIN, or None if it is not a valid ASIN. """
+    if ASIN_PATTERN.fullmatch(asin) is None:
+        return None
+    return int(asin, 36)
+
+
+def decode(codes):
+    """ @returns The ASINs of an array of base-36 codes. """
+    codes = np.array(codes, dtype=np.uint64)
+    chars = np.empty((len(codes), ASIN_LENGTH), dtype=np.uint8)
+    for pos in range(ASIN_LENGTH - 1, -1, -1):
+        chars[:, pos] = _DIGITS[codes % 36]
+        codes //= 36
+    return [asin.decode("ascii") for asin in chars.view(f"S{ASIN_LENGTH}")[:, 0]]
+
+
+class AsinSet:
+    """ A set of ASIN strings, iterated in sorted order. """
+
+    def __init__(self, asins=()):
+        self.codes = np.empty(0, dtype=np.uint64)
+        self.pending = set()
+        self.others = set()
+        self.update(asins)
+
+    def __len__(self):
+        return len(self.codes) + len(self.pending) + len(self.others)
+
+    def _has_code(self, code):
+        if code in self.pending:
+            return True
+        # a Python int would cast the whole array to compare
+        code = np.uint64(code)
+        idx = self.codes.searchsorted(code)
+        return idx < len(self.codes) and self.codes[idx] == code
+
+    def __contains__(self, asin):
+        code = encode(asin)
+        if code is None:
+            return asin in self.others
+        return self._has_code(code)
+
+    def add(self, asin):
+        code = encode(asin)
+        if code is None:
+            self.others.add(asin)
+        elif not self._has_code(code):
+            self.pending.add(code)
+            if len(self.pending) >= max(MIN_PENDING,
+                                        len(self.codes) // PENDING_FRACTION):
+                self.flush()
+
+    def update(self, asins):
+        for asin in asins:
+            self.add(asin)
+
+    def discard(self, asin):
+        code = encode(asin)
+        if code is None:
+            self.others.discard(asin)
+        elif code in self.pending:
+            self.pending.remove(code)
+        elif self._has_code(code):
+            self.codes = np.delete(self.codes,
+                                   self.codes.searchsorted(np.uint64(code)))
+
+    def flush(self):
+        """ Merge the buffered codes into the sorted array. """
+        if len(self.pending) == 0:
+            return
+        pending = np.fromiter(self.pending,
+                              dtype=np.uint64,
+                              count=len(self.pending))
+        pending.sort()
+        # a stable sort merges the two sorted runs in linear time
+        codes = np.concatenate([self.codes, pending])
+        codes.sort(kind="stable")
+        self.codes = codes
+        self.pending = set()
+
+    def nbytes(self):
+        """ The bytes of the sorted array, without the buffer and odd values. """
+        return self.codes.nbytes
+
+    def __iter__(self):
+        self.flush()
+        batch = 1 << 16
+        codes = (asin for start in range(0, len(self.codes), batch)
+                 for asin in decode(self.codes[start:start + batch]))
+        return heapq.merge(codes, sorted(self.others))
+
+
+def new_asin_set(compact=None):
+    """
+    An empty set of ASINs for the passes.
+    @param compact Whether to make an AsinSet instead of a Python set, by
+           default if NEO4J_LOADER_COMPACT_ASINS is set.
+    """
+    if compact is None:
+        compact = COMPACT
+    return AsinSet() if compact else set()
+
+
+def sorted_asins(asins):
+    """ The ASINs of a set of `new_asin_set` in sorted order. """
+    return asins if isinstance(asins, AsinSet) else sorted(asins)
@@ -0,0 +1,1243 @@
+#! /usr/bin/env python3
+"""
+Benchmarks of the preprocessing building blocks.
+
+    ./neo4j_loader/benchmark.py gzip /path/to/review.json --output gzip.json
+    ./neo4j_loader/benchmark.py decode /path/to/meta.json /path/to/review.json
+    ./neo4j_loader/benchmark.py index /path/to/meta.json /path/to/review.json
+    ./neo4j_loader/benchmark.py asin --meta /path/to/meta.json
+    ./neo4j_loader/benchmark.py clean --meta /path/to/meta.json --review /path/to/review.json
+    ./neo4j_loader/benchmark.py write --rows 2000000 --output write.json
+    ./neo4j_loader/benchmark.py sort --reviewers 4000000 --workers 1 4 8
+    ./neo4j_loader/benchmark.py passes --products 100000 --reviews 1000000 --output passes.json
+    ./neo4j_loader/benchmark.py prefilter --products 100000 --reviews 1000000
+    ./neo4j_loader/benchmark.py extract --baseline <revision> --output extract.json
+    ./neo4j_loader/benchmark.py load bolt://localhost:7687 --database scratch
+"""
+
+import argparse
+import gzip
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+from asin_set import AsinSet
+from decoding import available_backends, get_decoder, merge_fields
+from readers import DECOMPRESSORS, open_input
+
+
+def import_passes(scratch=False):
+    """
+    Import the node and relationship modules, which require NEO4J_HOME.
+    Outputs go to a temporary directory if NEO4J_HOME is not set.
+    @param scratch If true, use a temporary directory even if NEO4J_HOME is set,
+           so that the import dir is left as it is.
+    """
+    if scratch or os.getenv("NEO4J_HOME") is None:
+        os.environ["NEO4J_HOME"] = tempfile.mkdtemp()
+        os.mkdir(os.path.join(os.environ["NEO4J_HOME"], "import"))
+    import nodes
+    import relationships
+    return nodes, relationships
+
+
+def report(results, output=None, info=None):
+    """
+    Print the results and optionally save them as JSON.
+    @param info If given, saved with the results as {"info": info, "results": results}.
+    """
+    for result in results:
+        print(", ".join(f"{k}={v}" for k, v in result.items()))
+    if output is not None:
+        with open(output, "w") as outf:
+            json.dump(results if info is None else {
+                "info": info,
+                "results": results
+            },
+                      outf,
+                      indent=2)
+        print(f"output to {output}")
+
+
+def run_info():
+    """ The date, commit and Python version of a benchmark run. """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+    }
+
+
+def bench_gzip(args):
+    """ Throughput of reading (and parsing) an uncompressed file vs. its .gz file. """
+    path = args.path
+    gz_path = path + ".gz"
+    if not os.path.exists(gz_path):
+        print(f"compress {path} to {gz_path}")
+        with open(path, "rb") as inf, gzip.open(gz_path, "wb") as outf:
+            shutil.copyfileobj(inf, outf, 1 << 24)
+    size = os.path.getsize(path)
+    cases = [("plain", path, None)] + [
+        (x, gz_path, x)
+        for x in DECOMPRESSORS if x == "thread" or shutil.which(x) is not None
+    ]
+    results = []
+    for name, input_path, decompressor in cases + [("gzip.open", gz_path, None)]:
+        start = time.perf_counter()
+        if name == "gzip.open":
+            # decompression on the parsing thread
+            inf = gzip.open(input_path, "rt")
+        else:
+            inf = open_input(input_path, decompressor)
+        with inf:
+            lines = 0
+            for line in inf:
+                if args.parse:
+                    json.loads(line)
+                lines += 1
+        seconds = time.perf_counter() - start
+        results.append({
+            "case": name,
+            "lines": lines,
+            "seconds": round(seconds, 3),
+            "lines_per_sec": round(lines / seconds),
+            "mb_per_sec": round(size / seconds / 1e6, 1),
+        })
+    report(results, args.output)
+
+
+def read_lines(path, limit=None):
+    """ Read up to limit lines of an input file into memory. """
+    lines = []
+    with open_input(path) as inf:
+        for line in inf:
+            if limit is not None and len(lines) >= limit:
+                break
+            lines.append(line)
+    return lines
+
+
+def bench_decode(args):
+    """ Lines/sec of decoding the fields of each pass, stdlib json vs. the fast backends. """
+    nodes, relationships = import_passes()
+    review_time = ("unixReviewTime", )
+    passes = {
+        "get_brands": (args.meta, nodes.BrandCollector().fields),
+        "get_categories": (args.meta, nodes.CategoryCollector().fields),
+        "get_product": (args.meta, nodes.ProductWriter.fields),
+        "has_brand": (args.meta, relationships.HasBrandWriter.fields),
+        "belongs_to": (args.meta, relationships.BelongsToWriter.fields),
+        "product_to_product":
+        (args.meta,
+         relationships.ProductToProductWriter(
+             ['also_buy', 'also_view', 'similar_item']).fields),
+        "get_style_keys":
+        (args.review, merge_fields([review_time,
+                                    nodes.StyleKeyCollector.fields])),
+        "get_reviewers":
+        (args.review, merge_fields([review_time,
+                                    nodes.ReviewerCollector.fields])),
+        "get_reviews":
+        (args.review, merge_fields([review_time, nodes.ReviewWriter.fields])),
+        "is_written_by": (args.review,
+                          merge_fields([
+                              review_time,
+                              relationships.IsWrittenByWriter.fields
+                          ])),
+        "refers_to": (args.review,
+                      merge_fields(
+                          [review_time, relationships.RefersToWriter.fields])),
+        "rates": (args.review,
+                  merge_fields([review_time,
+                                relationships.RatesWriter.fields])),
+    }
+    lines = {
+        path: read_lines(path, args.limit)
+        for path in {args.meta, args.review}
+    }
+    results = []
+    for name, (path, fields) in passes.items():
+        cases = [("before", "json", None)] + [
+            ("after", backend, fields) for backend in available_backends()
+        ]
+        for case, backend, projection in cases:
+            decode = get_decoder(projection, backend)
+            start = time.perf_counter()
+            for line in lines[path]:
+                decode(line)
+            seconds = time.perf_counter() - start
+            results.append({
+                "pass": name,
+                "case": case,
+                "backend": backend,
+                "fields": "all" if projection is None else len(projection),
+                "lines_per_sec": round(len(lines[path]) / seconds),
+            })
+    report(results, args.output)
+
+
+def bench_index(args):
+    """ Lookups/sec of the node id indexes vs. pandas .loc, and lines/sec of the lookup-heavy passes. """
+    nodes, relationships = import_passes()
+    import node_index
+    from utils import neo4j_import_dir
+
+    # the node files the passes look up
+    if not os.path.exists(os.path.join(neo4j_import_dir, "brand.csv")):
+        nodes.get_brands(args.meta,
+                         word_frequency=False,
+                         replace=nodes.BRAND_REPLACE_PATTERNS)
+        nodes.get_categories(args.meta)
+        nodes.get_style_keys(args.review)
+    indexes = {
+        "brand": (node_index.load_brand_index(), "name:string",
+                  "id:ID(brand_id)", node_index.brand_signature),
+        "style": (node_index.load_style_index(), "key:string",
+                  "id:ID(style_id)", None),
+        "category": (node_index.load_category_index(), "name:string",
+                     "id:ID(category_id)", node_index.category_name),
+    }
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+    results = []
+    for name, (index, key_col, id_col, key_fn) in indexes.items():
+        keys = list(index.ids)
+        keys = [random.choice(keys) for _ in range(args.lookups)]
+        start = time.perf_counter()
+        for key in keys:
+            index.get_id(key)
+        seconds = time.perf_counter() - start
+        results.append({
+            "index": name,
+            "case": "NodeIndex",
+            "lookups_per_sec": round(len(keys) / seconds)
+        })
+        if pd is None:
+            continue
+        # the pandas lookup the passes used before
+        frame = pd.read_csv(index.path, converters={key_col: str, id_col: str})
+        if key_fn is not None:
+            frame[key_col] = frame[key_col].apply(key_fn)
+        frame = frame.set_index(key_col)
+        start = time.perf_counter()
+        for key in keys[:args.lookups // 100]:
+            frame.loc[key][id_col]
+        seconds = time.perf_counter() - start
+        results.append({
+            "index": name,
+            "case": "pandas.loc",
+            "lookups_per_sec": round(len(keys) / 100 / seconds)
+        })
+    passes = [("has_brand", relationships.has_brand, args.meta),
+              ("belongs_to", relationships.belongs_to, args.meta),
+              ("refers_to", relationships.refers_to, args.review)]
+    for name, func, path in passes:
+        start = time.perf_counter()
+        func(path)
+        seconds = time.perf_counter() - start
+        with open_input(path) as inf:
+            lines = sum(1 for _ in inf)
+        results.append({
+            "pass": name,
+            "seconds": round(seconds, 3),
+            "lines_per_sec": round(lines / seconds)
+        })
+    report(results, args.output)
+
+
+def get_asins(meta=None, count=1000000, seed=0):
+    """ The product and similar item asins of the meta file, or random ones. """
+    if meta is None:
+        rng = random.Random(seed)
+        chars = string.digits + string.ascii_uppercase
+        return [
+            "B0" + "".join(rng.choice(chars) for _ in range(8))
+            for _ in range(count)
+        ]
+    asins = []
+    decode = get_decoder(("asin", "also_buy", "also_view", "similar_item"))
+    with open_input(meta) as inf:
+        for line in inf:
+            j = decode(line)
+            asins.append(j["asin"])
+            asins.extend(j.get("also_buy", []))
+            asins.extend(j.get("also_view", []))
+            asins.extend(x["asin"] for x in j.get("similar_item", [])
+                         if "asin" in x)
+    return asins
+
+
+def bench_asin(args):
+    """ Memory and time of a Python set of asins vs. AsinSet. """
+    asins = get_asins(args.meta, args.count)
+    rng = random.Random(1)
+    lookups = [rng.choice(asins) for _ in range(args.lookups)]
+    results = []
+
+    def build(make, copy=False):
+        asin_set = make()
+        for asin in asins:
+            if copy:
+                # a new str, as decoded from a line, to count what a set keeps
+                asin = asin.encode().decode()
+            if asin not in asin_set:
+                asin_set.add(asin)
+        if isinstance(asin_set, AsinSet):
+            asin_set.flush()
+        return asin_set
+
+    for name, make in [("set", set), ("AsinSet", AsinSet)]:
+        # tracing slows down the allocations, so time a separate build
+        tracemalloc.start()
+        asin_set = build(make, copy=True)
+        memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del asin_set
+        start = time.perf_counter()
+        asin_set = build(make)
+        add_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for asin in lookups:
+            asin in asin_set
+        lookup_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for asin in (asin_set if name == "AsinSet" else sorted(asin_set)):
+            pass
+        sorted_seconds = time.perf_counter() - start
+        results.append({
+            "case": name,
+            "asins": len(asin_set),
+            "mb": round(memory[0] / 1e6, 1),
+            "peak_mb": round(memory[1] / 1e6, 1),
+            "bytes_per_asin": round(memory[0] / len(asin_set), 1),
+            "adds_per_sec": round(len(asins) / add_seconds),
+            "lookups_per_sec": round(len(lookups) / lookup_seconds),
+            "sorted_iter_seconds": round(sorted_seconds, 3),
+        })
+        del asin_set
+    report(results, args.output)
+
+
+# the pieces of the random values that the cleaning kernels are checked on
+CLEAN_PIECES = [
+    "a", "Z", "0", " ", "  ", ",", '"', '\\"', '""', "\n", "\r", "\r\n", "\t",
+    ".", "-", "&", "&amp;", "&#39;", "&nbsp;", "<b>", "</b>", "<", ">", "(",
+    ")", "{", "}", "Visit Amazon's", "Page", ";", "\u00e9", "\u0130", "\u00a0"
+]
+
+
+def random_values(rng, count):
+    """ Random values mixing words with the characters the kernels handle. """
+    values = []
+    for _ in range(count):
+        pieces = rng.choices(CLEAN_PIECES + ["word", "Brand Name"] * 4,
+                             k=rng.randint(0, 12))
+        values.append("".join(pieces))
+    return values
+
+
+def clean_kernels(module):
+    """ The (name, scalar function, batch function) of the cleaning kernels. """
+    return [
+        ("escape_comma_newline", module.escape_comma_newline,
+         module.escape_comma_newline_batch),
+    ]
+
+
+def get_clean_inputs(meta=None, review=None, limit=1000000):
+    """ The values of the meta and review fields cleaned by each kernel. """
+    descriptions, texts = [], []
+    if meta is not None:
+        decode = get_decoder(("description", "price", "rank"))
+        for line in read_lines(meta, limit):
+            j = decode(line)
+            descriptions.append("; ".join(
+                x.strip() for x in j.get("description", []) if x.strip()))
+            descriptions.append(j.get("price", ""))
+    if review is not None:
+        decode = get_decoder(("summary", "reviewText"))
+        for line in read_lines(review, limit):
+            j = decode(line)
+            texts.append(j.get("summary", ""))
+            texts.append(j.get("reviewText", ""))
+    return {"escape_comma_newline": descriptions + texts}
+
+
+def bench_clean(args):
+    """ Equivalence and values/sec of the scalar and batch cleaning kernels. """
+    import_passes()
+    import utils
+    rng = random.Random(args.seed)
+    kernels = clean_kernels(utils)
+    # the batch kernels must give the outputs of the scalar ones
+    for name, scalar, batch in kernels:
+        for _ in range(args.checks // 1000):
+            values = random_values(rng, 1000)
+            expected = [scalar(value) for value in values]
+            actual = batch(values)
+            mismatches = [(value, x, y)
+                          for value, x, y in zip(values, expected, actual)
+                          if x != y]
+            assert not mismatches, f"{name} differs on {mismatches[:3]}"
+        print(f"{name}: batch equals scalar on {args.checks} random values")
+    if args.meta is None and args.review is None:
+        values = random_values(rng, args.limit)
+        inputs = {name: values for name, _, _ in kernels}
+    else:
+        inputs = get_clean_inputs(args.meta, args.review, args.limit)
+    results = []
+    for name, scalar, batch in kernels:
+        values = inputs[name]
+        assert [scalar(x) for x in values] == [
+            y for start in range(0, len(values), args.batch_size)
+            for y in batch(values[start:start + args.batch_size])
+        ], f"{name} differs on the input values"
+        start = time.perf_counter()
+        for value in values:
+            scalar(value)
+        scalar_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for idx in range(0, len(values), args.batch_size):
+            batch(values[idx:idx + args.batch_size])
+        batch_seconds = time.perf_counter() - start
+        results.append({
+            "kernel": name,
+            "values": len(values),
+            "scalar_per_sec": round(len(values) / scalar_seconds),
+            "batch_per_sec": round(len(values) / batch_seconds),
+            "speedup": round(scalar_seconds / batch_seconds, 2),
+        })
+    report(results, args.output, run_info())
+
+
+def bench_write(args):
+    """ Rows/sec of writing review rows to the yearly files, per row vs. in blocks. """
+    import block_writer
+    rng = random.Random(args.seed)
+    words = ["great", "product", "works", "broke", "after", "a", "week"]
+    rows = [(rng.randrange(args.files),
+             f"R2015{idx},5.0,1434326400,True,,Five Stars,"
+             f"{' '.join(rng.choices(words, k=rng.randint(1, 100)))},0\n")
+            for idx in range(args.rows)]
+    size = sum(len(row) for _, row in rows)
+    output_dir = tempfile.mkdtemp(dir=args.dir)
+    cases = [
+        # (name, open a file, rows joined per batch)
+        ("per_row", lambda path: open(path, "w"), False),
+        ("per_row_1mib", lambda path: block_writer.open_output(
+            path, background=False), False),
+        ("blocks", lambda path: block_writer.open_output(
+            path, background=False), True),
+        ("blocks_thread", lambda path: block_writer.open_output(
+            path, background=True), True),
+    ]
+    results = []
+    for name, open_file, blocks in cases:
+        start = time.perf_counter()
+        outfiles = [
+            open_file(os.path.join(output_dir, f"{name}{idx}.csv"))
+            for idx in range(args.files)
+        ]
+        if blocks:
+            for batch_start in range(0, len(rows), args.batch_size):
+                parts = [[] for _ in outfiles]
+                for idx, row in rows[batch_start:batch_start + args.batch_size]:
+                    parts[idx].append(row)
+                for outf, part in zip(outfiles, parts):
+                    if part:
+                        outf.write("".join(part))
+        else:
+            writes = [outf.write for outf in outfiles]
+            for idx, row in rows:
+                writes[idx](row)
+        for outf in outfiles:
+            outf.close()
+        seconds = time.perf_counter() - start
+        results.append({
+            "case": name,
+            "rows": len(rows),
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(len(rows) / seconds),
+            "mb_per_sec": round(size / seconds / 1e6, 1),
+        })
+    shutil.rmtree(output_dir)
+    report(results, args.output, run_info())
+
+
+def bench_sort(args):
+    """ Seconds to sort the reviewer ids of the Reviewer node file, by sorted vs. parallel_sorted on workers. """
+    import extsort
+    rng = random.Random(args.seed)
+    chars = string.digits + string.ascii_uppercase
+    reviewers = list(
+        dict.fromkeys(
+            "A" + "".join(rng.choices(chars, k=rng.randint(9, 20)))
+            for _ in range(args.reviewers)))
+    start = time.perf_counter()
+    expected = sorted(reviewers)
+    results = [{
+        "case": "sorted",
+        "reviewers": len(expected),
+        "seconds": round(time.perf_counter() - start, 3)
+    }]
+    for workers in args.workers:
+        start = time.perf_counter()
+        items = extsort.parallel_sorted(reviewers, workers)
+        seconds = time.perf_counter() - start
+        assert items == expected, f"the order differs with {workers} workers"
+        results.append({
+            "case": f"extsort_{workers}",
+            "reviewers": len(items),
+            "seconds": round(seconds, 3),
+            "speedup": round(results[0]["seconds"] / seconds, 2)
+        })
+    report(results, args.output, run_info())
+
+
+# the functions of nodes.py and relationships.py in the order of dependency,
+# as (module, function, input, extra arguments)
+PASSES = [
+    ("nodes", "get_brands", "meta", {
+        "word_frequency": False,
+        "replace": "BRAND_REPLACE_PATTERNS"
+    }),
+    ("nodes", "get_categories", "meta", {}),
+    ("nodes", "get_style_keys", "review", {}),
+    ("nodes", "get_reviewers", "review", {}),
+    ("nodes", "get_product", "meta", {}),
+    ("nodes", "get_reviews", "review", {}),
+    ("relationships", "has_brand", "meta", {}),
+    ("relationships", "is_written_by", "review", {}),
+    ("relationships", "refers_to", "review", {}),
+    ("relationships", "rates", "review", {}),
+    ("relationships", "belongs_to", "meta", {}),
+    ("relationships", "product_to_product", "meta", {
+        "key": ["also_buy", "also_view", "similar_item"]
+    }),
+    ("nodes", "get_missing_products", "rates", {}),
+]
+
+
+def run_pass(module, func, path, kwargs):
+    """
+    Run a pass in a fresh process.
+    @returns The seconds and the peak RSS in bytes of the process.
+    """
+    module = __import__(module)
+    kwargs = dict(kwargs)
+    if kwargs.get("replace") == "BRAND_REPLACE_PATTERNS":
+        kwargs["replace"] = module.BRAND_REPLACE_PATTERNS
+    if func == "get_missing_products":
+        args = (path, [os.path.join(module.neo4j_import_dir, "product.csv")])
+    else:
+        args = (path, )
+    start = time.perf_counter()
+    getattr(module, func)(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    # kilobytes on Linux
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def snapshot(directory):
+    """ The size and modification time of the files in a directory tree. """
+    files = {}
+    for dirpath, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def count_lines(path):
+    from line_index import line_count
+    lines = line_count(path)
+    if lines is None:
+        with open_input(path) as inf:
+            lines = sum(1 for _ in inf)
+    return lines
+
+
+# the passes whose sinks all have a prefilter, in the order of dependency, as
+# (module, function, input, output)
+PREFILTER_PASSES = [
+    ("nodes", "get_brands", "meta", "brand.csv", {
+        "word_frequency": False,
+        "replace": "BRAND_REPLACE_PATTERNS"
+    }),
+    ("nodes", "get_style_keys", "review", "style.csv", {}),
+    ("relationships", "has_brand", "meta", "Product_hasBrand_Brand.csv", {}),
+    ("relationships", "refers_to", "review", "Review_refersTo_Style.csv", {}),
+]
+
+
+def bench_prefilter(args):
+    """ Seconds of the prefiltered passes, reading every line as text vs. the mapped file. """
+    # the passes overwrite their outputs, e.g. brand.csv, once per case
+    import_passes(scratch=True)
+    import pipeline
+    from utils import neo4j_import_dir
+    info = run_info()
+    if args.meta is None or args.review is None:
+        import synthetic
+        data_dir = tempfile.mkdtemp()
+        args.meta = os.path.join(data_dir, "meta.json")
+        args.review = os.path.join(data_dir, "review.json")
+        synthetic.generate(args.meta, args.review, args.products,
+                           args.reviews, args.seed)
+        info["synthetic"] = {
+            "products": args.products,
+            "reviews": args.reviews,
+            "seed": args.seed
+        }
+    inputs = {"meta": args.meta, "review": args.review}
+    mapped = pipeline.MAPPED
+    results = []
+    for module, func, input_name, output, kwargs in PREFILTER_PASSES:
+        output_path = os.path.join(neo4j_import_dir, output)
+        outputs = {}
+        for case in ["text", "mapped"]:
+            pipeline.MAPPED = case == "mapped"
+            try:
+                seconds, _ = run_pass(module, func, inputs[input_name],
+                                      kwargs)
+            finally:
+                pipeline.MAPPED = mapped
+            with open(output_path, "rb") as inf:
+                outputs[case] = inf.read()
+            results.append({
+                "pass": f"{module}.{func}",
+                "case": case,
+                "seconds": round(seconds, 3),
+            })
+        assert outputs["text"] == outputs["mapped"], f"{output} differs"
+        results[-1]["speedup"] = round(
+            results[-2]["seconds"] / results[-1]["seconds"], 2)
+    report(results, args.output, info)
+
+
+def bench_passes(args):
+    """ Lines/sec, peak RSS and output bytes of every pass of nodes.py and relationships.py. """
+    import_passes()
+    from utils import neo4j_import_dir
+    info = run_info()
+    if args.meta is None or args.review is None:
+        import synthetic
+        data_dir = tempfile.mkdtemp()
+        args.meta = os.path.join(data_dir, "meta.json")
+        args.review = os.path.join(data_dir, "review.json")
+        synthetic.generate(args.meta, args.review, args.products,
+                           args.reviews, args.seed)
+        info["synthetic"] = {
+            "products": args.products,
+            "reviews": args.reviews,
+            "seed": args.seed
+        }
+    inputs = {
+        "meta": args.meta,
+        "review": args.review,
+        "rates": os.path.join(neo4j_import_dir, "Review_rates_Product.csv")
+    }
+    info["inputs"] = {
+        name: {
+            "path": inputs[name],
+            "bytes": os.path.getsize(inputs[name]),
+            "lines": count_lines(inputs[name])
+        }
+        for name in ["meta", "review"]
+    }
+    # a fresh process per pass for its peak RSS
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for module, func, input_name, kwargs in PASSES:
+        if args.passes is not None and func not in args.passes:
+            continue
+        path = inputs[input_name]
+        before = snapshot(neo4j_import_dir)
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            seconds, peak_rss = executor.submit(run_pass, module, func, path,
+                                                kwargs).result()
+        after = snapshot(neo4j_import_dir)
+        output_bytes = sum(size for path, (size, mtime) in after.items()
+                           if before.get(path) != (size, mtime))
+        lines = count_lines(path)
+        results.append({
+            "pass": f"{module}.{func}",
+            "lines": lines,
+            "seconds": round(seconds, 3),
+            "lines_per_sec": round(lines / seconds),
+            "peak_rss_mb": round(peak_rss / 1e6, 1),
+            "output_bytes": output_bytes,
+        })
+    report(results, args.output, info)
+
+
+def load_revision(name, revision):
+    """ Load a module of this directory as of a git revision, to compare with. """
+    source = subprocess.run(
+        ["git", "show", f"{revision}:./{name}.py"],
+        cwd=os.path.dirname(os.path.realpath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True).stdout
+    module = types.ModuleType(f"{name}@{revision}")
+    exec(compile(source, f"{name}.py@{revision}", "exec"), module.__dict__)
+    return module
+
+
+class StandInRecord(tuple):
+    """ A record of a query result, indexed by position or by key like neo4j.Record. """
+
+    def __new__(cls, values, keys):
+        record = super().__new__(cls, values)
+        record.keys = keys
+        return record
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.keys.index(key)
+        return super().__getitem__(key)
+
+
+class StandInGraph:
+    """
+    A local stand-in for a Neo4j database holding one category, which answers
+    the queries of extract_subgraph.Neo4jHandler. A query is recognized by its
+    MATCH pattern and its RETURN clause is evaluated on the matched nodes, as
+    whole nodes (dicts) or their properties, with DISTINCT. The rows of a query
+    are kept after its first run, like the database holds the graph, so that
+    the following runs only measure the client. Records are created a fetch
+    size at a time, as the driver buffers them, after waiting latency seconds
+    for each fetch, which stand for the round trip to the database.
+    """
+
+    def __init__(self, category, products, reviews, seed=0, latency=0):
+        rng = random.Random(seed)
+        self.latency = latency
+        words = ["quality", "steel", "compact", "kitchen", "easy", "durable"]
+        self.category = {"name": category}
+        asins = get_asins(count=products, seed=seed)
+        self.products = [{
+            "asin": asin,
+            "description": [
+                " ".join(rng.choices(words, k=20))
+                for _ in range(rng.randint(0, 3))
+            ],
+            "price": f"${rng.randint(1, 500)}.99",
+            "rank": f"{rng.randint(1, 10**6):,} in {category[1:]} (",
+        } for asin in asins]
+        reviewers = [{
+            "reviewerID": f"A{idx:013d}",
+            "name": f"Reviewer {idx}"
+        } for idx in range(max(1, reviews // 4))]
+        # (reviewer, product, overall) of the reviews
+        self.reviews = [(rng.choice(reviewers), rng.choice(self.products),
+                         float(rng.randint(1, 5))) for _ in range(reviews)]
+        self.edges = {
+            relation: [(rng.choice(self.products), rng.choice(self.products))
+                       for _ in range(products * 2)]
+            for relation in ["isSimilarTo", "alsoBuy", "alsoView"]
+        }
+        # query to (keys, rows)
+        self.results = {}
+        self.records = 0
+        # the sessions may run on threads
+        self.lock = threading.Lock()
+
+    def match(self, query):
+        """ The bindings of the variables of the MATCH pattern of a query. """
+        for relation, edges in self.edges.items():
+            if f":{relation}]" in query:
+                return [{"p1": p1, "p2": p2} for p1, p2 in edges]
+        if "collect(u.reviewerID)" in query:
+            # the reviewers of a product and rating, aggregated in the query
+            groups = {}
+            for reviewer, product, overall in self.reviews:
+                if overall is None and "overall IS NOT NULL" in query:
+                    continue
+                groups.setdefault((id(product), overall),
+                                  []).append(reviewer["reviewerID"])
+            return [{
+                "reviewers": reviewers
+            } for reviewers in groups.values() if len(reviewers) > 1]
+        if "r1.overall" in query:
+            groups = {}
+            for reviewer, product, overall in self.reviews:
+                groups.setdefault((id(product), overall), []).append(reviewer)
+            return [{
+                "u1": u1,
+                "u2": u2
+            } for reviewers in groups.values()
+                    for idx1, u1 in enumerate(reviewers)
+                    for idx2, u2 in enumerate(reviewers) if idx1 != idx2]
+        if ":Reviewer" in query and ":Category" in query:
+            # r is the reviewer or the review
+            return [{
+                "r": reviewer if "(r:Reviewer)" in query else {
+                    "overall": overall
+                },
+                "u": reviewer,
+                "p": product,
+                "c": self.category
+            } for reviewer, product, overall in self.reviews]
+        if ":Category" in query:
+            return [{"p": product, "c": self.category} for product in self.products]
+        return [{
+            "u": reviewer,
+            "p": product
+        } for reviewer, product, _ in self.reviews]
+
+    def evaluate(self, query):
+        """ The keys and rows of the RETURN clause of a query. """
+        clause = query[query.rindex("RETURN") + len("RETURN"):].strip()
+        distinct = clause.startswith("DISTINCT ")
+        if distinct:
+            clause = clause[len("DISTINCT "):]
+        keys, columns = [], []
+        for column in clause.split(","):
+            expr, _, alias = column.strip().partition(" AS ")
+            variable, _, prop = expr.strip().partition(".")
+            keys.append(alias.strip() or expr.strip())
+            columns.append((variable, prop))
+        rows = [
+            tuple(binding[variable].get(prop) if prop else binding[variable]
+                  for variable, prop in columns)
+            for binding in self.match(query)
+        ]
+        if distinct:
+            # nodes and lists by identity, as they are not hashable
+            rows = list({
+                tuple(id(x) if isinstance(x, (dict, list)) else x
+                      for x in row): row
+                for row in rows
+            }.values())
+        return keys, rows
+
+    def run(self, query, fetch_size):
+        with self.lock:
+            if query not in self.results:
+                self.results[query] = self.evaluate(query)
+        keys, rows = self.results[query]
+        for start in range(0, len(rows), fetch_size):
+            if self.latency:
+                time.sleep(self.latency)
+            buffer = [
+                StandInRecord(row, keys)
+                for row in rows[start:start + fetch_size]
+            ]
+            with self.lock:
+                self.records += len(buffer)
+            yield from buffer
+
+
+class StandInSession:
+    """ A session and transaction of the stand-in graph. """
+
+    def __init__(self, graph, fetch_size):
+        self.graph = graph
+        self.fetch_size = fetch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_read(self, fn, *args):
+        return fn(self, *args)
+
+    def run(self, query, **parameters):
+        return self.graph.run(query, self.fetch_size)
+
+
+class StandInDatabase:
+    """ Replaces neo4j.GraphDatabase in a module, to connect to a stand-in graph. """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def driver(self, uri, auth=None):
+        return self
+
+    def session(self, fetch_size=1000):
+        return StandInSession(self.graph, fetch_size)
+
+    def close(self):
+        pass
+
+
+# the methods of Neo4jHandler, in the order of its __main__
+EXTRACT_METHODS = [
+    "_extract_product", "_extract_reviewer", "_extract_product_to_product",
+    "_extract_usu", "_extract_itemprod"
+]
+
+
+def read_outputs(folder):
+    """ The contents of the files under a folder, by their relative paths. """
+    outputs = {}
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as inf:
+                outputs[os.path.relpath(path, folder)] = inf.read()
+    return outputs
+
+
+def bench_extract(args):
+    """ Client peak memory and records/sec of extract_subgraph.Neo4jHandler on a stand-in graph, per method and concurrently. """
+    import_passes()
+    import extract_subgraph
+    info = run_info()
+    info["stand_in"] = {
+        "products": args.products,
+        "reviews": args.reviews,
+        "seed": args.seed,
+        "latency": args.latency
+    }
+    graph = StandInGraph(args.category, args.products, args.reviews,
+                         args.seed, args.latency)
+    cases = [("after", extract_subgraph, {
+        "fetch_size": fetch_size
+    }) for fetch_size in args.fetch_sizes]
+    if args.baseline is not None:
+        info["baseline"] = args.baseline
+        cases.insert(
+            0, ("before", load_revision("extract_subgraph", args.baseline), {}))
+    results = []
+    for case, module, kwargs in cases:
+        module.GraphDatabase = StandInDatabase(graph)
+        client = module.Neo4jHandler("bolt://stand-in", "neo4j", "neo4j",
+                                     **kwargs)
+        for method in EXTRACT_METHODS:
+            if args.methods is not None and method not in args.methods:
+                continue
+            # the first run computes the rows of the queries
+            client.execute(method, args.category)
+            # tracing slows down the allocations, so time a separate run
+            tracemalloc.start()
+            client.execute(method, args.category)
+            memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            graph.records = 0
+            start = time.perf_counter()
+            client.execute(method, args.category)
+            seconds = time.perf_counter() - start
+            results.append({
+                "case": case,
+                "fetch_size": kwargs.get("fetch_size", 1000),
+                "method": method,
+                "records": graph.records,
+                "seconds": round(seconds, 3),
+                "records_per_sec": round(graph.records / seconds),
+                "peak_mb": round(memory[1] / 1e6, 1),
+            })
+        client.close()
+    # all methods at the same time, after the rows are computed above
+    methods = [
+        method for method in EXTRACT_METHODS
+        if args.methods is None or method in args.methods
+    ]
+    # the outputs and records of the sequential runs of the last case
+    folder = os.path.dirname(
+        extract_subgraph.output_path(args.category, "product.csv"))
+    expected = read_outputs(folder)
+    expected_records = sum(result["records"]
+                           for result in results[-len(methods):])
+    client = extract_subgraph.Neo4jHandler("bolt://stand-in", "neo4j",
+                                           "neo4j")
+    for concurrency in args.concurrency:
+        # no output of the sequential runs is left to compare
+        shutil.rmtree(folder)
+        graph.records = 0
+        start = time.perf_counter()
+        client.execute_all([args.category], methods, concurrency)
+        seconds = time.perf_counter() - start
+        outputs = read_outputs(folder)
+        assert outputs.keys() == expected.keys(
+        ), f"execute_all with concurrency {concurrency} writes {sorted(outputs)}, not {sorted(expected)}"
+        for name, content in expected.items():
+            assert outputs[
+                name] == content, f"{name} differs with concurrency {concurrency}"
+        assert graph.records == expected_records, f"execute_all with concurrency {concurrency} fetches {graph.records} records, not {expected_records}"
+        results.append({
+            "case": "execute_all",
+            "concurrency": concurrency,
+            "records": graph.records,
+            "seconds": round(seconds, 3),
+            "records_per_sec": round(graph.records / seconds),
+        })
+    client.close()
+    report(results, args.output, info)
+
+
+def bench_load(args):
+    """ Rows/sec of loading the import CSVs over Bolt per batch size, into a scratch database emptied before each run. """
+    import_passes()
+    from bolt_import import BoltImporter, parse_admin_args
+    from utils import neo4j_import_dir
+    admin = importlib.import_module("import")
+    nodes, relationships = parse_admin_args(admin.NODE_FILES +
+                                            admin.RELATIONSHIP_FILES)
+    info = run_info()
+    info["database"] = args.database
+    results = []
+    for batch_size in args.batch_sizes:
+        importer = BoltImporter(args.uri, args.user, args.password,
+                                args.database, batch_size, args.writers)
+        with importer.session() as session:
+            session.run("MATCH (n) CALL { WITH n DETACH DELETE n } "
+                        "IN TRANSACTIONS OF 10000 ROWS").consume()
+        start = time.perf_counter()
+        stats = importer.load(nodes, relationships, neo4j_import_dir)
+        seconds = time.perf_counter() - start
+        importer.close()
+        rows = sum(x["rows"] for x in stats)
+        results.extend(stats)
+        results.append({
+            "name": "total",
+            "rows": rows,
+            "batch_size": batch_size,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(rows / seconds),
+        })
+    report(results, args.output, info)
+
+
+def main(argv=None):
+    """ Parse the command line and run a benchmark. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    sub = subparsers.add_parser("gzip", help=bench_gzip.__doc__)
+    sub.add_argument("path", help="an uncompressed JSON lines file")
+    sub.add_argument("--no-parse",
+                     dest="parse",
+                     action="store_false",
+                     help="only read lines, without json.loads")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_gzip)
+
+    sub = subparsers.add_parser("decode", help=bench_decode.__doc__)
+    sub.add_argument("meta", help="the meta JSON file")
+    sub.add_argument("review", help="the review JSON file")
+    sub.add_argument("--limit",
+                     type=int,
+                     default=1000000,
+                     help="the number of lines to decode per file")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_decode)
+
+    sub = subparsers.add_parser("index", help=bench_index.__doc__)
+    sub.add_argument("meta", help="the meta JSON file")
+    sub.add_argument("review", help="the review JSON file")
+    sub.add_argument("--lookups",
+                     type=int,
+                     default=1000000,
+                     help="the number of lookups per index")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_index)
+
+    sub = subparsers.add_parser("asin", help=bench_asin.__doc__)
+    sub.add_argument("--meta",
+                     help="the meta JSON file to read the asins from, "
+                     "instead of random asins")
+    sub.add_argument("--count",
+                     type=int,
+                     default=1000000,
+                     help="the number of random asins")
+    sub.add_argument("--lookups",
+                     type=int,
+                     default=1000000,
+                     help="the number of lookups")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_asin)
+
+    sub = subparsers.add_parser("clean", help=bench_clean.__doc__)
+    sub.add_argument("--meta",
+                     help="the meta JSON file to read the descriptions and "
+                     "prices from")
+    sub.add_argument("--review",
+                     help="the review JSON file to read the texts from")
+    sub.add_argument("--limit",
+                     type=int,
+                     default=1000000,
+                     help="the number of lines per file, or of random values "
+                     "without files")
+    sub.add_argument("--checks",
+                     type=int,
+                     default=100000,
+                     help="the number of random values to check each batch "
+                     "kernel on")
+    sub.add_argument("--batch-size",
+                     type=int,
+                     default=10000,
+                     help="the values per batch")
+    sub.add_argument("--seed", type=int, default=0)
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_clean)
+
+    sub = subparsers.add_parser("write", help=bench_write.__doc__)
+    sub.add_argument("--rows",
+                     type=int,
+                     default=2000000,
+                     help="the number of rows to write")
+    sub.add_argument("--files",
+                     type=int,
+                     default=23,
+                     help="the number of files the rows are spread over")
+    sub.add_argument("--batch-size",
+                     type=int,
+                     default=10000,
+                     help="the rows joined into blocks at a time")
+    sub.add_argument("--dir", help="the directory to write to")
+    sub.add_argument("--seed", type=int, default=0)
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_write)
+
+    sub = subparsers.add_parser("sort", help=bench_sort.__doc__)
+    sub.add_argument("--reviewers",
+                     type=int,
+                     default=4000000,
+                     help="the number of random reviewer ids to sort")
+    sub.add_argument("--workers",
+                     type=int,
+                     nargs="+",
+                     default=[1, os.cpu_count()],
+                     help="the worker processes of each run")
+    sub.add_argument("--seed", type=int, default=0)
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_sort)
+
+    sub = subparsers.add_parser("passes", help=bench_passes.__doc__)
+    sub.add_argument("--meta",
+                     help="the meta JSON file, by default a synthetic one")
+    sub.add_argument("--review",
+                     help="the review JSON file, by default a synthetic one")
+    sub.add_argument("--products",
+                     type=int,
+                     default=10000,
+                     help="the number of synthetic products")
+    sub.add_argument("--reviews",
+                     type=int,
+                     default=100000,
+                     help="the number of synthetic reviews")
+    sub.add_argument("--seed",
+                     type=int,
+                     default=0,
+                     help="the seed of the synthetic data")
+    sub.add_argument("--passes",
+                     nargs="+",
+                     help="the functions to run, by default all; a pass "
+                     "needs the node files of the passes before it")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_passes)
+
+    sub = subparsers.add_parser("prefilter", help=bench_prefilter.__doc__)
+    sub.add_argument("--meta",
+                     help="the meta JSON file, by default a synthetic one")
+    sub.add_argument("--review",
+                     help="the review JSON file, by default a synthetic one")
+    sub.add_argument("--products",
+                     type=int,
+                     default=10000,
+                     help="the number of synthetic products")
+    sub.add_argument("--reviews",
+                     type=int,
+                     default=100000,
+                     help="the number of synthetic reviews")
+    sub.add_argument("--seed",
+                     type=int,
+                     default=0,
+                     help="the seed of the synthetic data")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_prefilter)
+
+    sub = subparsers.add_parser("extract", help=bench_extract.__doc__)
+    sub.add_argument("--baseline",
+                     help="a git revision of extract_subgraph.py to compare "
+                     "with, run with the driver's default fetch size")
+    sub.add_argument("--category",
+                     default=" Appliances",
+                     help="the name of the category of the stand-in graph")
+    sub.add_argument("--products",
+                     type=int,
+                     default=10000,
+                     help="the number of products of the stand-in graph")
+    sub.add_argument("--reviews",
+                     type=int,
+                     default=100000,
+                     help="the number of reviews of the stand-in graph")
+    sub.add_argument("--seed",
+                     type=int,
+                     default=0,
+                     help="the seed of the stand-in graph")
+    sub.add_argument("--latency",
+                     type=float,
+                     default=0,
+                     help="the seconds the stand-in graph waits per fetch")
+    sub.add_argument("--concurrency",
+                     type=int,
+                     nargs="+",
+                     default=[1, 4],
+                     help="the numbers of threads to run all methods on")
+    sub.add_argument("--fetch-sizes",
+                     type=int,
+                     nargs="+",
+                     default=[100, 1000, 10000],
+                     help="the fetch sizes to extract with")
+    sub.add_argument("--methods",
+                     nargs="+",
+                     help="the methods of Neo4jHandler to run, by default all")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_extract)
+
+    sub = subparsers.add_parser("load", help=bench_load.__doc__)
+    sub.add_argument("uri", help="the Bolt URI of the server")
+    sub.add_argument("--database",
+                     required=True,
+                     help="the scratch database, which is emptied")
+    sub.add_argument("--user", default="neo4j")
+    sub.add_argument("--password", default="neo4j")
+    sub.add_argument("--batch-sizes",
+                     type=int,
+                     nargs="+",
+                     default=[1000, 10000, 50000],
+                     help="the rows per transaction to load with")
+    sub.add_argument("--writers",
+                     type=int,
+                     default=4,
+                     help="the files loaded at the same time")
+    sub.add_argument("--output", help="save the results as JSON")
+    sub.set_defaults(run=bench_load)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,132 @@
+"""
+The output files of the passes, written to disk in blocks of
+WRITE_BUFFER_SIZE bytes.
+
+A row written to an output file goes to the buffer of the io module, which
+costs less than collecting the rows in Python, and the buffer is written to
+disk when full, in one write call per block instead of one per 8 KiB. The
+sinks that buffer records to clean them in batches also join the rows of a
+batch into a block per file.
+
+If NEO4J_LOADER_WRITE_THREAD is set, or with background=True, the full blocks
+are handed to a writer thread, which writes them while the pass goes on
+parsing. The thread releases the GIL in the write calls, and at most
+MAX_PENDING_BLOCKS blocks wait for it. `sync` waits for the blocks of the
+files to be written, e.g. before a checkpoint records their sizes.
+"""
+
+import io
+import os
+import queue
+import threading
+
+WRITE_BUFFER_SIZE = 1 << 20
+MAX_PENDING_BLOCKS = 16
+BACKGROUND = os.getenv("NEO4J_LOADER_WRITE_THREAD") is not None
+OPEN_FLAGS = {
+    "w": os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    "a": os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+}
+
+
+class WriterThread:
+    """ Writes the blocks of the background files of a process in order. """
+
+    def __init__(self):
+        self.queue = queue.Queue(MAX_PENDING_BLOCKS)
+        self.error = None
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            fd, block = self.queue.get()
+            try:
+                if self.error is None:
+                    view = memoryview(block)
+                    while view:
+                        view = view[os.write(fd, view):]
+            except OSError as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """ Raise the error of a failed write, in the writing thread. """
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, fd, block):
+        self.check()
+        self.queue.put((fd, block))
+
+    def wait(self):
+        """ Wait for the blocks submitted so far to be written. """
+        self.queue.join()
+        self.check()
+
+
+# the writer thread of this process, started when first needed
+_thread = None
+
+
+def writer_thread():
+    global _thread
+    # a forked worker process does not inherit the thread
+    if _thread is None or _thread.pid != os.getpid():
+        _thread = WriterThread()
+    return _thread
+
+
+class BackgroundRaw(io.RawIOBase):
+    """ A raw output file whose writes are done by the writer thread. """
+
+    def __init__(self, path, mode="w"):
+        self.fd = os.open(path, OPEN_FLAGS[mode], 0o666)
+        self.thread = writer_thread()
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, b):
+        # the buffer reuses b, so the block is copied
+        self.thread.submit(self.fd, bytes(b))
+        return len(b)
+
+    def flush(self):
+        self.thread.wait()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.thread.wait()
+            finally:
+                os.close(self.fd)
+                super().close()
+
+
+def open_output(path, mode="w", background=None):
+    """
+    Open a text output file written in blocks of WRITE_BUFFER_SIZE bytes.
+    @param mode "w" or "a".
+    @param background Whether to write the blocks on the writer thread, by
+           default if NEO4J_LOADER_WRITE_THREAD is set.
+    """
+    if background is None:
+        background = BACKGROUND
+    if not background:
+        return open(path, mode, buffering=WRITE_BUFFER_SIZE)
+    return io.TextIOWrapper(
+        io.BufferedWriter(BackgroundRaw(path, mode), WRITE_BUFFER_SIZE))
+
+
+def sync(outf):
+    """ Flush an output file and wait for its blocks to be written. """
+    outf.flush()
+    raw = getattr(getattr(outf, "buffer", None), "raw", None)
+    if isinstance(raw, BackgroundRaw):
+        raw.flush()
@@ -0,0 +1,341 @@
+"""
+Load the node and relationship CSVs of neo4j-admin import into a running
+database over Bolt, in batches of `UNWIND $rows`.
+
+The files are given like the arguments of neo4j-admin import,
+"--nodes=Label=header_and_rows.csv,rows.csv" and
+"--relationships=TYPE=a.csv,b.csv", and read the same way: the header of a
+group of files is the first line of its first file, the types of the columns
+follow the header (string by default, string[] split by ";"), empty values
+are left out and the ID columns are stored as properties when named.
+
+A relationship matches its start and end nodes by the label and property of
+their ID space, e.g. (:Brand {id}) for :END_ID(brand_id). Products and
+reviewers share the global ID space, so a relationship file of that space
+takes the label from its name, Start_type_End.csv, or from `labels`.
+
+Before the load, a uniqueness constraint is created per node label and ID
+property, which also indexes the nodes matched by the relationships. The nodes
+are merged, so that loading a file again does not duplicate them, and the
+relationships are created. The labels, then the relationship types, are loaded
+in parallel on `writers` threads, each sending its batches in a transaction
+per batch, retried on transient errors such as deadlocks.
+"""
+
+import csv
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from neo4j import GraphDatabase
+
+from utils import open_csv
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_WRITERS = 4
+# the ID space of the columns without a group
+GLOBAL_ID_SPACE = ""
+ARRAY_DELIMITER = ";"
+CONVERTERS = {
+    "string": str,
+    "int": int,
+    "long": int,
+    "short": int,
+    "byte": int,
+    "float": float,
+    "double": float,
+    "boolean": lambda value: value.lower() == "true",
+}
+NAME_CHECKER = re.compile("[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def parse_admin_args(args):
+    """
+    @param args The --nodes and --relationships arguments of neo4j-admin import.
+    @returns The (label, paths) of the nodes and (type, paths) of the
+             relationships.
+    """
+    nodes, relationships = [], []
+    for arg in args:
+        option, name, paths = arg.split("=", 2)
+        files = (name, paths.split(","))
+        if option == "--nodes":
+            nodes.append(files)
+        elif option == "--relationships":
+            relationships.append(files)
+        else:
+            raise ValueError(f"unknown import argument {arg}")
+    return nodes, relationships
+
+
+def quote_name(name):
+    """ A label, relationship type or property key as written in Cypher. """
+    return name if NAME_CHECKER.match(name) else f"`{name}`"
+
+
+class Column:
+    """ A column of the header of a neo4j-admin import file. """
+
+    def __init__(self, header):
+        self.name, _, kind = header.partition(":")
+        self.id_space = GLOBAL_ID_SPACE
+        if "(" in kind:
+            kind, self.id_space = kind[:-1].split("(", 1)
+        self.kind = kind or "string"
+        self.array = self.kind.endswith("[]")
+        convert_type = self.kind[:-2] if self.array else self.kind
+        self.convert = CONVERTERS.get(convert_type.lower(), str)
+
+    def value(self, text):
+        if self.array:
+            return [self.convert(x) for x in text.split(ARRAY_DELIMITER)]
+        return self.convert(text)
+
+
+class CsvGroup:
+    """ A group of files sharing the header of the first file. """
+
+    def __init__(self, paths, import_dir):
+        self.paths = [os.path.join(import_dir, path) for path in paths]
+        with open_csv(self.paths[0]) as inf:
+            self.columns = [Column(x) for x in next(csv.reader(inf))]
+        self.names = [os.path.basename(path) for path in paths]
+
+    def column(self, kind):
+        """ The index and column of the first column of a kind. """
+        for idx, column in enumerate(self.columns):
+            if column.kind == kind:
+                return idx, column
+        raise ValueError(f"no {kind} column in {self.names[0]}")
+
+    def lines(self):
+        """ The values of the lines, after the header. """
+        for idx, path in enumerate(self.paths):
+            with open_csv(path) as inf:
+                reader = csv.reader(inf)
+                if idx == 0:
+                    next(reader, None)
+                yield from reader
+
+    def properties(self, values):
+        """ The properties of a line, without the empty values and the unnamed or ignored columns. """
+        return {
+            column.name: column.value(text)
+            for column, text in zip(self.columns, values)
+            if text != "" and column.name and column.kind not in
+            ("START_ID", "END_ID", "IGNORE")
+        }
+
+
+def relationship_rows(group):
+    """ The {"start", "end", "properties"} of the lines of a relationship file group. """
+    start_idx, _ = group.column("START_ID")
+    end_idx, _ = group.column("END_ID")
+    for values in group.lines():
+        yield {
+            "start": values[start_idx],
+            "end": values[end_idx],
+            "properties": group.properties(values)
+        }
+
+
+def batched(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class BoltImporter:
+    """ Loads neo4j-admin import files into a running database. """
+
+    def __init__(self,
+                 uri,
+                 user,
+                 password,
+                 database=None,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 writers=DEFAULT_WRITERS):
+        """
+        @param database The database to load into, the default one if None.
+        @param batch_size The number of rows sent per transaction.
+        @param writers The number of files loaded at the same time.
+        """
+        self.driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=max(writers, 1) + 1)
+        self.database = database
+        self.batch_size = batch_size
+        self.writers = writers
+
+    def close(self):
+        self.driver.close()
+
+    def session(self):
+        return self.driver.session(database=self.database)
+
+    @staticmethod
+    def _run(tx, query, rows):
+        return tx.run(query, rows=rows).consume().counters
+
+    def write_batches(self, query, rows, name):
+        """
+        Send the rows in batches, a transaction per batch.
+        @returns The stats of the load of a file group.
+        """
+        start = time.perf_counter()
+        count = 0
+        with self.session() as session:
+            for batch in batched(rows, self.batch_size):
+                session.execute_write(self._run, query, batch)
+                count += len(batch)
+        seconds = time.perf_counter() - start
+        stats = {
+            "name": name,
+            "rows": count,
+            "batch_size": self.batch_size,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(count / seconds) if seconds > 0 else None,
+        }
+        print(", ".join(f"{k}={v}" for k, v in stats.items()))
+        return stats
+
+    def create_constraints(self, id_spaces):
+        """ A uniqueness constraint per label and ID property, which indexes them. """
+        keys = {key for labels in id_spaces.values() for key in labels.items()}
+        with self.session() as session:
+            for label, key in sorted(keys):
+                name = re.sub("[^A-Za-z0-9_]", "_", f"{label}_{key}")
+                session.run(f"CREATE CONSTRAINT {name} IF NOT EXISTS "
+                            f"FOR (n:{quote_name(label)}) "
+                            f"REQUIRE n.{quote_name(key)} IS UNIQUE").consume()
+
+    def merge_nodes(self, label, key, rows, name):
+        """
+        Merge nodes by their ID property.
+        @param rows The properties of the nodes.
+        @param name The name of the rows in the stats.
+        """
+        key = quote_name(key)
+        query = (f"UNWIND $rows AS row MERGE (n:{quote_name(label)} "
+                 f"{{{key}: row.{key}}}) SET n += row")
+        return self.write_batches(query, rows, name)
+
+    def create_relationships(self, rel_type, start, end, rows, name,
+                             merge=False):
+        """
+        @param start, end The (label, ID property) of the start and end nodes.
+        @param rows The {"start", "end", "properties"} of the relationships.
+        @param name The name of the rows in the stats.
+        @param merge Whether to merge the relationships instead of creating
+               them, so that loading them again does not duplicate them.
+        """
+        query = (
+            f"UNWIND $rows AS row "
+            f"MATCH (a:{quote_name(start[0])} {{{quote_name(start[1])}: row.start}}) "
+            f"MATCH (b:{quote_name(end[0])} {{{quote_name(end[1])}: row.end}}) "
+            f"{'MERGE' if merge else 'CREATE'} (a)-[r:{quote_name(rel_type)}]->(b) "
+            f"SET r {'+=' if merge else '='} row.properties")
+        return self.write_batches(query, rows, name)
+
+    def load_nodes(self, label, group):
+        """ Merge the nodes of a file group by their ID property. """
+        _, column = group.column("ID")
+        assert column.name, f"the ID column of {label} must be named to match it"
+        return self.merge_nodes(
+            label, column.name,
+            (group.properties(values) for values in group.lines()),
+            f"{label}={','.join(group.names)}")
+
+    def load_relationships(self, rel_type, group, start, end, merge=False):
+        """ Create, or merge, the relationships of a file group. """
+        return self.create_relationships(rel_type, start, end,
+                                         relationship_rows(group),
+                                         f"{rel_type}={','.join(group.names)}",
+                                         merge)
+
+    def load(self, nodes, relationships, import_dir, labels=None):
+        """
+        Load the nodes, then the relationships.
+        @param nodes, relationships As returned by parse_admin_args.
+        @param labels The (start label, end label) of relationship types whose
+               ID spaces have many labels, by default from their file names.
+        @returns The stats of the load of each file group.
+        """
+        labels = labels or {}
+        node_groups = [(label, CsvGroup(paths, import_dir))
+                       for label, paths in nodes]
+        # ID space to {label: ID property}
+        id_spaces = {}
+        for label, group in node_groups:
+            _, column = group.column("ID")
+            id_spaces.setdefault(column.id_space, {})[label] = column.name
+        rel_groups = []
+        for rel_type, paths in relationships:
+            group = CsvGroup(paths, import_dir)
+            name = group.names[0].removesuffix(".gz")
+            name_labels = os.path.splitext(name)[0].split("_")
+            ends = []
+            for kind, idx in [("START_ID", 0), ("END_ID", -1)]:
+                space = id_spaces.get(group.column(kind)[1].id_space, {})
+                if rel_type in labels:
+                    label = labels[rel_type][0 if idx == 0 else 1]
+                elif len(space) == 1:
+                    label = next(iter(space))
+                else:
+                    label = name_labels[idx]
+                assert label in space, (
+                    f"cannot tell the {kind} label of {group.names[0]} "
+                    f"among {sorted(space)}, pass it in labels")
+                ends.append((label, space[label]))
+            rel_groups.append((rel_type, group, ends[0], ends[1]))
+        self.create_constraints(id_spaces)
+        with ThreadPoolExecutor(self.writers) as executor:
+            stats = list(
+                executor.map(lambda x: self.load_nodes(*x), node_groups))
+            stats += list(
+                executor.map(lambda x: self.load_relationships(*x),
+                             rel_groups))
+        return stats
+
+
+def add_arguments(parser, database=None):
+    """ Add the options to load over Bolt to the parser of an import script. """
+    parser.add_argument("--bolt",
+                        metavar="URI",
+                        help="load into the running database at this URI, "
+                        "e.g. bolt://localhost:7687, instead of neo4j-admin "
+                        "import")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="neo4j")
+    parser.add_argument("--database",
+                        default=database,
+                        help="the database to load into")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help="the rows per transaction")
+    parser.add_argument("--writers",
+                        type=int,
+                        default=DEFAULT_WRITERS,
+                        help="the files loaded at the same time")
+
+
+def import_files(args, admin_args, import_dir, labels=None):
+    """
+    Load the files of the neo4j-admin import arguments with the options of
+    add_arguments.
+    @returns The stats of the load of each file group.
+    """
+    importer = BoltImporter(args.bolt, args.user, args.password,
+                            args.database, args.batch_size, args.writers)
+    try:
+        nodes, relationships = parse_admin_args(admin_args)
+        return importer.load(nodes, relationships, import_dir, labels)
+    finally:
+        importer.close()
@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+"""
+Checkpoints of the preprocessing steps, to resume after a crash.
+
+A `Manifest` in the import dir records each completed step with the size and
+modification time of its input and output files. When resuming, a step is
+skipped if the files are unchanged since it completed.
+
+Within a step, a pass over an input file whose sinks are all `resumable`
+saves a checkpoint every `checkpoint_bytes` of input, e.g. CHECKPOINT_BYTES: the byte offset of the
+next line, the lines read, the state of the sinks and the sizes of their
+flushed output files. Resuming the pass truncates the output files to those
+sizes and continues from the offset.
+"""
+
+import json
+import os
+
+from readers import is_gzip, iter_mapped_lines
+from utils import neo4j_import_dir
+
+MANIFEST_NAME = ".manifest.json"
+CHECKPOINT_BYTES = 1 << 30
+
+# the step run by `Manifest.run`, whose passes take checkpoints
+_step = None
+
+
+def fingerprint(path):
+    """ The size and modification time of a file. """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def list_files(paths):
+    """ The files of the paths, with the files in directories expanded. """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    return files
+
+
+def fingerprints(paths):
+    """ @returns The fingerprints of the files of the paths, or None if any is missing. """
+    try:
+        return {path: fingerprint(path) for path in list_files(paths)}
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path, value):
+    """ Write a JSON file atomically. """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as outf:
+        json.dump(value, outf, indent=1)
+    os.replace(tmp_path, path)
+
+
+class Manifest:
+    """ The completed preprocessing steps and their input and output files. """
+
+    def __init__(self,
+                 resume=False,
+                 checkpoint_bytes=None,
+                 output_dir=neo4j_import_dir):
+        """
+        @param resume If true, skip the completed steps and resume the passes
+               from their checkpoints. Otherwise, run all steps again.
+        @param checkpoint_bytes The input bytes between checkpoints of a pass,
+               or None to take no checkpoints.
+        """
+        self.resume = resume
+        self.checkpoint_bytes = checkpoint_bytes
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.steps = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as inf:
+                self.steps = json.load(inf)
+
+    def is_complete(self, name, inputs, outputs):
+        """ Whether the step completed with the current input and output files. """
+        entry = self.steps.get(name)
+        if entry is None:
+            return False
+        return (entry["inputs"] == fingerprints(inputs)
+                and entry["outputs"] == fingerprints(outputs))
+
+    def run(self, name, func, inputs, outputs):
+        """
+        Run a step and record it, unless it is complete and resuming.
+        @param func The function of the step, called without arguments.
+        @param inputs, outputs The files or directories the step reads and writes.
+        """
+        global _step
+        if self.resume and self.is_complete(name, inputs, outputs):
+            print(f"Skip {name}, the outputs are complete")
+            return
+        self.steps.pop(name, None)
+        write_json(self.path, self.steps)
+        _step = (self, name)
+        try:
+            func()
+        finally:
+            _step = None
+        self.steps[name] = {
+            "inputs": fingerprints(inputs),
+            "outputs": fingerprints(outputs)
+        }
+        write_json(self.path, self.steps)
+
+
+def read_lines(path, offset):
+    """ Iterate over the lines of a file from a byte offset, with the offset after each line. """
+    with open(path, "rb") as inf:
+        inf.seek(offset)
+        for line in inf:
+            offset += len(line)
+            yield offset, line.decode("utf-8")
+
+
+def get_pass_checkpoint(path, sinks):
+    """
+    @returns The `PassCheckpoint` of a pass over the input file in the current
+             step, or None if the pass cannot take checkpoints.
+    """
+    if _step is None:
+        return None
+    manifest, name = _step
+    if (manifest.checkpoint_bytes is None or is_gzip(path)
+            or not all(sink.resumable for sink in sinks)):
+        return None
+    return PassCheckpoint(manifest, name, path, sinks)
+
+
+class PassCheckpoint:
+    """ Byte-offset checkpoints of a pass over an input file. """
+
+    def __init__(self, manifest, step, path, sinks):
+        self.every = manifest.checkpoint_bytes
+        self.resume = manifest.resume
+        self.input_path = path
+        self.sinks = sinks
+        self.sink_names = [type(sink).__name__ for sink in sinks]
+        self.path = os.path.join(manifest.output_dir,
+                                 f".checkpoint.{step}.json")
+
+    def restore(self):
+        """
+        Restore the sinks from the checkpoint, before they are opened.
+        @returns The byte offset, the lines read and the state of the pass at
+                 the checkpoint, or (0, 0, None) to start from the beginning.
+        """
+        if not self.resume or not os.path.exists(self.path):
+            return 0, 0, None
+        with open(self.path, "r") as inf:
+            checkpoint = json.load(inf)
+        if (checkpoint["input"] != fingerprint(self.input_path)
+                or checkpoint["sinks"] != self.sink_names):
+            return 0, 0, None
+        for sink, sizes in zip(self.sinks, checkpoint["sizes"]):
+            for name, size in sizes.items():
+                path = os.path.join(sink.output_dir, name)
+                if not os.path.exists(path) or os.path.getsize(path) < size:
+                    return 0, 0, None
+        for sink, sizes, state in zip(self.sinks, checkpoint["sizes"],
+                                      checkpoint["states"]):
+            sink.resume_sizes = sizes
+            sink.restore_checkpoint(state)
+        print(f"Resume from line {checkpoint['lines']} of {self.input_path}")
+        return checkpoint["offset"], checkpoint["lines"], checkpoint["state"]
+
+    def save(self, offset, lines, state):
+        """ Flush the output files of the sinks and save a checkpoint. """
+        for sink in self.sinks:
+            sink.flush()
+        states = [sink.get_checkpoint() for sink in self.sinks]
+        sizes = []
+        for sink in self.sinks:
+            sink.sync_files()
+            sizes.append({
+                name: os.path.getsize(os.path.join(sink.output_dir, name))
+                for name, _ in sink.outputs
+            })
+        write_json(
+            self.path, {
+                "input": fingerprint(self.input_path),
+                "sinks": self.sink_names,
+                "offset": offset,
+                "lines": lines,
+                "state": state,
+                "states": states,
+                "sizes": sizes,
+            })
+
+    def iter_lines(self, offset, lines, state, pattern=None, skipped=None):
+        """
+        Iterate over the lines of the input file from the byte offset, saving a
+        checkpoint after every `every` bytes of lines.
+        @param lines The lines before the offset.
+        @param state The JSON state of the pass, saved with the checkpoints.
+        @param pattern, skipped If pattern is set, read the file with
+               `readers.iter_mapped_lines`, giving None for the lines it does
+               not match.
+        """
+        if pattern is None:
+            spans = read_lines(self.input_path, offset)
+        else:
+            spans = iter_mapped_lines(self.input_path, offset, None, pattern,
+                                      skipped)
+        last_offset = offset
+        for offset, line in spans:
+            # the consumer has processed the line when the next is read
+            yield line
+            lines += 1
+            if offset - last_offset >= self.every:
+                self.save(offset, lines, state)
+                last_offset = offset
+
+    def remove(self):
+        """ Remove the checkpoint when the pass is complete. """
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+"""
+Write the node and relationship tables of the import dir as Parquet or Arrow
+IPC files with typed columns, for analytics and feature pipelines that would
+otherwise parse the CSVs again.
+
+A table is a file group of neo4j-admin import, e.g. product.csv with
+missing_product.csv, or review/review_header.csv with the reviews of every
+year, and the *_2018.csv relationship files are appended to the tables of
+their types. The columns are typed by the header like neo4j-admin import types
+them (float overall, int unixReviewTime, boolean verified, string[] as a list
+of strings, ...), empty values are null, and the unnamed ID columns are named
+after their kind, e.g. :START_ID as start_id. The rows are converted and
+written in record batches of batch_size rows, so a table is never held in
+memory. The tables are written under ${NEO4J_HOME}/import/columnar/.
+
+pyarrow is only needed for this output (pip3 install pyarrow).
+
+    ./neo4j_loader/columnar.py --format parquet
+"""
+
+import argparse
+import os
+import sys
+from glob import glob
+
+from bolt_import import CsvGroup
+from utils import neo4j_import_dir
+
+FORMATS = ["csv", "parquet", "arrow"]
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+DEFAULT_BATCH_SIZE = 65536
+OUTPUT_DIR = "columnar"
+# Neo4j stores int and float properties in 64 bits
+ARROW_TYPES = {
+    "int": "int64",
+    "long": "int64",
+    "short": "int16",
+    "byte": "int8",
+    "float": "float64",
+    "double": "float64",
+    "boolean": "bool_",
+}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "the parquet and arrow outputs need pyarrow: pip3 install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def column_name(column):
+    return column.name or column.kind.lower()
+
+
+def arrow_type(pa, column):
+    """ The Arrow type of a column of a neo4j-admin header. """
+    kind = column.kind[:-2] if column.array else column.kind
+    value_type = getattr(pa, ARROW_TYPES.get(kind.lower(), "string"))()
+    return pa.list_(value_type) if column.array else value_type
+
+
+def table_groups(import_dir=neo4j_import_dir):
+    """
+    @returns The file groups of each table of the import dir, each group
+             starting with its header file, relative to the import dir.
+    """
+    tables = {}
+    for path in sorted(glob("*.csv", root_dir=import_dir)):
+        name = os.path.splitext(path)[0]
+        if name.endswith("_2018") or name == "missing_product":
+            continue
+        tables[name] = [[path]]
+        if os.path.exists(os.path.join(import_dir, f"{name}_2018.csv")):
+            tables[name].append([f"{name}_2018.csv"])
+    if "product" in tables and os.path.exists(
+            os.path.join(import_dir, "missing_product.csv")):
+        tables["product"][0].append("missing_product.csv")
+    header = os.path.join("review", "review_header.csv")
+    if os.path.exists(os.path.join(import_dir, header)):
+        tables["review"] = [[header] + sorted(
+            glob(os.path.join("review", "review[0-9]*.csv"),
+                 root_dir=import_dir))]
+    return tables
+
+
+class ColumnarWriter:
+    """ Writes the lines of a CSV file group to a Parquet or Arrow IPC file in record batches. """
+
+    def __init__(self, path, columns, output_format,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        @param columns The `bolt_import.Column`s of the header of the table.
+        @param output_format "parquet" or "arrow".
+        """
+        self.pa = import_pyarrow()
+        self.columns = columns
+        self.schema = self.pa.schema([
+            (column_name(column), arrow_type(self.pa, column))
+            for column in columns
+        ])
+        self.batch_size = batch_size
+        self.values = [[] for _ in columns]
+        self.rows = 0
+        if output_format == "parquet":
+            self.writer = self.pa.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_file(path, self.schema)
+
+    def write(self, values):
+        """ Add the values of a line, written with the next batch. """
+        for column, column_values, text in zip(self.columns, self.values,
+                                               values):
+            column_values.append(None if text == "" else column.value(text))
+        if len(self.values[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.values[0]:
+            return
+        batch = self.pa.RecordBatch.from_arrays([
+            self.pa.array(values, type=field.type)
+            for values, field in zip(self.values, self.schema)
+        ],
+                                                schema=self.schema)
+        self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+        self.values = [[] for _ in self.columns]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def write_table(groups, output_path, output_format,
+                import_dir=neo4j_import_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write a table from its file groups, typed by the header of the first group.
+    @returns The number of rows written.
+    """
+    groups = [CsvGroup(paths, import_dir) for paths in groups]
+    writer = ColumnarWriter(output_path, groups[0].columns, output_format,
+                            batch_size)
+    try:
+        for group in groups:
+            for values in group.lines():
+                writer.write(values)
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def output_paths(output_format, import_dir=neo4j_import_dir):
+    """ The output file of each table of the import dir. """
+    output_dir = os.path.join(import_dir, OUTPUT_DIR)
+    return {
+        name: os.path.join(output_dir, f"{name}.{EXTENSIONS[output_format]}")
+        for name in table_groups(import_dir)
+    }
+
+
+def write_tables(output_format, import_dir=neo4j_import_dir,
+                 batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write every table of the import dir under its columnar folder.
+    @returns The number of rows of each table.
+    """
+    assert output_format in EXTENSIONS, f"cannot write {output_format} tables"
+    os.makedirs(os.path.join(import_dir, OUTPUT_DIR), exist_ok=True)
+    paths = output_paths(output_format, import_dir)
+    rows = {}
+    for name, groups in table_groups(import_dir).items():
+        rows[name] = write_table(groups, paths[name], output_format,
+                                 import_dir, batch_size)
+        print(f"{name}: {rows[name]} rows to {paths[name]}")
+    return rows
+
+
+def main(argv=None):
+    """ Parse the command line and write the tables. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--format",
+                        choices=list(EXTENSIONS),
+                        default="parquet",
+                        help="the format of the tables")
+    parser.add_argument("--import-dir",
+                        default=neo4j_import_dir,
+                        help="the import dir written by preprocess.main")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help="the rows per record batch")
+    args = parser.parse_args(argv)
+    write_tables(args.format, args.import_dir, args.batch_size)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
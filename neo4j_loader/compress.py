@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+"""
+Compress the node and relationship files of the import dir to .csv.gz files,
+which neo4j-admin import reads as they are, and `import.py` finds in place of
+the .csv files.
+
+The files are compressed in parallel, one per worker, largest first, by a
+pigz or gzip process if one is installed, or else by zlib on a thread, which
+releases the GIL while compressing. A file is compressed to a temporary file
+that replaces the .csv file once complete, so that an interrupted run leaves
+each file either compressed or not.
+
+The passes of `preprocess.main` read back some of the files, e.g. style.csv,
+and resume from the sizes of the .csv files, so the files are compressed
+once all of them are written.
+
+    ./neo4j_loader/compress.py --workers 8
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+from utils import neo4j_import_dir
+
+COMPRESSORS = ["pigz", "gzip", "zlib"]
+DEFAULT_LEVEL = 6
+BLOCK_SIZE = 1 << 22
+
+
+def default_compressor():
+    return next(x for x in COMPRESSORS
+                if x == "zlib" or shutil.which(x) is not None)
+
+
+def output_files(import_dir=neo4j_import_dir):
+    """ The CSV files of the import dir and its review folder. """
+    return sorted(
+        glob("*.csv", root_dir=import_dir) +
+        glob(os.path.join("review", "*.csv"), root_dir=import_dir))
+
+
+def compress_file(path, compressor=None, level=DEFAULT_LEVEL):
+    """ Replace a file with its .gz file. """
+    compressor = compressor or default_compressor()
+    assert compressor in COMPRESSORS, f"unknown compressor {compressor}"
+    tmp_path = f"{path}.gz.tmp"
+    if compressor == "zlib":
+        with open(path, "rb") as inf, gzip.open(tmp_path, "wb",
+                                                compresslevel=level) as outf:
+            shutil.copyfileobj(inf, outf, BLOCK_SIZE)
+    else:
+        # one thread per file, as the files are compressed in parallel
+        threads = ["-p", "1"] if compressor == "pigz" else []
+        with open(tmp_path, "wb") as outf:
+            subprocess.run([compressor, f"-{level}", "-c"] + threads + [path],
+                           stdout=outf,
+                           check=True)
+    os.replace(tmp_path, f"{path}.gz")
+    os.remove(path)
+
+
+def compress_files(import_dir=neo4j_import_dir,
+                   workers=1,
+                   compressor=None,
+                   level=DEFAULT_LEVEL):
+    """
+    Compress the CSV files of the import dir in parallel.
+    @returns The bytes of the files before and after compression.
+    """
+    paths = sorted((os.path.join(import_dir, name)
+                    for name in output_files(import_dir)),
+                   key=os.path.getsize,
+                   reverse=True)
+    before = sum(os.path.getsize(path) for path in paths)
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+        list(
+            executor.map(lambda path: compress_file(path, compressor, level),
+                         paths))
+    after = sum(os.path.getsize(f"{path}.gz") for path in paths)
+    print(f"compressed {len(paths)} files from {before} to {after} bytes")
+    return before, after
+
+
+def main(argv=None):
+    """ Parse the command line and compress the files. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--import-dir",
+                        default=neo4j_import_dir,
+                        help="the import dir written by preprocess.main")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="the files compressed at the same time")
+    parser.add_argument("--compressor",
+                        choices=COMPRESSORS,
+                        help="by default, the first installed one")
+    parser.add_argument("--level",
+                        type=int,
+                        default=DEFAULT_LEVEL,
+                        help="the gzip compression level")
+    args = parser.parse_args(argv)
+    compress_files(args.import_dir, args.workers, args.compressor, args.level)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+"""
+JSON decoding of the input lines.
+
+The first installed backend of BACKENDS is used, and the NEO4J_LOADER_JSON
+environment variable selects one explicitly. With field projection, a decoder
+only returns the requested top-level fields of a record. The simdjson backend
+parses lazily and does not materialize the other fields, such as a long
+reviewText; the other backends return the whole record. orjson comes first
+since it decodes whole records faster than simdjson materializes the
+projected ones in `benchmark.py decode`. Lines that a fast
+backend rejects, e.g. with lone surrogate escapes, fall back to the stdlib json.
+"""
+
+import json
+import os
+
+BACKENDS = ["orjson", "simdjson", "ujson", "json"]
+
+
+def available_backends():
+    """ The installed backends in order of preference. """
+    backends = []
+    for backend in BACKENDS[:-1]:
+        try:
+            __import__(backend)
+            backends.append(backend)
+        except ImportError:
+            pass
+    return backends + ["json"]
+
+
+def default_backend():
+    """ The backend selected by NEO4J_LOADER_JSON, or the fastest installed one. """
+    backend = os.getenv("NEO4J_LOADER_JSON")
+    if backend is None:
+        return available_backends()[0]
+    assert backend in BACKENDS, f"NEO4J_LOADER_JSON must be one of {BACKENDS}"
+    return backend
+
+
+def merge_fields(field_sets):
+    """
+    Combine the fields needed by several consumers.
+    @param field_sets Iterable of field tuples, None meaning all fields.
+    @returns The union of the fields, or None if any consumer needs all fields.
+    """
+    merged = set()
+    for fields in field_sets:
+        if fields is None:
+            return None
+        merged.update(fields)
+    return tuple(sorted(merged))
+
+
+def _to_python(value):
+    """ Convert a lazy simdjson value to Python objects. """
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    if hasattr(value, "as_list"):
+        return value.as_list()
+    return value
+
+
+def get_decoder(fields=None, backend=None):
+    """
+    @param fields The top-level fields to return, or None for all fields.
+    @param backend One of BACKENDS, by default `default_backend()`.
+    @returns A function that decodes a line into a dict.
+    """
+    backend = backend or default_backend()
+    assert backend in BACKENDS, f"unknown JSON backend {backend}"
+    if backend == "json":
+        return json.loads
+    if backend == "simdjson":
+        import simdjson
+        parser = simdjson.Parser()
+
+        def decode_simdjson(line):
+            try:
+                doc = parser.parse(
+                    line.encode("utf-8") if isinstance(line, str) else line)
+                if fields is None:
+                    return doc.as_dict()
+                return {
+                    field: _to_python(doc[field])
+                    for field in fields if field in doc
+                }
+            except ValueError:
+                return json.loads(line)
+
+        return decode_simdjson
+    module = __import__(backend)
+
+    def decode(line):
+        try:
+            return module.loads(line)
+        except ValueError:
+            return json.loads(line)
+
+    return decode
@@ -0,0 +1,307 @@
+#! /usr/bin/env python3
+"""
+Apply the reviews of 2018, which import.py leaves out, or a later delta dump
+to a running graph imported from the import dir, over Bolt.
+
+A delta is a group of Review node files with the isWrittenBy, refersTo and
+rates files of their reviews, like review/review2018.csv and the *_2018.csv
+files written by `preprocess.main`. A delta dump is a directory written by
+`preprocess.main` on newer data, all of whose reviews are applied. The nodes
+that the delta refers to and that are not in the node files of the base
+import are added:
+    * the reviewers not in reviewers.csv, which is sorted by reviewer id, by
+      merging it with the sorted reviewers of the delta
+    * the products not in product.csv or missing_product.csv, with the
+      properties of the product files of a dump, if any
+    * the styles of a dump whose keys are not in the graph, with ids after
+      those in the graph; the style ids of a dump are mapped to them by key
+The review ids of a dump restart from those of the base, so they are given a
+prefix, e.g. "D1". Every write merges on the node ids and the relationship
+ends, in the batched transactions of `bolt_import.BoltImporter`, so that a
+delta can be applied again, e.g. after a failure, without duplicates.
+
+    ./neo4j_loader/delta_import.py bolt://localhost:7687
+    ./neo4j_loader/delta_import.py bolt://localhost:7687 --dump /path/to/import --review-id-prefix D1
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+from asin_set import new_asin_set
+from bolt_import import (BoltImporter, CsvGroup, DEFAULT_BATCH_SIZE,
+                         DEFAULT_WRITERS, relationship_rows)
+from extract_subgraph_csv import iter_rows
+from node_index import NodeIndex
+from utils import csv_path, neo4j_import_dir, open_csv
+
+# relationship type to the name of its files and its end node (label, ID property)
+DELTA_RELATIONSHIPS = {
+    "isWrittenBy": ("Review_isWrittenBy_Reviewer", ("Reviewer", "reviewerID")),
+    "refersTo": ("Review_refersTo_Style", ("Style", "id")),
+    "rates": ("Review_rates_Product", ("Product", "asin")),
+}
+REVIEW = ("Review", "id")
+STYLE_KEY_COL = "key:string"
+STYLE_ID_COL = "id:ID(style_id)"
+
+
+class Delta:
+    """ The files of a delta, relative to its directory. """
+
+    def __init__(self, directory, review_files, relationship_files):
+        """
+        @param review_files The Review node files, after the header file.
+        @param relationship_files The files of each of DELTA_RELATIONSHIPS,
+               each with its header.
+        """
+        self.directory = directory
+        self.review_files = review_files
+        self.relationship_files = relationship_files
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def group(self, paths):
+        return CsvGroup(paths, self.directory)
+
+    def relationship_rows(self, rel_type):
+        for path in self.relationship_files[rel_type]:
+            yield from relationship_rows(self.group([path]))
+
+
+def increment(import_dir=neo4j_import_dir, year=2018):
+    """ The reviews of a year that import.py leaves out. """
+    return Delta(
+        import_dir,
+        [os.path.join("review", "review_header.csv"),
+         os.path.join("review", f"review{year}.csv")],
+        {
+            rel_type: [f"{name}_{year}.csv"]
+            for rel_type, (name, _) in DELTA_RELATIONSHIPS.items()
+        })
+
+
+def dump(directory):
+    """ All reviews of an import dir written by `preprocess.main`. """
+    # the names of the .csv.gz files of a compressed dir, which open_csv finds
+    review_files = sorted({
+        path.removesuffix(".gz")
+        for pattern in ["review[0-9]*.csv", "review[0-9]*.csv.gz"]
+        for path in glob(os.path.join("review", pattern), root_dir=directory)
+    })
+    relationship_files = {}
+    for rel_type, (name, _) in DELTA_RELATIONSHIPS.items():
+        relationship_files[rel_type] = [
+            path for path in [f"{name}.csv", f"{name}_2018.csv"]
+            if os.path.exists(csv_path(os.path.join(directory, path)))
+        ]
+    return Delta(directory,
+                 [os.path.join("review", "review_header.csv")] + review_files,
+                 relationship_files)
+
+
+class DeltaImporter:
+    """ Applies deltas to the graph imported from a base import dir. """
+
+    def __init__(self, importer, base_dir=neo4j_import_dir):
+        self.importer = importer
+        self.base_dir = base_dir
+
+    def base_path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def end_ids(self, delta, rel_type):
+        """ The distinct end node ids of the relationships of a type. """
+        return {row["end"] for row in delta.relationship_rows(rel_type)}
+
+    def new_reviewers(self, delta, reviewer_ids):
+        """ The properties of the reviewers not in the base reviewers.csv. """
+        new = set()
+        ids = iter(sorted(reviewer_ids))
+        current = next(ids, None)
+        for base_id, in iter_rows(self.base_path("reviewers.csv"), columns=1):
+            while current is not None and current < base_id:
+                new.add(current)
+                current = next(ids, None)
+            if current == base_id:
+                current = next(ids, None)
+            if current is None:
+                break
+        if current is not None:
+            new.add(current)
+            new.update(ids)
+        return self.node_rows(delta, ["reviewers.csv"], "reviewerID", new)
+
+    def new_products(self, delta, asins):
+        """ The properties of the products not in the base product files. """
+        base = new_asin_set()
+        for name in ["product.csv", "missing_product.csv"]:
+            if os.path.exists(csv_path(self.base_path(name))):
+                with open_csv(self.base_path(name), newline=None) as inf:
+                    for line in inf:
+                        base.add(line.split(",", 1)[0])
+        new = {asin for asin in asins if asin not in base}
+        return self.node_rows(delta, ["product.csv"], "asin", new)
+
+    def node_rows(self, delta, names, key, ids):
+        """
+        The properties of the nodes of ids, from the node files of a dump, or
+        only their ids for the nodes not in those files, like the products of
+        missing_product.csv.
+        """
+        rows = {}
+        if delta.directory != self.base_dir:
+            for name in names:
+                if not os.path.exists(csv_path(delta.path(name))):
+                    continue
+                group = delta.group([name])
+                rows_iter = (group.properties(values)
+                             for values in group.lines())
+                for row in rows_iter:
+                    if row.get(key) in ids:
+                        rows.setdefault(row[key], row)
+        for node_id in ids:
+            rows.setdefault(node_id, {key: node_id})
+        return list(rows.values())
+
+    def style_ids(self, delta):
+        """
+        The styles of a dump are matched by key with the styles in the graph,
+        which may include those of the dumps applied before.
+        @returns The base id of each style id of the delta, and the properties
+                 of the new styles.
+        """
+        if delta.directory == self.base_dir:
+            base = NodeIndex(self.base_path("style.csv"), STYLE_KEY_COL,
+                             STYLE_ID_COL)
+            return {node_id: node_id for node_id in base.ids.values()}, []
+        with self.importer.session() as session:
+            base = {
+                record["key"]: record["id"]
+                for record in session.run(
+                    "MATCH (s:Style) RETURN s.key AS key, s.id AS id")
+            }
+        width = max((len(x) for x in base.values()), default=1)
+        next_id = max((int(x) for x in base.values()), default=-1) + 1
+        ids, new = {}, []
+        delta_styles = NodeIndex(delta.path("style.csv"), STYLE_KEY_COL,
+                                 STYLE_ID_COL)
+        for key, delta_id in delta_styles.ids.items():
+            if key not in base:
+                base[key] = str(next_id).zfill(width)
+                next_id += 1
+                new.append({"id": base[key], "key": key})
+            ids[delta_id] = base[key]
+        return ids, new
+
+    def apply(self, delta, review_id_prefix=""):
+        """
+        Merge the new nodes, the reviews and their relationships of a delta.
+        @param review_id_prefix Prepended to the review ids of the delta.
+        @returns The stats of each write.
+        """
+        start = time.perf_counter()
+        ends = {label: key for _, (_, (label, key)) in DELTA_RELATIONSHIPS.items()}
+        ends[REVIEW[0]] = REVIEW[1]
+        self.importer.create_constraints({"": ends})
+        style_ids, new_styles = self.style_ids(delta)
+        new_nodes = [
+            ("Reviewer", "reviewerID",
+             self.new_reviewers(delta, self.end_ids(delta, "isWrittenBy"))),
+            ("Product", "asin",
+             self.new_products(delta, self.end_ids(delta, "rates"))),
+            ("Style", "id", new_styles),
+        ]
+        for label, _, rows in new_nodes:
+            print(f"{len(rows)} new {label} nodes")
+        reviews = delta.group(delta.review_files)
+        _, review_column = reviews.column("ID")
+
+        def review_rows():
+            for values in reviews.lines():
+                row = reviews.properties(values)
+                row[review_column.name] = review_id_prefix + row[
+                    review_column.name]
+                yield row
+
+        def delta_relationships(rel_type):
+            for row in delta.relationship_rows(rel_type):
+                row["start"] = review_id_prefix + row["start"]
+                if rel_type == "refersTo":
+                    row["end"] = style_ids[row["end"]]
+                yield row
+
+        with ThreadPoolExecutor(self.importer.writers) as executor:
+            stats = list(
+                executor.map(
+                    lambda x: self.importer.merge_nodes(
+                        x[0], x[1], x[2], f"new {x[0]}"), new_nodes))
+            stats.append(
+                self.importer.merge_nodes(REVIEW[0], REVIEW[1], review_rows(),
+                                          ",".join(reviews.names)))
+            rel_types = [
+                rel_type for rel_type, paths in delta.relationship_files.items()
+                if paths
+            ]
+            stats += list(
+                executor.map(
+                    lambda rel_type: self.importer.create_relationships(
+                        rel_type, REVIEW, DELTA_RELATIONSHIPS[rel_type][1],
+                        delta_relationships(rel_type), ",".join(
+                            delta.relationship_files[rel_type]), True),
+                    rel_types))
+        seconds = time.perf_counter() - start
+        rows = sum(x["rows"] for x in stats)
+        print(f"applied {rows} rows in {seconds:.1f}s, "
+              f"{rows / seconds:.0f} rows/sec")
+        return stats
+
+
+def main(argv=None):
+    """ Parse the command line and apply a delta. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("uri", help="the Bolt URI of the server")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="neo4j")
+    parser.add_argument("--database", help="the database to apply it to")
+    parser.add_argument("--base-dir",
+                        default=neo4j_import_dir,
+                        help="the import dir of the imported graph")
+    parser.add_argument("--year",
+                        type=int,
+                        default=2018,
+                        help="the year of the increment in the base import dir")
+    parser.add_argument("--dump",
+                        help="apply all reviews of this import dir instead")
+    parser.add_argument("--review-id-prefix",
+                        default="",
+                        help="prepended to the review ids of the delta")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help="the rows per transaction")
+    parser.add_argument("--writers",
+                        type=int,
+                        default=DEFAULT_WRITERS,
+                        help="the files applied at the same time")
+    args = parser.parse_args(argv)
+    if args.dump is not None:
+        assert args.review_id_prefix, "a dump needs a --review-id-prefix"
+        delta = dump(args.dump)
+    else:
+        delta = increment(args.base_dir, args.year)
+    importer = BoltImporter(args.uri, args.user, args.password, args.database,
+                            args.batch_size, args.writers)
+    try:
+        DeltaImporter(importer, args.base_dir).apply(delta,
+                                                     args.review_id_prefix)
+    finally:
+        importer.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
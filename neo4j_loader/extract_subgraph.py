@@ -1,10 +1,52 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from neo4j import GraphDatabase
+from same_rates import write_groups, write_same_rates
 from utils import *
 
+# the number of records the driver fetches at a time, which bounds the
+# records buffered by the client
+DEFAULT_FETCH_SIZE = 1000
+# the number of extractions run at the same time by execute_all
+DEFAULT_CONCURRENCY = 4
+EXTRACTIONS = [
+    "_extract_product", "_extract_reviewer", "_extract_product_to_product",
+    "_extract_usu", "_extract_itemprod"
+]
+
+
+def output_path(category, name):
+    """ The path of an output file of a category, creating its folder. """
+    path = os.path.join(neo4j_import_dir, "subgraph", category[1:], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
 class Neo4jHandler:
-    def __init__(self, uri, user, password):
+    """
+    Extracts the subgraph of a category to CSV files. The queries only
+    return the properties written to the files, with DISTINCT where rows
+    repeat, and the records are written as they are fetched, so the client
+    holds at most fetch_size records at a time. The queries start from the
+    category, found by the index of create_category_index.
+    """
+
+    def __init__(self,
+                 uri,
+                 user,
+                 password,
+                 fetch_size=DEFAULT_FETCH_SIZE,
+                 workers=1,
+                 max_group_size=None):
+        """
+        @param workers The number of processes, and shards, building the usu edges.
+        @param max_group_size If not None, the usu edges of a product and rating
+               are built from a sample of this many of its reviews.
+        """
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        self.fetch_size = fetch_size
+        self.workers = workers
+        self.max_group_size = max_group_size
 
     def close(self):
         self.driver.close()
@@ -12,9 +54,49 @@ class Neo4jHandler:
     def eval(self, fn_name):
         return eval(f"self.{fn_name}")
 
+    def read(self, fn_name, category):
+        """ Run an extraction in a read transaction, which the driver may retry. """
+        with self.driver.session(fetch_size=self.fetch_size) as session:
+            return session.execute_read(self.eval(fn_name), category)
+
+    def finish(self, fn_name, result):
+        """
+        Finish an extraction from the result of its transaction, e.g. build the
+        usu edges of the groups written by _extract_usu on worker processes.
+        """
+        if fn_name == "_extract_usu":
+            groups_path, path = result
+            write_same_rates(groups_path, path, self.workers,
+                             self.max_group_size)
+
     def execute(self, fn_name, category):
+        self.finish(fn_name, self.read(fn_name, category))
+
+    def execute_all(self,
+                    categories,
+                    fn_names=EXTRACTIONS,
+                    concurrency=DEFAULT_CONCURRENCY):
+        """
+        Run the extractions of the categories at the same time, each in its own
+        session on one of concurrency threads. The driver releases the GIL
+        while it waits for records, so that the rows of an extraction are
+        formatted and written while the others fetch. The extractions are
+        finished once the threads are done, so that the usu workers are not
+        forked while other threads use the driver.
+        """
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = [(fn_name, executor.submit(self.read, fn_name, category))
+                       for category in categories for fn_name in fn_names]
+            results = [(fn_name, future.result())
+                       for fn_name, future in futures]
+        for fn_name, result in results:
+            self.finish(fn_name, result)
+
+    def create_category_index(self):
+        """ Index the categories by name, where the queries start. """
         with self.driver.session() as session:
-            session.execute_read(self.eval(fn_name), category)
+            session.run("CREATE INDEX category_name IF NOT EXISTS "
+                        "FOR (c:Category) ON (c.name)").consume()
 
     @staticmethod
     def _extract_product(tx, category):
@@ -25,32 +107,22 @@ class Neo4jHandler:
             tx: neo4j transaction
             category: category name
         """
-        result = tx.run("MATCH (p: Product)-[:belongsTo]->(c:Category {name: $category})" 
-                        "RETURN p", category=category)
+        result = tx.run("MATCH (p: Product)-[:belongsTo]->(c:Category {name: $category}) "
+                        "RETURN DISTINCT p.asin AS asin, p.description AS description, "
+                        "p.price AS price, p.rank AS rank", category=category)
 
-        output_folder = os.path.join(neo4j_import_dir, "subgraph", category[1:])
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-        output_path = os.path.join(output_folder, "product.csv")
-        distinct = set()
-        with open(output_path, "w") as outf:
+        with open(output_path(category, "product.csv"), "w") as outf:
             outf.write(
                 "asin:ID,description:string[],price:string,rank:string\n")
-            for record in result:
-                j = dict(record["p"])
-                asin = j["asin"]
-                description = j["description"] if "description" in j else [""]
+            for asin, description, price, rank in result:
                 description = [
-                    desc.strip() for desc in description
+                    desc.strip() for desc in description or []
                     if len(desc.strip()) > 0
                 ]
                 description = "; ".join(description)
                 description = escape_comma_newline(description)
-                price = escape_comma_newline(j["price"]) if "price" in j else ""
-                rank = escape_comma_newline(j["rank"]) if "rank" in j else ""
-                distinct.add((asin, description, price, rank))
-
-            for asin, description, price, rank in distinct:
+                price = escape_comma_newline(price) if price is not None else ""
+                rank = escape_comma_newline(rank) if rank is not None else ""
                 outf.write(f"{asin},{description},{price},{rank}\n")
 
     @staticmethod
@@ -62,23 +134,13 @@ class Neo4jHandler:
             tx: neo4j transaction
             category: category name
         """
-        result = tx.run("MATCH (r:Reviewer)<-[:isWrittenBy]-(:Review)-[:rates]->(p:Product)-[:belongsTo]->(c:Category {name: $category})" 
-                        "RETURN r", category=category)
+        result = tx.run("MATCH (r:Reviewer)<-[:isWrittenBy]-(:Review)-[:rates]->(p:Product)-[:belongsTo]->(c:Category {name: $category}) "
+                        "RETURN DISTINCT r.reviewerID AS reviewerID, r.name AS name", category=category)
 
-        output_folder = os.path.join(neo4j_import_dir, "subgraph", category[1:])
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-        output_path = os.path.join(output_folder, "reviewers.csv")
-        distinct = set()
-        with open(output_path, "w") as outf:
+        with open(output_path(category, "reviewers.csv"), "w") as outf:
             outf.write("reviewerID:ID,name:string\n")
-            for record in result:
-                j = dict(record["r"])
-                id = j["reviewerID"]
-                name = escape_comma_newline(j['name']) if 'name' in j else ''
-                distinct.add((id, name))
-
-            for id, name in distinct:
+            for id, name in result:
+                name = escape_comma_newline(name) if name is not None else ''
                 outf.write(f"{id},{name}\n")
 
     @staticmethod
@@ -92,25 +154,16 @@ class Neo4jHandler:
         """
         relations = ["isSimilarTo", "alsoBuy", "alsoView"]
         cypher_query = {
-            "isSimilarTo": "MATCH (:Category {name: $category})<-[:belongsTo]-(p1:Product)-[r:isSimilarTo]->(p2:Product)-[:belongsTo]->(:Category {name: $category}) RETURN DISTINCT p1, p2",
-            "alsoBuy": "MATCH (:Category {name: $category})<-[:belongsTo]-(p1:Product)-[r:alsoBuy]->(p2:Product)-[:belongsTo]->(:Category {name: $category}) RETURN DISTINCT p1, p2",
-            "alsoView": "MATCH (:Category {name: $category})<-[:belongsTo]-(p1:Product)-[r:alsoView]->(p2:Product)-[:belongsTo]->(:Category {name: $category}) RETURN DISTINCT p1, p2"
+            "isSimilarTo": "MATCH (:Category {name: $category})<-[:belongsTo]-(p1:Product)-[r:isSimilarTo]->(p2:Product)-[:belongsTo]->(:Category {name: $category}) RETURN DISTINCT p1.asin AS asin1, p2.asin AS asin2",
+            "alsoBuy": "MATCH (:Category {name: $category})<-[:belongsTo]-(p1:Product)-[r:alsoBuy]->(p2:Product)-[:belongsTo]->(:Category {name: $category}) RETURN DISTINCT p1.asin AS asin1, p2.asin AS asin2",
+            "alsoView": "MATCH (:Category {name: $category})<-[:belongsTo]-(p1:Product)-[r:alsoView]->(p2:Product)-[:belongsTo]->(:Category {name: $category}) RETURN DISTINCT p1.asin AS asin1, p2.asin AS asin2"
             }
         for relation in relations:
             result = tx.run(cypher_query[relation], category=category)
 
-            output_folder = os.path.join(neo4j_import_dir, "subgraph", category[1:])
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            output_path = os.path.join(output_folder, 
-                                f"Product_{relation}_Product.csv")
-            with open(output_path, "w") as outf:
+            with open(output_path(category, f"Product_{relation}_Product.csv"), "w") as outf:
                 outf.write(":START_ID,:END_ID\n")
-                for record in result:
-                    j_p1 = dict(record["p1"])
-                    j_p2 = dict(record["p2"])
-                    asin1 = j_p1["asin"]
-                    asin2 = j_p2["asin"]
+                for asin1, asin2 in result:
                     outf.write(f"{asin1},{asin2}\n")
 
     @staticmethod
@@ -119,25 +172,25 @@ class Neo4jHandler:
         The function extracts all edges of types "sameRates" that 
         belong to the specified category, and exports the data to a CSV file.
         The "sameRates" edge type links Reviewers who have given at least one common star rating.
+        The reviewers of the reviews of each product are grouped by rating in
+        the query, leaving out the reviews without a rating, and written to a
+        groups file, whose edges are built by `same_rates` in `finish`, after
+        the transaction.
         Parameters:
             tx: neo4j transaction
             category: category name
+        Returns:
+            the paths of the groups file and of the usu file
         """
-        result = tx.run("MATCH (u1: Reviewer)<-[:isWrittenBy]-(r1:Review)-[:rates]->(:Product)<-[:rates]-(r2:Review)-[:isWrittenBy]->(u2: Reviewer) WHERE r1.overall=r2.overall RETURN DISTINCT u1, u2")
-
-        output_folder = os.path.join(neo4j_import_dir, "subgraph", category[1:], "v1")
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-        output_path = os.path.join(output_folder, 
-                               "User_usu_User.csv")
-        with open(output_path, "w") as outf:
-            outf.write(":START_ID,:END_ID\n")
-            for record in result:
-                j_u1 = dict(record["u1"])
-                j_u2 = dict(record["u2"])
-                user1_id = j_u1["reviewerID"]
-                user2_id = j_u2["reviewerID"]
-                outf.write(f"{user1_id},{user2_id}\n")
+        result = tx.run("MATCH (:Category {name: $category})<-[:belongsTo]-(p:Product)<-[:rates]-(r:Review)-[:isWrittenBy]->(u:Reviewer) "
+                        "WHERE r.overall IS NOT NULL "
+                        "WITH p, r.overall AS overall, collect(u.reviewerID) AS reviewers WHERE size(reviewers) > 1 "
+                        "RETURN reviewers", category=category)
+
+        path = output_path(category, os.path.join("v1", "User_usu_User.csv"))
+        groups_path = path + ".groups"
+        write_groups((record[0] for record in result), groups_path)
+        return groups_path, path
 
     @staticmethod
     def _extract_itemprod(tx, category):
@@ -149,28 +202,16 @@ class Neo4jHandler:
             tx: neo4j transaction
             category: category name
         """
-        result = tx.run("MATCH (u: Reviewer)<-[:isWrittenBy]-(: Review)-[:rates]->(p: Product) RETURN u, p")
-
-        output_folder = os.path.join(neo4j_import_dir, "subgraph", category[1:], "v1")
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
+        result = tx.run("MATCH (:Category {name: $category})<-[:belongsTo]-(p:Product)<-[:rates]-(r:Review)-[:isWrittenBy]->(u:Reviewer) "
+                        "RETURN u.reviewerID AS user_id, p.asin AS product_id, r.overall AS overall", category=category)
 
-        output_path = os.path.join(output_folder,
-                                 "User_itemprod_Product.csv")
-        with open(output_path, "w") as outf:   
-            outf.write(":START_ID,:END_ID\n")
-            for record in result:
-                j_u = dict(record["u"])
-                j_p = dict(record["p"])
-                user_id = j_u["reviewerID"]
-                product_id = j_p["asin"]
-                outf.write(f"{user_id},{product_id}\n")
+        with open(output_path(category, os.path.join("v1", "User_itemprod_Product.csv")), "w") as outf:
+            outf.write(":START_ID,:END_ID,overall:float\n")
+            for user_id, product_id, overall in result:
+                outf.write(f"{user_id},{product_id},{'' if overall is None else overall}\n")
 
 if __name__ == "__main__":
     client = Neo4jHandler("bolt://localhost:7687", "neo4j", "neo4j")
-    client.execute("_extract_product", " Appliances")
-    client.execute("_extract_reviewer", " Appliances")
-    client.execute("_extract_product_to_product", " Appliances")
-    client.execute("_extract_usu", " Appliances")
-    client.execute("_extract_itemprod", " Appliances")
+    client.create_category_index()
+    client.execute_all([" Appliances"])
     client.close()
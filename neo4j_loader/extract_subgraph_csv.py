@@ -0,0 +1,406 @@
+#! /usr/bin/env python3
+"""
+Extract the subgraphs of categories from the import CSVs, without Neo4j.
+
+The outputs are those of `extract_subgraph.Neo4jHandler`, in
+${NEO4J_HOME}/import/subgraph/<category>/ for each category:
+    * product.csv, reviewers.csv
+    * Product_{isSimilarTo,alsoBuy,alsoView}_Product.csv
+    * v1/User_itemprod_Product.csv, v1/User_usu_User.csv
+
+Any number of categories, or all of them, are extracted together, and each
+file written by `preprocess.main` is scanned once for all of them:
+    1. Product_belongsTo_Category.csv gives the categories of the products.
+    2. product.csv and the product-product files are partitioned by the
+       categories of the products.
+    3. Review_rates_Product.csv is partitioned by the categories of the rated
+       products, joined in order with Review_isWrittenBy_Reviewer.csv and the
+       Review node files, which are written in the same review order.
+    4. The partitions are finished in parallel: the duplicate edges are
+       removed where the Cypher queries use DISTINCT, the reviews are grouped
+       by product and rating and the reviewers of each category are
+       collected. The usu edges of the groups are then built in parallel over
+       the shards of every category, as in `same_rates`.
+    5. reviewers.csv, sorted by reviewer id, is merged with the sorted
+       reviewers of all categories.
+Like the imported graph, the reviews of 2018 are excluded. Rows are written
+in the order of the input files.
+
+    ./neo4j_loader/extract_subgraph_csv.py " Appliances" "Books"
+    ./neo4j_loader/extract_subgraph_csv.py all --workers 8
+"""
+
+import argparse
+import heapq
+import os
+import sys
+from collections import deque
+from multiprocessing import Pool
+
+from node_index import category_name, load_category_index
+from same_rates import merge_shards, shard_tasks, write_groups, write_shard
+from utils import neo4j_import_dir, open_csv
+
+ALL_CATEGORIES = "all"
+PRODUCT_TO_PRODUCT = ["isSimilarTo", "alsoBuy", "alsoView"]
+# the years of the Review node files, indexed like the review years of the ids
+REVIEW_FILE_YEARS = range(1996, 2019)
+# the intermediate files of a partition, removed when it is finished
+REVIEWS_NAME = ".reviews.csv"
+REVIEWERS_NAME = ".reviewers.txt"
+GROUPS_NAME = ".usu_groups.txt"
+
+
+def iter_rows(path, columns=2, header=True):
+    """
+    Iterate over the first columns of the rows of a CSV file, or of its .gz
+    file, after the header if any. The columns must not be quoted.
+    """
+    with open_csv(path, newline=None) as inf:
+        if header:
+            inf.readline()
+        for line in inf:
+            yield line.rstrip("\n").split(",", columns)[:columns]
+
+
+def review_key(review_id):
+    """ The year and line count of a review id, R{year}{line count of the year}. """
+    return review_id[1:5], int(review_id[5:])
+
+
+class ReviewLookup:
+    """
+    Values by review id, from the rows of a file written in review file order
+    and looked up in the same order. The line counts of the ids of a year
+    increase in review file order, so the rows are read ahead until the line
+    count of the review id is reached, skipping the reviews not looked up.
+    """
+
+    def __init__(self, rows):
+        """ @param rows The (review id, value) rows in review file order. """
+        self.rows = iter(rows)
+        # the rows read ahead by year, as (line count, value)
+        self.pending = {}
+
+    def get(self, review_id):
+        """ @returns The value of the review, or None if it has no row. """
+        year, count = review_key(review_id)
+        queue = self.pending.setdefault(year, deque())
+        while True:
+            while queue:
+                if queue[0][0] > count:
+                    return None
+                row_count, value = queue.popleft()
+                if row_count == count:
+                    return value
+            row = next(self.rows, None)
+            if row is None:
+                return None
+            row_year, row_count = review_key(row[0])
+            self.pending.setdefault(row_year, deque()).append(
+                (row_count, row[1]))
+
+
+class CategoryPartition:
+    """ The output files of the subgraph of a category. """
+
+    def __init__(self, name, category_id, output_dir):
+        self.name = name
+        self.category_id = category_id
+        self.output_dir = output_dir
+        self.files = {}
+
+    def output_path(self, name):
+        path = os.path.join(self.output_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def open_file(self, name, header):
+        outf = open(self.output_path(name), "w")
+        if header is not None:
+            outf.write(header)
+        self.files[name] = outf
+        return outf
+
+    def close_files(self):
+        for outf in self.files.values():
+            outf.close()
+        self.files = {}
+
+
+def finish_partition(output_dir):
+    """
+    Finish the outputs of a partition after the scans: remove the duplicate
+    product-product edges, write the groups of the usu edges and the sorted
+    reviewer ids.
+    @returns The number of distinct reviewers of the partition.
+    """
+    for relation in PRODUCT_TO_PRODUCT:
+        path = os.path.join(output_dir, f"Product_{relation}_Product.csv")
+        with open(path, "r") as inf:
+            lines = inf.readlines()
+        with open(path, "w") as outf:
+            outf.writelines(dict.fromkeys(lines))
+    # the reviewers of the reviews of a product with the same rating
+    groups = {}
+    reviews_path = os.path.join(output_dir, REVIEWS_NAME)
+    for asin, overall, reviewer_id in iter_rows(reviews_path,
+                                                columns=3,
+                                                header=False):
+        groups.setdefault((asin, overall), []).append(reviewer_id)
+    os.remove(reviews_path)
+    write_groups(groups.values(), os.path.join(output_dir, GROUPS_NAME))
+    reviewers = sorted({
+        reviewer_id for reviewer_id, _ in iter_rows(
+            os.path.join(output_dir, "v1", "User_itemprod_Product.csv"))
+    })
+    with open(os.path.join(output_dir, REVIEWERS_NAME), "w") as outf:
+        for reviewer_id in reviewers:
+            outf.write(reviewer_id + "\n")
+    print(f"output to {output_dir}")
+    return len(reviewers)
+
+
+class SubgraphExtractor:
+    """ The subgraphs of categories, partitioned from the import CSVs. """
+
+    def __init__(self,
+                 categories,
+                 import_dir=neo4j_import_dir,
+                 workers=1,
+                 max_group_size=None):
+        """
+        @param categories The category names, with or without the surrounding
+               spaces of the Neo4j extractor, e.g. " Appliances", or "all".
+        @param import_dir The directory of the files written by `preprocess.main`.
+        @param workers The number of processes finishing the partitions, which
+               is also the number of shards of the usu edges of a partition.
+        @param max_group_size If not None, the usu edges of a product and rating
+               are built from a sample of this many of its reviews.
+        """
+        self.import_dir = import_dir
+        self.workers = workers
+        self.max_group_size = max_group_size
+        index = load_category_index(os.path.join(import_dir, "category.csv"))
+        if categories == ALL_CATEGORIES or ALL_CATEGORIES in categories:
+            categories = [
+                name for _, name in iter_rows(
+                    os.path.join(import_dir, "category.csv"))
+            ]
+        self.partitions = []
+        for name in dict.fromkeys(category_name(x) for x in categories):
+            self.partitions.append(
+                CategoryPartition(
+                    name, index.get_id(name, "category to extract"),
+                    os.path.join(import_dir, "subgraph", name)))
+        # asin to the indexes of the partitions of the product, as a tuple
+        self.product_partitions = None
+
+    def input_path(self, name):
+        return os.path.join(self.import_dir, name)
+
+    def load_product_partitions(self):
+        """ The partitions of the products, most of which have one category. """
+        if self.product_partitions is None:
+            partition_idx = {
+                partition.category_id: idx
+                for idx, partition in enumerate(self.partitions)
+            }
+            # share the tuple of a single partition between the products
+            singles = {idx: (idx, ) for idx in partition_idx.values()}
+            self.product_partitions = {}
+            for asin, end_id in iter_rows(
+                    self.input_path("Product_belongsTo_Category.csv")):
+                idx = partition_idx.get(end_id)
+                if idx is None:
+                    continue
+                partitions = self.product_partitions.get(asin)
+                if partitions is None:
+                    self.product_partitions[asin] = singles[idx]
+                elif idx not in partitions:
+                    self.product_partitions[asin] = partitions + (idx, )
+            print(f"{len(self.product_partitions)} products in "
+                  f"{len(self.partitions)} categories")
+        return self.product_partitions
+
+    def extract_product(self):
+        """ product.csv of the products of each category. """
+        product_partitions = self.load_product_partitions()
+        with open_csv(self.input_path("product.csv"), newline=None) as inf:
+            header = inf.readline()
+            outputs = [
+                partition.open_file("product.csv", header)
+                for partition in self.partitions
+            ]
+            for line in inf:
+                for idx in product_partitions.get(line.split(",", 1)[0], ()):
+                    outputs[idx].write(line)
+
+    def extract_product_to_product(self):
+        """ The product-product edges between products of the same category. """
+        product_partitions = self.load_product_partitions()
+        for relation in PRODUCT_TO_PRODUCT:
+            name = f"Product_{relation}_Product.csv"
+            outputs = [
+                partition.open_file(name, ":START_ID,:END_ID\n")
+                for partition in self.partitions
+            ]
+            for asin1, asin2 in iter_rows(self.input_path(name)):
+                partitions1 = product_partitions.get(asin1)
+                if partitions1 is None:
+                    continue
+                partitions2 = product_partitions.get(asin2)
+                if partitions2 is None:
+                    continue
+                for idx in partitions1:
+                    if idx in partitions2:
+                        outputs[idx].write(f"{asin1},{asin2}\n")
+
+    def extract_reviews(self):
+        """
+        v1/User_itemprod_Product.csv, a reviewer-product edge with the rating
+        per review of the products of each category, and the reviews to build the usu edges from.
+        """
+        product_partitions = self.load_product_partitions()
+        itemprods = [
+            partition.open_file(os.path.join("v1", "User_itemprod_Product.csv"),
+                                ":START_ID,:END_ID,overall:float\n")
+            for partition in self.partitions
+        ]
+        reviews = [
+            partition.open_file(REVIEWS_NAME, None)
+            for partition in self.partitions
+        ]
+        reviewers = ReviewLookup(
+            iter_rows(self.input_path("Review_isWrittenBy_Reviewer.csv")))
+        # the ratings by the year of the review ids, opened when first needed
+        ratings = [None for year in REVIEW_FILE_YEARS]
+        count = 0
+        for review_id, asin in iter_rows(
+                self.input_path("Review_rates_Product.csv")):
+            partitions = product_partitions.get(asin)
+            # look up every review, so that the rows read ahead stay few
+            reviewer_id = reviewers.get(review_id)
+            if partitions is None or reviewer_id is None:
+                continue
+            year_idx = int(review_id[1:5]) - 1996
+            if ratings[year_idx] is None:
+                year = REVIEW_FILE_YEARS[year_idx]
+                ratings[year_idx] = ReviewLookup(
+                    iter_rows(self.input_path(
+                        os.path.join("review", f"review{year}.csv")),
+                              header=False))
+            overall = ratings[year_idx].get(review_id)
+            count += 1
+            for idx in partitions:
+                itemprods[idx].write(
+                    f"{reviewer_id},{asin},{'' if overall is None else overall}\n")
+                if overall is not None:
+                    reviews[idx].write(f"{asin},{overall},{reviewer_id}\n")
+        print(f"{count} reviews in {len(self.partitions)} categories")
+
+    def finish_partitions(self):
+        """
+        Finish the partitions in parallel, then write their usu edges in
+        parallel over the shards of every partition.
+        """
+        for partition in self.partitions:
+            partition.close_files()
+        output_dirs = [partition.output_dir for partition in self.partitions]
+        usu_paths = [(os.path.join(output_dir, GROUPS_NAME),
+                      os.path.join(output_dir, "v1", "User_usu_User.csv"))
+                     for output_dir in output_dirs]
+        tasks = [
+            task for groups_path, output_path in usu_paths for task in
+            shard_tasks(groups_path, output_path, self.workers,
+                        self.max_group_size)
+        ]
+        if self.workers > 1:
+            with Pool(self.workers) as pool:
+                pool.map(finish_partition, output_dirs)
+                pool.starmap(write_shard, tasks)
+        else:
+            for output_dir in output_dirs:
+                finish_partition(output_dir)
+            for task in tasks:
+                write_shard(*task)
+        for groups_path, output_path in usu_paths:
+            merge_shards(groups_path, output_path, self.workers)
+
+    def extract_reviewer(self):
+        """
+        reviewers.csv of the reviewers of the reviews of the products of each
+        category, merging the sorted reviewer node file with the sorted
+        reviewers of each category.
+        """
+        heap = []
+        for idx, partition in enumerate(self.partitions):
+            ids = open(os.path.join(partition.output_dir, REVIEWERS_NAME), "r")
+            reviewer_id = ids.readline().rstrip("\n")
+            if reviewer_id:
+                heap.append((reviewer_id, idx, ids))
+            else:
+                ids.close()
+        heapq.heapify(heap)
+        with open_csv(self.input_path("reviewers.csv"), newline=None) as inf:
+            header = inf.readline()
+            outputs = [
+                partition.open_file("reviewers.csv", header)
+                for partition in self.partitions
+            ]
+            for line in inf:
+                if len(heap) == 0:
+                    break
+                key = line.split(",", 1)[0]
+                # skip the reviewers without a node
+                while len(heap) > 0 and heap[0][0] <= key:
+                    reviewer_id, idx, ids = heap[0]
+                    if reviewer_id == key:
+                        outputs[idx].write(line)
+                    next_id = ids.readline().rstrip("\n")
+                    if next_id:
+                        assert next_id > reviewer_id, "reviewers not sorted"
+                        heapq.heapreplace(heap, (next_id, idx, ids))
+                    else:
+                        heapq.heappop(heap)
+                        ids.close()
+        for _, _, ids in heap:
+            ids.close()
+        for partition in self.partitions:
+            partition.close_files()
+            os.remove(os.path.join(partition.output_dir, REVIEWERS_NAME))
+            print(f"output to {partition.output_dir}")
+
+    def extract_all(self):
+        """ Write all outputs of the subgraphs. """
+        self.extract_product()
+        self.extract_product_to_product()
+        self.extract_reviews()
+        self.finish_partitions()
+        self.extract_reviewer()
+
+
+def main(argv=None):
+    """ Parse the command line and extract the subgraphs. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("categories",
+                        nargs="+",
+                        help=f'the category names, or "{ALL_CATEGORIES}"')
+    parser.add_argument("--import-dir",
+                        default=neo4j_import_dir,
+                        help="the directory of the import CSVs")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="the processes finishing the categories")
+    parser.add_argument("--max-group-size",
+                        type=int,
+                        help="sample the reviews of a product and rating down "
+                        "to this many to build the usu edges")
+    args = parser.parse_args(argv)
+    SubgraphExtractor(args.categories, args.import_dir, args.workers,
+                      args.max_group_size).extract_all()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
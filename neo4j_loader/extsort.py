@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+"""
+External merge sort of key-value pairs that do not fit in memory.
+
+Sorted runs are spilled to temporary files and merged with a k-way merge. Runs
+are numbered in input order, and when a key appears in several runs the value
+of the first run wins, which keeps first-seen semantics across runs.
+
+The values of a node file are sorted by `parallel_sorted`. If
+NEO4J_LOADER_SORT_WORKERS is more than 1 and there are more than
+PARALLEL_SORT_ITEMS items, the items are split into key ranges at the
+quantiles of a sample, and each range is sorted on a forked worker process,
+which inherits the items and returns only their order. The ranges are
+concatenated, so that the result, including the order of equal items, is the
+same as sorted(items). Each worker reads every item, which copies the pages of
+the list into the worker, so the workers are off by default, and the runs of a
+`SpillingDict`, whose budget bounds the memory, are always sorted in process.
+"""
+
+import heapq
+import multiprocessing
+import os
+import random
+import re
+import tempfile
+from array import array
+
+# estimated bytes of a str key and value in a dict, besides their characters
+ENTRY_OVERHEAD = 200
+SORT_WORKERS = int(os.getenv("NEO4J_LOADER_SORT_WORKERS", 1))
+PARALLEL_SORT_ITEMS = 1 << 20
+# the sampled items per worker to choose the key ranges
+SAMPLES_PER_WORKER = 1000
+
+_ESCAPE = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_UNESCAPE = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r"}
+_ESCAPED = re.compile(r"\\(.)")
+
+
+def _escape(value):
+    return value.translate(_ESCAPE)
+
+
+def _unescape(value):
+    if "\\" not in value:
+        return value
+    return _ESCAPED.sub(lambda m: _UNESCAPE[m.group(1)], value)
+
+
+def _open_run(path, mode):
+    return open(path, mode, encoding="utf-8", errors="surrogatepass",
+                newline="\n")
+
+
+# the items and range bounds of `parallel_sorted`, inherited by its workers
+_items = None
+_bounds = None
+
+
+def _sort_range(range_idx):
+    """ The indices of the items in a key range, in the order of the items. """
+    items = _items
+    low = _bounds[range_idx - 1] if range_idx > 0 else None
+    high = _bounds[range_idx] if range_idx < len(_bounds) else None
+    if low is None:
+        indices = [idx for idx, item in enumerate(items) if item < high]
+    elif high is None:
+        indices = [idx for idx, item in enumerate(items) if low <= item]
+    else:
+        indices = [
+            idx for idx, item in enumerate(items) if low <= item < high
+        ]
+    # a stable sort keeps equal items in input order
+    indices.sort(key=items.__getitem__)
+    return array("q", indices)
+
+
+def parallel_sorted(items, workers=None):
+    """
+    sorted(items), with key ranges sorted on worker processes if there are
+    enough items.
+    @param workers The worker processes, SORT_WORKERS by default.
+    @returns A sorted list of the items.
+    """
+    global _items, _bounds
+    items = list(items)
+    workers = workers or SORT_WORKERS
+    # the worker processes of a pool cannot fork their own
+    if (workers <= 1 or len(items) < PARALLEL_SORT_ITEMS
+            or multiprocessing.current_process().daemon):
+        items.sort()
+        return items
+    sample = sorted(
+        random.sample(items, min(len(items), workers * SAMPLES_PER_WORKER)))
+    _items = items
+    _bounds = [
+        sample[len(sample) * idx // workers] for idx in range(1, workers)
+    ]
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            orders = pool.map(_sort_range, range(workers))
+    finally:
+        _items = _bounds = None
+    return [items[idx] for order in orders for idx in order]
+
+
+def entry_size(key, value):
+    """ Estimated memory of a key-value entry in a dict. """
+    return len(key) + len(value) + ENTRY_OVERHEAD
+
+
+def write_run(pairs, directory, prefix=None):
+    """
+    Write sorted key-value pairs to a run file.
+    @returns The path of the run file.
+    """
+    fd, path = tempfile.mkstemp(suffix=".run", prefix=prefix, dir=directory)
+    os.close(fd)
+    with _open_run(path, "w") as outf:
+        for key, value in pairs:
+            outf.write(f"{_escape(key)}\t{_escape(value)}\n")
+    return path
+
+
+def read_run(path):
+    """ Iterate over the key-value pairs of a run file. """
+    with _open_run(path, "r") as inf:
+        for line in inf:
+            key, value = line[:-1].split("\t", 1)
+            yield _unescape(key), _unescape(value)
+
+
+def merge_runs(paths):
+    """
+    Merge sorted run files.
+    @param paths The run files in input order.
+    @returns An iterator of key-value pairs sorted by key, with the value of
+             the first run for keys repeated across runs.
+    """
+
+    def tag(run_idx, path):
+        for key, value in read_run(path):
+            yield key, run_idx, value
+
+    last_key = None
+    for key, _, value in heapq.merge(
+            *[tag(run_idx, path) for run_idx, path in enumerate(paths)]):
+        if key != last_key:
+            last_key = key
+            yield key, value
+
+
+class SpillingDict:
+    """
+    A dict of str keys and values that keeps the first value of a key, and
+    spills sorted runs to disk when the estimated memory exceeds the budget.
+    Keys repeated across runs are deduplicated by `sorted_items`.
+    """
+
+    def __init__(self, memory_budget=None, directory=None, prefix=None):
+        """
+        @param memory_budget The estimated bytes to hold in memory, or None to
+               never spill.
+        @param directory The directory of the run files.
+        @param prefix The name prefix of the run files.
+        """
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.prefix = prefix
+        self.items = {}
+        self.size = 0
+        self.runs = []
+
+    def __contains__(self, key):
+        """ Whether the key is in memory, i.e. seen since the last spill. """
+        return key in self.items
+
+    def setdefault(self, key, value):
+        """ Add the key if it is not in memory. """
+        if key in self.items:
+            return
+        self.items[key] = value
+        if self.memory_budget is not None:
+            self.size += entry_size(key, value)
+            if self.size > self.memory_budget:
+                self.spill()
+
+    def items_in_memory(self):
+        """ The items in memory sorted by key. """
+        # the keys are distinct, and compare faster than the items
+        items = self.items
+        return [(key, items[key]) for key in sorted(items)]
+
+    def spill(self):
+        """ Write the items in memory to a sorted run. """
+        if len(self.items) > 0:
+            self.runs.append(
+                write_run(self.items_in_memory(), self.directory,
+                          self.prefix))
+        self.items = {}
+        self.size = 0
+
+    def sorted_items(self):
+        """ Iterate over the items sorted by key, the first value per key. """
+        if len(self.runs) == 0:
+            return iter(self.items_in_memory())
+        self.spill()
+        return merge_runs(self.runs)
+
+    def restore_runs(self, runs):
+        """
+        Continue from the runs of an earlier instance, deleting the other run
+        files with the prefix, which it spilled later.
+        """
+        self.runs = list(runs)
+        directory = self.directory or tempfile.gettempdir()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if (name.startswith(self.prefix or tempfile.gettempprefix())
+                    and name.endswith(".run") and path not in self.runs):
+                os.remove(path)
+
+    def remove_runs(self):
+        """ Delete the run files. """
+        for path in self.runs:
+            os.remove(path)
+        self.runs = []
@@ -0,0 +1,216 @@
+#! /usr/bin/env python3
+"""
+Export the subgraphs of categories as NumPy arrays for GNN training, so that
+a training job maps the graph into memory instead of parsing the CSVs.
+
+The nodes of each type get dense integer ids, in the order of their node file
+(product.csv, reviewers.csv), followed by the ends of the edges that are not
+in it. The ids of a type are mapped to its keys by a text file with the key
+of id i on line i. Each relation file of the subgraph, written by
+`extract_subgraph.py` or `extract_subgraph_csv.py`, gives a folder with
+    * src.npy, dst.npy, the edges in COO format, sorted by source
+    * indptr.npy, with dst.npy as the indices, the CSR format of the edges:
+      the out-neighbors of source i are dst[indptr[i]:indptr[i + 1]]
+    * <name>.npy per numeric property of the edges, e.g. overall.npy for the
+      ratings of User_itemprod_Product, NaN or 0 where it is missing
+and graph.json describes the node types and relations. The arrays are saved
+with np.save, to be loaded with np.load(path, mmap_mode="r").
+
+    ./neo4j_loader/gnn_export.py " Appliances"
+    ./neo4j_loader/gnn_export.py all --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+from array import array
+from multiprocessing import Pool
+
+import numpy as np
+
+from bolt_import import CsvGroup
+from node_index import category_name
+from utils import neo4j_import_dir
+
+ALL_CATEGORIES = "all"
+OUTPUT_DIR = "gnn"
+# node type to its node file in the subgraph folder
+NODE_FILES = {"Product": "product.csv", "Reviewer": "reviewers.csv"}
+# relation file to the types of its source and destination nodes
+RELATION_FILES = {
+    "Product_isSimilarTo_Product.csv": ("Product", "Product"),
+    "Product_alsoBuy_Product.csv": ("Product", "Product"),
+    "Product_alsoView_Product.csv": ("Product", "Product"),
+    os.path.join("v1", "User_usu_User.csv"): ("Reviewer", "Reviewer"),
+    os.path.join("v1", "User_itemprod_Product.csv"): ("Reviewer", "Product"),
+}
+# the typecodes of the numeric edge properties and their missing values
+ATTRIBUTE_TYPES = {
+    "int": ("q", 0),
+    "long": ("q", 0),
+    "short": ("q", 0),
+    "byte": ("q", 0),
+    "float": ("d", float("nan")),
+    "double": ("d", float("nan")),
+    "boolean": ("b", 0),
+}
+
+
+class IdMap:
+    """ The dense ids of the nodes of a type. """
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+
+    def get(self, key):
+        """ The id of a key, a new one if it is not mapped yet. """
+        node_id = self.ids.get(key)
+        if node_id is None:
+            node_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return node_id
+
+    def __len__(self):
+        return len(self.keys)
+
+    def save(self, path):
+        with open(path, "w") as outf:
+            for key in self.keys:
+                outf.write(f"{key}\n")
+
+
+def index_dtype(size):
+    return np.int32 if size < 2**31 else np.int64
+
+
+def read_edges(group, src_ids, dst_ids):
+    """
+    @returns The source and destination ids of the edges of a file group, and
+             the values of each numeric property of its header.
+    """
+    start_idx, _ = group.column("START_ID")
+    end_idx, _ = group.column("END_ID")
+    attributes = [(idx, column) for idx, column in enumerate(group.columns)
+                  if column.name and not column.array
+                  and column.kind.lower() in ATTRIBUTE_TYPES]
+    src, dst = array("q"), array("q")
+    values = {
+        column.name: array(ATTRIBUTE_TYPES[column.kind.lower()][0])
+        for _, column in attributes
+    }
+    for line in group.lines():
+        src.append(src_ids.get(line[start_idx]))
+        dst.append(dst_ids.get(line[end_idx]))
+        for idx, column in attributes:
+            text = line[idx] if idx < len(line) else ""
+            values[column.name].append(
+                column.value(text) if text != "" else
+                ATTRIBUTE_TYPES[column.kind.lower()][1])
+    return (np.frombuffer(src, dtype=np.int64),
+            np.frombuffer(dst, dtype=np.int64),
+            {name: np.frombuffer(x, dtype=x.typecode)
+             for name, x in values.items()})
+
+
+def save_relation(output_dir, src, dst, attributes, num_src, num_dst):
+    """ Save the edges of a relation in COO and CSR formats, sorted by source. """
+    os.makedirs(output_dir, exist_ok=True)
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(num_src + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_src), out=indptr[1:])
+    np.save(os.path.join(output_dir, "indptr.npy"), indptr)
+    np.save(os.path.join(output_dir, "src.npy"),
+            src[order].astype(index_dtype(num_src)))
+    np.save(os.path.join(output_dir, "dst.npy"),
+            dst[order].astype(index_dtype(num_dst)))
+    for name, values in attributes.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), values[order])
+
+
+def export_subgraph(subgraph_dir):
+    """
+    Export the subgraph of a category folder to its gnn folder.
+    @returns The description of the graph, as written to graph.json.
+    """
+    output_dir = os.path.join(subgraph_dir, OUTPUT_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    id_maps = {node_type: IdMap() for node_type in NODE_FILES}
+    for node_type, name in NODE_FILES.items():
+        group = CsvGroup([name], subgraph_dir)
+        key_idx, _ = group.column("ID")
+        for line in group.lines():
+            id_maps[node_type].get(line[key_idx])
+    listed = {node_type: len(ids) for node_type, ids in id_maps.items()}
+    # the edges are saved once all ends have ids, for the size of indptr
+    relations = {}
+    for path, (src_type, dst_type) in RELATION_FILES.items():
+        if not os.path.exists(os.path.join(subgraph_dir, path)):
+            continue
+        relation = os.path.splitext(os.path.basename(path))[0]
+        relations[relation] = (src_type, dst_type) + read_edges(
+            CsvGroup([path], subgraph_dir), id_maps[src_type],
+            id_maps[dst_type])
+    graph = {"nodes": {}, "relations": {}}
+    for node_type, ids in id_maps.items():
+        ids.save(os.path.join(output_dir, f"{node_type}.txt"))
+        graph["nodes"][node_type] = {
+            "count": len(ids),
+            "not_in_node_file": len(ids) - listed[node_type]
+        }
+    for relation, (src_type, dst_type, src, dst,
+                   attributes) in relations.items():
+        save_relation(os.path.join(output_dir, relation), src, dst,
+                      attributes, len(id_maps[src_type]),
+                      len(id_maps[dst_type]))
+        graph["relations"][relation] = {
+            "src": src_type,
+            "dst": dst_type,
+            "edges": len(src),
+            "attributes": sorted(attributes)
+        }
+    with open(os.path.join(output_dir, "graph.json"), "w") as outf:
+        json.dump(graph, outf, indent=1)
+    print(f"output to {output_dir}")
+    return graph
+
+
+def subgraph_dirs(categories, import_dir=neo4j_import_dir):
+    """ The subgraph folders of the categories, or of all extracted ones. """
+    root = os.path.join(import_dir, "subgraph")
+    if categories == ALL_CATEGORIES or ALL_CATEGORIES in categories:
+        categories = sorted(
+            name for name in os.listdir(root)
+            if os.path.isdir(os.path.join(root, name)))
+    return [
+        os.path.join(root, name)
+        for name in dict.fromkeys(category_name(x) for x in categories)
+    ]
+
+
+def main(argv=None):
+    """ Parse the command line and export the subgraphs. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("categories",
+                        nargs="+",
+                        help=f'the category names, or "{ALL_CATEGORIES}"')
+    parser.add_argument("--import-dir",
+                        default=neo4j_import_dir,
+                        help="the import dir of the subgraph folders")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="the categories exported at the same time")
+    args = parser.parse_args(argv)
+    dirs = subgraph_dirs(args.categories, args.import_dir)
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            pool.map(export_subgraph, dirs)
+    else:
+        for subgraph_dir in dirs:
+            export_subgraph(subgraph_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
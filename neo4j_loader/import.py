@@ -1,33 +1,60 @@
 #! /usr/bin/env python3
-""" Import Amazon product review graph to NEO4J using neo4j-admin import. """
+"""
+Import Amazon product review graph to NEO4J using neo4j-admin import, or
+load it into a running database with --bolt. The files compressed by
+`compress.py` are imported from their .csv.gz files.
+"""
 
+import argparse
 import os
+import sys
 from glob import glob
 
+from bolt_import import add_arguments, import_files
 from utils import neo4j_import_dir
 
+
+def find(name):
+    """ The name of a file of the import dir, or of its .gz file if compressed. """
+    if os.path.exists(os.path.join(neo4j_import_dir, f"{name}.gz")):
+        return f"{name}.gz"
+    return name
+
+
 ###### NODE FILES ######
 # excluding reviews of year 2018
 # if multiple CSVs in a file group contain header, use --auto-skip-subsequent-headers
-PRODUCT_FILES = ','.join(glob("*product.csv", root_dir=neo4j_import_dir))
+# product.csv first, for its header
+PRODUCT_FILES = ','.join(
+    find(path) for path in sorted(
+        set(glob("*product.csv", root_dir=neo4j_import_dir)) | {
+            path.removesuffix(".gz")
+            for path in glob("*product.csv.gz", root_dir=neo4j_import_dir)
+        },
+        key=lambda path: (path != "product.csv", path)))
 NODE_FILES = [
-    '--nodes=Brand=brand.csv', '--nodes=Category=category.csv',
-    '--nodes=Style=style.csv', f'--nodes=Product={PRODUCT_FILES}',
-    '--nodes=Reviewer=reviewers.csv',
-    '--nodes=Review=review/review_header.csv,' +
-    ','.join([f'review/review{year}.csv' for year in range(1996, 2018)])
+    f'--nodes=Brand={find("brand.csv")}',
+    f'--nodes=Category={find("category.csv")}',
+    f'--nodes=Style={find("style.csv")}', f'--nodes=Product={PRODUCT_FILES}',
+    f'--nodes=Reviewer={find("reviewers.csv")}',
+    '--nodes=Review=' + ','.join(
+        find(os.path.join('review', name)) for name in ['review_header.csv'] +
+        [f'review{year}.csv' for year in range(1996, 2018)])
 ]
 
 ###### RELATIONSHIP FILES ######
 RELATIONSHIP_FILES = [
-    "--relationships=isWrittenBy=Review_isWrittenBy_Reviewer.csv",
-    "--relationships=refersTo=Review_refersTo_Style.csv",
-    "--relationships=rates=Review_rates_Product.csv",
-    "--relationships=belongsTo=Product_belongsTo_Category.csv",
-    "--relationships=hasBrand=Product_hasBrand_Brand.csv",
-    "--relationships=isSimilarTo=Product_isSimilarTo_Product.csv",
-    "--relationships=alsoBuy=Product_alsoBuy_Product.csv",
-    "--relationships=alsoView=Product_alsoView_Product.csv"
+    f"--relationships={rel_type}={find(name)}"
+    for rel_type, name in [
+        ("isWrittenBy", "Review_isWrittenBy_Reviewer.csv"),
+        ("refersTo", "Review_refersTo_Style.csv"),
+        ("rates", "Review_rates_Product.csv"),
+        ("belongsTo", "Product_belongsTo_Category.csv"),
+        ("hasBrand", "Product_hasBrand_Brand.csv"),
+        ("isSimilarTo", "Product_isSimilarTo_Product.csv"),
+        ("alsoBuy", "Product_alsoBuy_Product.csv"),
+        ("alsoView", "Product_alsoView_Product.csv"),
+    ]
 ]
 
 
@@ -38,11 +65,17 @@ def validate_paths(files):
             assert os.path.exists(path), f"File not exists: {path}."
 
 
-def main():
-    """ neo4j-admin import """
+def main(argv=None):
+    """ neo4j-admin import, or the Bolt loader """
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
     os.chdir(neo4j_import_dir)
     validate_paths(NODE_FILES)
     validate_paths(RELATIONSHIP_FILES)
+    if args.bolt is not None:
+        import_files(args, NODE_FILES + RELATIONSHIP_FILES, neo4j_import_dir)
+        return
     # legacy = '--legacy-style-quoting=true \\\n'
     legacy = ''
     cmd = f"neo4j-admin import {legacy}" + ' \\\n'.join(NODE_FILES +
@@ -51,4 +84,5 @@ def main():
     os.system(cmd)
 
 
-main()
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,15 @@
 #! /usr/bin/env python3
-""" Import Amazon product review graph to NEO4J using neo4j-admin import. """
+"""
+Import Amazon product review graph to NEO4J using neo4j-admin import, or
+load it into a running database with --bolt.
+"""
 
+import argparse
 import os
+import sys
 from glob import glob
 
+from bolt_import import add_arguments, import_files
 from utils import neo4j_import_dir
 
 neo4j_import_dir = os.path.join(os.getenv("NEO4J_HOME"),
@@ -27,6 +33,10 @@ RELATIONSHIP_FILES = [
     "--relationships=rates=Reviewer_rates_Product.csv"
 ]
 
+# the labels of the relationships between nodes of the same ID space, which
+# their file names do not tell
+BOLT_LABELS = {"sameRates": ("Reviewer", "Reviewer")}
+
 
 def validate_paths(files):
     """ Check that paths exist. """
@@ -35,11 +45,18 @@ def validate_paths(files):
             assert os.path.exists(path), f"File not exists: {path}."
 
 
-def main():
-    """ neo4j-admin import """
+def main(argv=None):
+    """ neo4j-admin import, or the Bolt loader """
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser, database="demo1")
+    args = parser.parse_args(argv)
     os.chdir(neo4j_import_dir)
     validate_paths(NODE_FILES)
     validate_paths(RELATIONSHIP_FILES)
+    if args.bolt is not None:
+        import_files(args, NODE_FILES + RELATIONSHIP_FILES, neo4j_import_dir,
+                     BOLT_LABELS)
+        return
     # legacy = '--legacy-style-quoting=true \\\n'
     legacy = '--database=demo1 \\\n'
     cmd = f"neo4j-admin import {legacy}" + ' \\\n'.join(NODE_FILES +
@@ -48,4 +65,5 @@ def main():
     os.system(cmd)
 
 
-main()
+if __name__ == "__main__":
+    main(sys.argv[1:])
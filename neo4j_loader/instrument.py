@@ -0,0 +1,241 @@
+#! /usr/bin/env python3
+"""
+Opt-in instrumentation of the passes over the input files.
+
+When enabled, each pass of `process_reviews` or `process_meta` records the
+time spent reading lines, decoding JSON, in the cleaning functions of
+CLEAN_FUNCTIONS, writing output files, and closing the sinks (e.g. sorting and
+writing the node files), with the peak RSS and records/sec of the pass. The
+metrics are appended as JSON lines to the metrics file. Optionally, each pass
+is profiled by cProfile into a .prof file.
+
+Enable it by `enable(metrics_path, profile_dir)`, or by setting the
+NEO4J_LOADER_METRICS (and NEO4J_LOADER_PROFILE) environment variables.
+Sharded passes are not instrumented.
+"""
+
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+
+# the cleaning functions of utils, timed where the passes call them
+CLEAN_FUNCTIONS = [
+    "clean_html", "simplify_value", "escape_comma_newline",
+    "escape_comma_quote", "clean_brand_values", "clean_style_key",
+    "escape_comma_newline_batch"
+]
+# the modules that call the cleaning functions
+CLEAN_CALLERS = ["nodes", "relationships"]
+
+metrics_path = os.getenv("NEO4J_LOADER_METRICS")
+profile_dir = os.getenv("NEO4J_LOADER_PROFILE")
+# the pass being measured
+_current = None
+
+
+def enable(path, profile=None):
+    """
+    Record the metrics of the following passes.
+    @param path The JSON lines file to append the metrics to.
+    @param profile If set, the directory to write a cProfile file per pass to.
+    """
+    global metrics_path, profile_dir
+    metrics_path = path
+    profile_dir = profile
+
+
+def disable():
+    """ Stop recording the metrics of the passes. """
+    global metrics_path, profile_dir
+    metrics_path = None
+    profile_dir = None
+
+
+def reset_peak_rss():
+    """ Reset the peak RSS of the process, where Linux allows it. """
+    try:
+        with open("/proc/self/clear_refs", "w") as outf:
+            outf.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """ The peak RSS of the process in bytes. """
+    try:
+        with open("/proc/self/status", "r") as inf:
+            for line in inf:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def timed_clean(func):
+    """ Time a cleaning function, excluding the cleaning functions it calls. """
+
+    def wrapper(*args, **kwargs):
+        metrics = _current
+        if metrics is None or metrics.in_clean:
+            return func(*args, **kwargs)
+        metrics.in_clean = True
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.seconds["clean"] += time.perf_counter() - start
+            metrics.in_clean = False
+
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def install_clean_timers():
+    """ Wrap the cleaning functions in the modules that call them. """
+    for module_name in CLEAN_CALLERS:
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        for name in CLEAN_FUNCTIONS:
+            func = getattr(module, name, None)
+            if func is not None and not hasattr(func, "__wrapped__"):
+                setattr(module, name, timed_clean(func))
+
+
+class TimedFile:
+    """ An output file that adds the time of its writes to a pass. """
+
+    def __init__(self, outf, metrics):
+        self.outf = outf
+        self.metrics = metrics
+
+    def write(self, data):
+        start = time.perf_counter()
+        result = self.outf.write(data)
+        self.metrics.seconds["write"] += time.perf_counter() - start
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.outf, name)
+
+
+class PassMetrics:
+    """ The metrics of a pass over an input file. """
+
+    def __init__(self, path, sinks):
+        self.path = path
+        self.name = "+".join(type(sink).__name__ for sink in sinks)
+        self.seconds = {
+            "read": 0.0,
+            "decode": 0.0,
+            "clean": 0.0,
+            "write": 0.0,
+            "close": 0.0
+        }
+        self.in_clean = False
+        self.records = 0
+        self.profile = None
+        self.start = None
+        # whether the peak RSS is of this pass, or of the process so far
+        self.rss_reset = False
+
+    def begin(self):
+        """ Start measuring the pass. """
+        global _current
+        install_clean_timers()
+        self.rss_reset = reset_peak_rss()
+        _current = self
+        if profile_dir is not None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.start = time.perf_counter()
+
+    def timed_lines(self, lines):
+        """ Iterate over the lines, adding the time of reading them. """
+        lines = iter(lines)
+        while True:
+            start = time.perf_counter()
+            try:
+                line = next(lines)
+            except StopIteration:
+                return
+            self.seconds["read"] += time.perf_counter() - start
+            self.records += 1
+            yield line
+
+    def timed_decode(self, decode):
+        """ Wrap the decoder, adding the time of decoding. """
+
+        def timed(line):
+            start = time.perf_counter()
+            j = decode(line)
+            self.seconds["decode"] += time.perf_counter() - start
+            return j
+
+        return timed
+
+    def close_sinks(self, sinks):
+        """ Close the sinks, adding the time of closing them. """
+        start = time.perf_counter()
+        for sink in sinks:
+            sink.close()
+        self.seconds["close"] += time.perf_counter() - start
+
+    def end(self):
+        """ Stop measuring and append the metrics to the metrics file. """
+        global _current
+        total = time.perf_counter() - self.start
+        _current = None
+        if self.profile is not None:
+            self.profile.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_path = os.path.join(
+                profile_dir,
+                f"{self.name}.{time.strftime('%Y%m%d%H%M%S')}.prof")
+            self.profile.dump_stats(profile_path)
+            print(f"profile output to {profile_path}")
+        # the time of consume besides the cleaning and writes
+        other = total - sum(self.seconds.values())
+        metrics = {
+            "pass": self.name,
+            "input": self.path,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "records": self.records,
+            "seconds": round(total, 3),
+            "records_per_sec":
+            round(self.records / total) if total > 0 else None,
+        }
+        metrics.update({
+            f"{phase}_seconds": round(seconds, 3)
+            for phase, seconds in self.seconds.items()
+        })
+        metrics["other_seconds"] = round(other, 3)
+        metrics["peak_rss_mb"] = round(peak_rss() / 1e6, 1)
+        metrics["peak_rss_of_pass"] = self.rss_reset
+        with open(metrics_path, "a") as outf:
+            outf.write(json.dumps(metrics) + "\n")
+        print(f"metrics output to {metrics_path}")
+        return metrics
+
+
+def start_pass(path, sinks, shard=False):
+    """
+    @returns The started `PassMetrics` of a pass if instrumentation is enabled,
+             else None.
+    """
+    if metrics_path is None or shard:
+        return None
+    metrics = PassMetrics(path, sinks)
+    metrics.begin()
+    return metrics
+
+
+def current():
+    """ The metrics of the pass being measured, or None. """
+    return _current
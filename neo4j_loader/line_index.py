@@ -0,0 +1,170 @@
+#! /usr/bin/env python3
+"""
+Line indexes of the JSON input files, for the progress bars, the line numbers
+of the shards and random access to a line.
+
+The index of a file holds its line count and the byte offset of every
+INDEX_EVERY-th line. It is built by a scan of the memory-mapped file, block by
+block, with NumPy finding the newlines, and cached as JSON next to the file,
+e.g. review.json.lines.json. The cache is used as long as the size and
+modification time of the file are those recorded in it, and is built again
+otherwise. If the directory of the file is not writable, the index is built
+on each run.
+
+A gzip file cannot be read from a byte offset, so it has no index.
+
+    ./neo4j_loader/line_index.py /path/to/review.json --line 1000000
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+from bisect import bisect_right
+
+import numpy as np
+
+from checkpoint import fingerprint, write_json
+from readers import is_gzip
+
+INDEX_SUFFIX = ".lines.json"
+INDEX_EVERY = 1 << 14
+SCAN_BLOCK_SIZE = 1 << 24
+NEWLINE = ord("\n")
+
+
+def scan_lines(path, every=INDEX_EVERY, block_size=SCAN_BLOCK_SIZE):
+    """
+    Find the newlines of a file.
+    @returns The line count, and the byte offsets of lines 0, every,
+             2 * every, ...
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    newlines = 0
+    if size == 0:
+        return 0, offsets
+    with open(path, "rb") as inf, mmap.mmap(inf.fileno(), 0,
+                                            access=mmap.ACCESS_READ) as data:
+        for pos in range(0, size, block_size):
+            block = np.frombuffer(data, np.uint8, min(block_size, size - pos),
+                                  pos)
+            found = np.flatnonzero(block == NEWLINE)
+            # the line after newline i of the block is line newlines + i + 1
+            first = -(newlines + 1) % every
+            offsets.extend((found[first::every] + (pos + 1)).tolist())
+            newlines += len(found)
+            # release the buffer, so that the map can be closed
+            del block
+        last = data[size - 1]
+    lines = newlines + (last != NEWLINE)
+    if offsets[-1] == size:
+        # the line after the last newline is empty
+        offsets.pop()
+    return lines, offsets
+
+
+class LineIndex:
+    """ The line count of a file and the byte offsets of every `every`-th line. """
+
+    def __init__(self, path, lines, every, offsets):
+        self.path = path
+        self.lines = lines
+        self.every = every
+        self.offsets = offsets
+
+    def line_number(self, offset):
+        """ The number of lines before a byte offset at the start of a line. """
+        idx = bisect_right(self.offsets, offset) - 1
+        start = self.offsets[idx]
+        with open(self.path, "rb") as inf:
+            inf.seek(start)
+            return idx * self.every + inf.read(offset - start).count(b"\n")
+
+    def line_offset(self, linenum):
+        """ The byte offset of a line, counted from 0. """
+        assert 0 <= linenum < self.lines, f"no line {linenum} in {self.path}"
+        offset = self.offsets[linenum // self.every]
+        with open(self.path, "rb") as inf:
+            inf.seek(offset)
+            for _ in range(linenum % self.every):
+                offset += len(inf.readline())
+        return offset
+
+    def read_line(self, linenum):
+        """ The text of a line, counted from 0. """
+        with open(self.path, "rb") as inf:
+            inf.seek(self.line_offset(linenum))
+            return inf.readline().decode("utf-8")
+
+    def save(self, path):
+        write_json(
+            path, {
+                "fingerprint": fingerprint(self.path),
+                "lines": self.lines,
+                "every": self.every,
+                "offsets": self.offsets
+            })
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def load_line_index(path, every=INDEX_EVERY):
+    """ The cached index of a file, or None if it is missing or stale. """
+    try:
+        with open(index_path(path), "r") as inf:
+            cached = json.load(inf)
+    except (OSError, ValueError):
+        return None
+    if cached["fingerprint"] != fingerprint(path) or cached["every"] != every:
+        return None
+    return LineIndex(path, cached["lines"], every, cached["offsets"])
+
+
+def get_line_index(path, every=INDEX_EVERY):
+    """
+    The index of a file, from its cache or built and cached.
+    @returns The `LineIndex`, or None for a gzip file.
+    """
+    if is_gzip(path):
+        return None
+    index = load_line_index(path, every)
+    if index is None:
+        lines, offsets = scan_lines(path, every)
+        index = LineIndex(path, lines, every, offsets)
+        try:
+            index.save(index_path(path))
+        except OSError:
+            pass
+    return index
+
+
+def line_count(path):
+    """ The number of lines of a file, or None for a gzip file. """
+    index = get_line_index(path)
+    return None if index is None else index.lines
+
+
+def main(argv=None):
+    """ Parse the command line and index the files. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="+", help="the files to index")
+    parser.add_argument("--line",
+                        type=int,
+                        help="print this line of each file, counted from 0")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        index = get_line_index(path)
+        if index is None:
+            print(f"{path}: cannot index a gzip file")
+            continue
+        print(f"{path}: {index.lines} lines")
+        if args.line is not None:
+            print(index.read_line(args.line), end="")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
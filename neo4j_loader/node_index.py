@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+""" In-memory indexes from node keys to the ids in the node files. """
+
+import csv
+import os
+
+from utils import csv_path, neo4j_import_dir, open_csv, simplify_value
+
+
+class MissingNodeError(KeyError):
+    """ A key that is not in the node file it should refer to. """
+
+    def __str__(self):
+        return self.args[0]
+
+
+class NodeIndex:
+    """
+    A hash map from the key column of a node file to its id column, for
+    resolving the ids of relationship end nodes.
+    """
+
+    def __init__(self, path, key_col, id_col, key_fn=None):
+        """
+        @param path The node file written by `output_node_file`, read from its
+               .gz file if compressed.
+        @param key_col, id_col The header names of the key and id columns.
+        @param key_fn A function applied to the key values, if any.
+        """
+        self.path = path
+        self.ids = {}
+        with open_csv(path) as inf:
+            reader = csv.reader(inf)
+            header = next(reader)
+            key_idx, id_idx = header.index(key_col), header.index(id_col)
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                key = row[key_idx] if key_fn is None else key_fn(row[key_idx])
+                # keep the first id of a repeated key
+                self.ids.setdefault(key, row[id_idx])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def get_id(self, key, context=None):
+        """
+        @param context Where the key comes from, to report if it is missing.
+        @returns The id of the node with the key.
+        """
+        try:
+            return self.ids[key]
+        except KeyError:
+            message = f"{key!r} not in {self.path}"
+            if context is not None:
+                message += f" ({context})"
+            raise MissingNodeError(message) from None
+
+
+def brand_signature(name):
+    """ The case-insensitive signature of a brand name. """
+    return simplify_value(name)[0]
+
+
+def category_name(name):
+    """ The category name without surrounding spaces. """
+    return name.strip()
+
+
+# node file indexes loaded in this process, shared by the passes
+_indexes = {}
+
+
+def load_index(path, key_col, id_col, key_fn=None):
+    """ Load a node index, reusing it if the node file has not changed. """
+    stat = os.stat(csv_path(path))
+    cache_key = (path, key_col, id_col, key_fn, stat.st_size,
+                 stat.st_mtime_ns)
+    if cache_key not in _indexes:
+        print(f"read {path}")
+        _indexes[cache_key] = NodeIndex(path, key_col, id_col, key_fn)
+    return _indexes[cache_key]
+
+
+def load_brand_index(file_name="brand.csv"):
+    """ Index of brand ids by brand signature. """
+    return load_index(os.path.join(neo4j_import_dir, file_name),
+                      "name:string", "id:ID(brand_id)", brand_signature)
+
+
+def load_style_index(file_name="style.csv"):
+    """ Index of style ids by style key. """
+    return load_index(os.path.join(neo4j_import_dir, file_name), "key:string",
+                      "id:ID(style_id)")
+
+
+def load_category_index(file_name="category.csv"):
+    """ Index of category ids by category name. """
+    return load_index(os.path.join(neo4j_import_dir, file_name),
+                      "name:string", "id:ID(category_id)", category_name)
@@ -1,15 +1,88 @@
 #! /usr/bin/env python3
 """ Generate node files for Amazon product review data. """
 
-import json
 import os
-from datetime import datetime
-import pandas as pd
 from tqdm import tqdm
 
+from asin_set import new_asin_set, sorted_asins
+from block_writer import open_output
+from extsort import SpillingDict
+from pipeline import MetaSink, ReviewSink, process_meta, process_reviews
 from utils import *
 
 
+def count_words(freq, words):
+    """ Add the words to the word frequency dict. """
+    for word in words:
+        if word in freq:
+            freq[word] += 1
+        else:
+            freq[word] = 1
+
+
+def merge_word_frequency(freqs):
+    """ Sum the word frequency dicts. """
+    merged = {}
+    for freq in freqs:
+        for word, count in freq.items():
+            merged[word] = merged.get(word, 0) + count
+    return merged
+
+
+class BrandCollector(MetaSink):
+    """ Collects the distinct brand values and outputs the Brand node file. """
+
+    def __init__(self,
+                 key="brand",
+                 word_frequency=True,
+                 replace=None,
+                 debug=False,
+                 output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.key = key
+        self.prefilter = f'"{key}"'
+        self.fields = (key, )
+        self.word_frequency = word_frequency
+        self.replace = replace
+        self.debug = debug
+        self.distinct = {}
+        self.freq = {}
+
+    def consume(self, j, linenum):
+        key = self.key
+        if key in j:
+            value = clean_brand_values(j[key].strip(), self.replace)
+            # cleaning
+            if value is None:
+                if self.debug:
+                    print(linenum, j[key])
+                return
+            # word frequency
+            if self.word_frequency:
+                count_words(self.freq, (word.lower() for word in value.split()))
+            # get distinct brand values
+            signature, value = simplify_value(value)
+            if len(value) > 0 and signature not in self.distinct:
+                self.distinct[signature] = value
+
+    def close(self):
+        if self.word_frequency:
+            output_word_frequency(self.freq, "brand_word_frequency.txt")
+        # output
+        output_node_file(self.distinct, self.key)
+
+    @classmethod
+    def merge(cls, shards):
+        first = shards[0]
+        merged = cls(first.key, first.word_frequency, first.replace)
+        for shard in shards:
+            for signature, value in shard.distinct.items():
+                if signature not in merged.distinct:
+                    merged.distinct[signature] = value
+        merged.freq = merge_word_frequency(shard.freq for shard in shards)
+        merged.close()
+
+
 def get_brands(path,
                key="brand",
                word_frequency=True,
@@ -25,193 +98,331 @@ def get_brands(path,
            first element and ends with the second element.
     @param debug If true, print the original strings that gives invalid values.
     """
-    distinct = {}
-    freq = {}
-    # input
-    with open(path, "r") as inf:
-        for linenum, line in tqdm(enumerate(inf),
-                                  total=META_COUNT,
-                                  desc="Line"):
-            if key not in line:
-                continue
-            j = json.loads(line.strip())
-            if key in j:
-                value = clean_brand_values(j[key].strip(), replace)
-                # cleaning
-                if value is None:
-                    if debug:
-                        print(linenum, j[key])
-                    continue
-                # word frequency
-                if word_frequency:
-                    for word in value.split():
-                        word = word.lower()
-                        if word in freq:
-                            freq[word] += 1
-                        else:
-                            freq[word] = 1
-                # get distinct brand values
-                signature, value = simplify_value(value)
-                if len(value) > 0 and signature not in distinct:
-                    distinct[signature] = value
-    if word_frequency:
-        output_word_frequency(freq, "brand_word_frequency.txt")
-    # output
-    output_node_file(distinct, key)
+    process_meta(path, [BrandCollector(key, word_frequency, replace, debug)])
+
+
+class CategoryCollector(MetaSink):
+    """ Collects the distinct first categories and outputs the Category node file. """
+
+    def __init__(self,
+                 key="category",
+                 word_frequency=False,
+                 output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.key = key
+        self.fields = (key, )
+        self.word_frequency = word_frequency
+        self.distinct = set()
+        self.freq = {}
+
+    def consume(self, j, linenum):
+        if self.key in j:
+            # get the first category
+            word = j[self.key]
+            word = word[0]
+            if "," in word:
+                word = word.replace(",", " &")
+            # update distinct values
+            self.distinct.add(word)
+            # word frequency
+            if self.word_frequency:
+                count_words(self.freq, [word])
+
+    def close(self):
+        if self.word_frequency:
+            output_word_frequency(self.freq, f"{self.key}_word_frequency.txt")
+        output_node_file(self.distinct, self.key)
+
+    @classmethod
+    def merge(cls, shards):
+        merged = cls(shards[0].key, shards[0].word_frequency)
+        merged.distinct = set().union(*(shard.distinct for shard in shards))
+        merged.freq = merge_word_frequency(shard.freq for shard in shards)
+        merged.close()
 
 
 def get_categories(data_path, key="category", word_frequency=False):
     """ Generate Category node file. """
-    # input
-    distinct = set()
-    freq = {}
-    with open(data_path, "r") as inf:
-        for line in tqdm(inf, total=META_COUNT, desc="Line"):
-            j = json.loads(line.strip())
-            if key in j:
-                # get the first category
-                word = j[key]
-                word = word[0]
-                if "," in word:
-                    word = word.replace(",", " &")
-                # update distinct values
-                distinct.add(word)
-                # word frequency
-                if word_frequency:
-                    if word in freq:
-                        freq[word] += 1
-                    else:
-                        freq[word] = 1
-    if word_frequency:
-        output_word_frequency(freq, f"{key}_word_frequency.txt")
-    output_node_file(distinct, key)
+    process_meta(data_path, [CategoryCollector(key, word_frequency)])
+
+
+class StyleKeyCollector(ReviewSink):
+    """ Collects the distinct style keys and outputs the Style node file. """
+    prefilter = '"style"'
+    fields = ("style", )
+    resumable = True
+
+    def __init__(self, output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.styles = set()
+
+    def get_checkpoint(self):
+        return sorted(self.styles)
+
+    def restore_checkpoint(self, state):
+        self.styles = set(state)
+
+    def consume(self, j, review_id, year):
+        if "style" in j and isinstance(j["style"], dict):
+            for key in j["style"]:
+                self.styles.add(clean_style_key(key))
+
+    def close(self):
+        output_node_file(self.styles, 'style', col='key')
+
+    @classmethod
+    def merge(cls, shards):
+        merged = cls()
+        merged.styles = set().union(*(shard.styles for shard in shards))
+        merged.close()
 
 
 def get_style_keys(path):
     """ Get Style node file. """
-    data = pd.read_json(path, lines=True, chunksize=100000)
-    styles = set()
+    process_reviews(path, [StyleKeyCollector()])
+
+
+class ReviewerCollector(ReviewSink):
+    """
+    Collects the first seen name per reviewer and outputs the Reviewer node file.
+    With a memory budget, sorted runs of reviewers are spilled to disk and
+    merged on close.
+    """
+    fields = ("reviewerID", "reviewerName")
+    resumable = True
 
-    def add_key(style_dict):
-        if isinstance(style_dict, dict):
-            for key in style_dict:
-                styles.add(clean_style_key(key))
+    def __init__(self, memory_budget=None, output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.memory_budget = memory_budget
+        self.reviewers = SpillingDict(memory_budget, output_dir, "reviewers.")
 
-    for chunk_id, chunk in enumerate(data):
-        print(chunk_id * 100000 / REVIEW_COUNT * 100, '%')
-        chunk["style"].apply(add_key)
-    output_node_file(styles, 'style', col='key')
+    def get_checkpoint(self):
+        # the reviewers so far are kept in the runs
+        self.reviewers.spill()
+        return self.reviewers.runs
 
+    def restore_checkpoint(self, state):
+        self.reviewers.restore_runs(state)
 
-def get_reviewers(path):
+    def consume(self, j, review_id, year):
+        if not j["reviewerID"] in self.reviewers:
+            name = escape_comma_newline(clean_html(
+                j["reviewerName"])) if "reviewerName" in j else ""
+            self.reviewers.setdefault(j["reviewerID"], name)
+
+    def close(self):
+        output_path = os.path.join(self.output_dir, "reviewers.csv")
+        with open_output(output_path) as outf:
+            outf.write("reviewerID:ID,name:string\n")
+            for rid, name in self.reviewers.sorted_items():
+                outf.write(f"{rid},{escape_comma_quote(name)}\n")
+            print(f"output to {output_path}")
+        self.reviewers.remove_runs()
+
+    def finish_shard(self):
+        if self.memory_budget is not None:
+            self.reviewers.spill()
+        return super().finish_shard()
+
+    @classmethod
+    def merge(cls, shards):
+        merged = cls(shards[0].memory_budget)
+        for shard in shards:
+            # runs in input order keep the first seen names
+            merged.reviewers.runs.extend(shard.reviewers.runs)
+            for rid, name in shard.reviewers.items.items():
+                merged.reviewers.setdefault(rid, name)
+        merged.close()
+
+
+def get_reviewers(path, memory_budget=None):
     """
     Generate Reviewer node file.
+    @param memory_budget If set, the estimated bytes of reviewers to hold in
+           memory before spilling sorted runs to disk.
     """
-    reviewers = {}
-    output_path = os.path.join(neo4j_import_dir, "reviewers.csv")
-    with open(path, "r") as inf:
-        for line in tqdm(inf, total=REVIEW_COUNT, desc="Line"):
-            j = json.loads(line.strip())
-            if not j["reviewerID"] in reviewers:
-                name = escape_comma_newline(clean_html(
-                    j["reviewerName"])) if "reviewerName" in j else ""
-                reviewers[j["reviewerID"]] = name
-    with open(output_path, "w") as outf:
-        outf.write("reviewerID:ID,name:string\n")
-        for rid, name in sorted(reviewers.items()):
-            outf.write(f"{rid},{escape_comma_quote(name)}\n")
-        print(f"output to {output_path}")
+    process_reviews(path, [ReviewerCollector(memory_budget)])
 
 
-def get_reviews(path):
-    """ Generate Review node file per year. """
-    # create review folder
-    if not os.path.exists(os.path.join(neo4j_import_dir, 'review')):
-        os.mkdir(os.path.join(neo4j_import_dir, 'review'))
-    # write header in a separate file
-    with open(os.path.join(neo4j_import_dir, 'review', 'review_header.csv'),
-              'w') as outf:
-        outf.write(
-            "id:ID(review_id),overall:float,unixReviewTime:int,"
+class ReviewWriter(ReviewSink):
+    """ Writes the Review node file per year. """
+    fields = ("overall", "unixReviewTime", "verified", "vote", "summary",
+              "reviewText", "image")
+    resumable = True
+
+    def __init__(self, output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.outfiles = []
+        # the rows to write, with the summary and text to escape
+        self.batch = []
+
+    def open(self):
+        # create review folder
+        if not os.path.exists(os.path.join(self.output_dir, 'review')):
+            os.mkdir(os.path.join(self.output_dir, 'review'))
+        # write header in a separate file
+        self.open_file(
+            os.path.join('review', 'review_header.csv'),
+            header="id:ID(review_id),overall:float,unixReviewTime:int,"
             "verified:boolean,vote:int,summary:string,reviewText:string,"
             "numImages:int\n")
-    with [
-            open(os.path.join(neo4j_import_dir, 'review', f"review{year}.csv"),
-                 'w') for year in range(1996, 2019)
-    ] as outfiles:
-        line_counts = [0 for outf in outfiles]
-        with open(path, 'r') as inf:
-            for line in tqdm(inf, total=REVIEW_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                # get fields
-                overall = j['overall'] if 'overall' in j else ''
-                time = j['unixReviewTime'] if 'unixReviewTime' in j else ''
-                verified = j['verified'] if 'verified' in j else ''
-                vote = j['vote'].replace(',', '') if 'vote' in j else ''
-                summary = escape_comma_newline(
-                    j['summary']) if 'summary' in j else ''
-                review_text = escape_comma_newline(
-                    j['reviewText']) if 'reviewText' in j else ''
-                num_images = len(j['image']) if 'image' in j else 0
-                # output
-                try:
-                    year = datetime.fromtimestamp(int(time)).year
-                except ValueError:
-                    year = 1996
-                idx = line_counts[year - 1996]
-                outfiles[year - 1996].write(
-                    f"R{year}{idx},{overall},{time},{verified},{vote},{summary},{review_text},{num_images}\n"
-                )
-                line_counts[year - 1996] += 1
-    print(f"output to {os.path.join(neo4j_import_dir, 'review')}")
+        self.outfiles = [
+            self.open_file(os.path.join('review', f"review{year}.csv"))
+            for year in range(1996, 2019)
+        ]
+
+    def consume(self, j, review_id, year):
+        # get fields
+        overall = j['overall'] if 'overall' in j else ''
+        time = j['unixReviewTime'] if 'unixReviewTime' in j else ''
+        verified = j['verified'] if 'verified' in j else ''
+        vote = j['vote'].replace(',', '') if 'vote' in j else ''
+        summary = j['summary'] if 'summary' in j else ''
+        review_text = j['reviewText'] if 'reviewText' in j else ''
+        num_images = len(j['image']) if 'image' in j else 0
+        self.batch.append((year, review_id, overall, time, verified, vote,
+                           summary, review_text, num_images))
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        summaries = escape_comma_newline_batch(row[6] for row in self.batch)
+        review_texts = escape_comma_newline_batch(row[7] for row in self.batch)
+        # output a block per year
+        blocks = [[] for _ in self.outfiles]
+        for (year, review_id, overall, time, verified, vote, _, _,
+             num_images), summary, review_text in zip(self.batch, summaries,
+                                                       review_texts):
+            blocks[year - 1996].append(
+                f"{review_id},{overall},{time},{verified},{vote},{summary},{review_text},{num_images}\n"
+            )
+        for outf, rows in zip(self.outfiles, blocks):
+            if rows:
+                outf.write("".join(rows))
+        self.batch = []
+
+    def finish_shard(self):
+        self.flush()
+        return super().finish_shard()
+
+    def close(self):
+        self.flush()
+        self.close_files()
+        print(f"output to {os.path.join(self.output_dir, 'review')}")
+
+
+def get_reviews(path):
+    """ Generate Review node file per year. """
+    process_reviews(path, [ReviewWriter()])
+
+
+class ProductWriter(MetaSink):
+    """ Writes the Product node file, including products that only exist in similar item info. """
+    fields = ("asin", "description", "price", "rank", "also_buy", "also_view",
+              "similar_item")
+
+    def __init__(self, output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.asins = new_asin_set()
+        self.extended_similar_asins = new_asin_set()
+        self.outf = None
+        self.similarf = None
+        # the (asin, description, price, rank) to escape and write
+        self.batch = []
+
+    def open(self):
+        self.outf = self.open_file(
+            "product.csv",
+            header="asin:ID,description:string[],price:string,rank:string\n")
+        if self.shard:
+            # a shard keeps the similar items per product, since only the
+            # first entry of a product repeated across shards counts on merge
+            self.similarf = self.open_file("product_similar.tsv")
+
+    def consume(self, j, linenum):
+        asin = j["asin"]
+        if asin in self.asins:  # avoid repeated product entry
+            return
+        self.asins.add(asin)
+        description = j["description"] if "description" in j else [""]
+        description = [
+            desc.strip() for desc in description if len(desc.strip()) > 0
+        ]
+        description = "; ".join(description)
+        price = j["price"] if "price" in j else ""
+        rank = j["rank"] if "rank" in j else ""
+        rank = rank[0] if isinstance(rank, list) else rank
+        self.batch.append((asin, description, price, rank))
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+        # handle product that only exist in similar item info
+        for key in ['also_buy', 'also_view', 'similar_item']:
+            if key in j:
+                ids = j[key]
+                if key == "similar_item":
+                    ids = [subj["asin"] for subj in ids if "asin" in subj]
+                for similar_asin in ids:
+                    if len(
+                            similar_asin
+                    ) > 0 and similar_asin != 'new-releases' and similar_asin not in self.asins:
+                        if self.shard:
+                            self.similarf.write(f"{asin}\t{similar_asin}\n")
+                        else:
+                            self.extended_similar_asins.add(similar_asin)
+
+    def flush(self):
+        columns = [
+            escape_comma_newline_batch(row[idx] for row in self.batch)
+            for idx in range(1, 4)
+        ]
+        self.outf.write("".join(
+            f"{asin},{description},{price},{rank}\n"
+            for (asin, _, _, _), description, price, rank in zip(
+                self.batch, *columns)))
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        for asin in sorted_asins(self.extended_similar_asins):
+            if asin not in self.asins:
+                self.outf.write(f"{asin},,,\n")
+        self.close_files()
+        print(f"output to {os.path.join(self.output_dir, 'product.csv')}")
+
+    def finish_shard(self):
+        self.flush()
+        # the asins are read back from the shard file on merge
+        self.asins = None
+        return super().finish_shard()
+
+    @classmethod
+    def merge(cls, shards):
+        merged = cls()
+        merged.open()
+        for shard in shards:
+            # keep the first entry of products repeated across shards
+            kept = new_asin_set()
+            with open(os.path.join(shard.output_dir, "product.csv")) as inf:
+                inf.readline()
+                for line in inf:
+                    asin, _ = line.split(',', 1)
+                    if asin not in merged.asins:
+                        merged.asins.add(asin)
+                        kept.add(asin)
+                        merged.outf.write(line)
+            with open(os.path.join(shard.output_dir,
+                                   "product_similar.tsv")) as inf:
+                for line in inf:
+                    asin, similar_asin = line[:-1].split('\t', 1)
+                    if asin in kept:
+                        merged.extended_similar_asins.add(similar_asin)
+        merged.close()
 
 
 def get_product(data_path):
     """ Generate Product node file. """
-    output_path = os.path.join(neo4j_import_dir, "product.csv")
-    asins = set()
-    extended_similar_asins = set()
-    with open(data_path, "r") as inf:
-        with open(output_path, "w") as outf:
-            outf.write(
-                "asin:ID,description:string[],price:string,rank:string\n")
-            for line in tqdm(inf, total=META_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                asin = j["asin"]
-                if asin in asins:  # avoid repeated product entry
-                    continue
-                asins.add(asin)
-                description = j["description"] if "description" in j else [""]
-                description = [
-                    desc.strip() for desc in description
-                    if len(desc.strip()) > 0
-                ]
-                description = "; ".join(description)
-                description = escape_comma_newline(description)
-                price = j["price"] if "price" in j else ""
-                price = escape_comma_newline(price)
-                rank = j["rank"] if "rank" in j else ""
-                rank = rank[0] if isinstance(rank, list) else rank
-                rank = escape_comma_newline(rank)
-                outf.write(f"{asin},{description},{price},{rank}\n")
-
-                # handle product that only exist in similar item info
-                for key in ['also_buy', 'also_view', 'similar_item']:
-                    if key in j:
-                        ids = j[key]
-                        if key == "similar_item":
-                            ids = [
-                                subj["asin"] for subj in ids if "asin" in subj
-                            ]
-                        for similar_asin in ids:
-                            if len(
-                                    similar_asin
-                            ) > 0 and similar_asin != 'new-releases' and similar_asin not in asins:
-                                extended_similar_asins.add(similar_asin)
-            for asin in sorted(extended_similar_asins):
-                if asin not in asins:
-                    outf.write(f"{asin},,,\n")
-    print(f"output to {output_path}")
+    process_meta(data_path, [ProductWriter()])
 
 
 def get_missing_products(rates_file,
@@ -222,15 +433,15 @@ def get_missing_products(rates_file,
     @param product_files The product.csv file, with header "asin,description,price,rank"
     @param output_name The output name
     """
-    rated_products = set()
+    rated_products = new_asin_set()
     with open(rates_file, 'r') as inf:
         for line in tqdm(inf, desc='Line'):
             _, asin = line.strip().rsplit(',', 1)
             rated_products.add(asin)
-    rated_products.remove(':END_ID')
+    rated_products.discard(':END_ID')
     print(f"rated_products {len(rated_products)}")
 
-    asins = set()
+    asins = new_asin_set()
     for product_file in product_files:
         print(f"processing {product_file}")
         with open(product_file, 'r') as inf:
@@ -238,12 +449,12 @@ def get_missing_products(rates_file,
                 asin, _ = line.split(',', 1)
                 asins.add(asin)
     with open(os.path.join(neo4j_import_dir, output_name), 'w') as outf:
-        for asin in rated_products:
+        for asin in sorted_asins(rated_products):
             if asin not in asins:
                 outf.write(f'{asin},,,\n')
 
 
-def generate_node_files(meta_path, review_path):
+def generate_node_files(meta_path, review_path, review=True):
     """
     Generate the node files.
         * Brand
@@ -252,6 +463,7 @@ def generate_node_files(meta_path, review_path):
         * Reviewer
         * Review
         * Product
+    @param review If false, skip the node files of the review file.
     """
     print(f'meta_path={meta_path}')
     print(f'review_path={review_path}')
@@ -260,14 +472,16 @@ def generate_node_files(meta_path, review_path):
     get_brands(meta_path, word_frequency=False, replace=BRAND_REPLACE_PATTERNS)
     print("Generate Category node files")
     get_categories(meta_path)
-    print("Generate Style node files")
-    get_style_keys(review_path)
-    print("Generate Reviewer node files")
-    get_reviewers(review_path)
+    if review:
+        print("Generate Style node files")
+        get_style_keys(review_path)
+        print("Generate Reviewer node files")
+        get_reviewers(review_path)
     print("Generate Product node files")
     get_product(meta_path)
-    print("Generate Review node files")
-    get_reviews(review_path)
+    if review:
+        print("Generate Review node files")
+        get_reviews(review_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,304 @@
+#! /usr/bin/env python3
+""" Single-pass processing of the input files shared by node and relationship writers. """
+
+import io
+import os
+import shutil
+from tqdm import tqdm
+
+import instrument
+from block_writer import open_output, sync
+from checkpoint import get_pass_checkpoint
+from decoding import get_decoder, merge_fields
+from line_index import line_count
+from readers import (is_gzip, iter_lines, iter_mapped_lines,
+                     prefilter_pattern)
+from utils import get_review_id, neo4j_import_dir, review_year
+
+# if set, the passes whose sinks all have prefilters read the mapped input and
+# skip the other lines as bytes, see `readers.iter_mapped_lines`
+MAPPED = os.getenv("NEO4J_LOADER_MAPPED") is not None
+
+
+class Sink:
+    """
+    Consumer of parsed records.
+
+    A sink opens its output files in `open`, receives the records of an input
+    file in `consume`, and writes any buffered output in `close`. A sink that
+    buffers records to clean their values in batches writes them in `flush`,
+    which is also called before a checkpoint.
+
+    When the input file is split into shards, each shard is processed by a
+    separate sink writing to its own output directory. The shard sink is
+    finished by `finish_shard` instead of `close`, and `merge` combines the
+    finished shard sinks into the final output.
+    """
+    # if set, only the lines containing the substring are passed to the sink,
+    # and with MAPPED, a pass whose sinks all have one skips the other lines
+    # as bytes
+    prefilter = None
+    # the top-level fields of the records used by the sink, None for all
+    fields = None
+    # set if the sink processes a shard of the input file
+    shard = False
+    # set if the state of the sink is its output files and `get_checkpoint`,
+    # so that a pass can resume from a checkpoint
+    resumable = False
+
+    def __init__(self, output_dir=neo4j_import_dir):
+        self.output_dir = output_dir
+        self.files = []
+        self.outputs = []
+        # the sizes of the output files to resume from, by name
+        self.resume_sizes = {}
+
+    def open_file(self, name, header=None):
+        """
+        Open an output file in the output directory, closed by `close_files`,
+        and written in blocks by `block_writer`.
+        @param name The file path relative to the output directory.
+        @param header The header line to write, if any.
+        """
+        path = os.path.join(self.output_dir, name)
+        if name in self.resume_sizes:
+            # drop the output written after the checkpoint
+            os.truncate(path, self.resume_sizes[name])
+            outf = open_output(path, "a")
+        else:
+            outf = open_output(path, "w")
+            if header is not None:
+                outf.write(header)
+        if instrument.current() is not None:
+            outf = instrument.TimedFile(outf, instrument.current())
+        self.files.append(outf)
+        self.outputs.append((name, header is not None))
+        return outf
+
+    def sync_files(self):
+        """ Write the buffered output of the files opened by `open_file` to disk. """
+        for outf in self.files:
+            sync(outf)
+
+    def close_files(self):
+        """ Close the files opened by `open_file`. """
+        for outf in self.files:
+            outf.close()
+        self.files = []
+
+    def open(self):
+        """ Prepare the output files. """
+
+    def consume(self, j, *args):
+        """ Process a parsed record. """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Write the records buffered by `consume`. """
+
+    def close(self):
+        """ Finish the output files. """
+        self.close_files()
+
+    def get_checkpoint(self):
+        """ @returns The JSON state of a resumable sink besides its output files. """
+        return None
+
+    def restore_checkpoint(self, state):
+        """ Restore the state returned by `get_checkpoint`, before `open`. """
+
+    def finish_shard(self):
+        """
+        Close the output files of a shard without finishing the output.
+        @returns The sink to pass to `merge`.
+        """
+        self.close_files()
+        return self
+
+    def __getstate__(self):
+        # drop the file handles when a finished shard is sent between processes
+        state = dict(self.__dict__)
+        for key, value in self.__dict__.items():
+            if isinstance(value, io.IOBase) or (isinstance(value, list) and any(
+                    isinstance(x, io.IOBase) for x in value)):
+                state[key] = None
+        return state
+
+    @classmethod
+    def merge(cls, shards):
+        """
+        Combine the finished shard sinks (in input order) into the final
+        output. By default, the output files of the shards are concatenated.
+        """
+        for name, has_header in shards[0].outputs:
+            output_path = os.path.join(neo4j_import_dir, name)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, "w") as outf:
+                for idx, shard in enumerate(shards):
+                    append_file(outf,
+                                os.path.join(shard.output_dir, name),
+                                skip_header=has_header and idx > 0)
+            print(f"output to {output_path}")
+
+
+class ReviewSink(Sink):
+    """ Consumer of parsed review records. """
+
+    def consume(self, j, review_id, year):
+        """
+        @param j The parsed review record.
+        @param review_id The review id, R{year}{line count of the year}.
+        @param year The review year used for the id and yearly files.
+        """
+        raise NotImplementedError
+
+
+class MetaSink(Sink):
+    """ Consumer of parsed product metadata records. """
+
+    def consume(self, j, linenum):
+        """
+        @param j The parsed metadata record.
+        @param linenum The line number in the meta file.
+        """
+        raise NotImplementedError
+
+
+def append_file(outf, path, skip_header=False):
+    """ Append the content of the file at path to the open file outf. """
+    with open(path, "r") as inf:
+        if skip_header:
+            inf.readline()
+        shutil.copyfileobj(inf, outf, 1 << 24)
+
+
+def close_sinks(sinks, metrics=None):
+    """ Close the sinks in order, timing them if the pass is instrumented. """
+    if metrics is None:
+        for sink in sinks:
+            sink.close()
+    else:
+        metrics.close_sinks(sinks)
+        metrics.end()
+
+
+def get_prefilter_pattern(path, sinks):
+    """
+    @returns The pattern of the prefilters of the sinks for
+             `readers.iter_mapped_lines`, or None if MAPPED is not set, a sink
+             takes every line or the file is compressed.
+    """
+    if not MAPPED or is_gzip(path) or any(sink.prefilter is None
+                                          for sink in sinks):
+        return None
+    return prefilter_pattern(sink.prefilter for sink in sinks)
+
+
+def process_reviews(path, sinks, start=0, end=None, line_counts=None):
+    """
+    Parse each line of the review file once and feed the record to all sinks.
+    Sinks are closed in the given order, so a sink may depend on files written
+    by the sinks before it.
+
+    @param start, end The byte range of a shard of the review file.
+    @param line_counts The review count per year before the shard, or None.
+    @returns The shard sinks to merge if a byte range is given.
+    """
+    shard = start != 0 or end is not None
+    checkpoint = None if shard else get_pass_checkpoint(path, sinks)
+    if checkpoint is not None:
+        start, first_line, line_counts = checkpoint.restore()
+    metrics = instrument.start_pass(path, sinks, shard)
+    for sink in sinks:
+        sink.shard = shard
+        sink.open()
+    decode = get_decoder(
+        merge_fields([("unixReviewTime", )] + [sink.fields for sink in sinks]))
+    if line_counts is None:
+        line_counts = [0 for year in range(1996, 2019)]  # line count per year
+    pattern = get_prefilter_pattern(path, sinks)
+
+    def skipped(data, line_start, line_end):
+        # the review ids count the lines skipped by the prefilters
+        line_counts[review_year(data, line_start, line_end) - 1996] += 1
+
+    if checkpoint is not None:
+        lines = checkpoint.iter_lines(start, first_line, line_counts, pattern,
+                                      skipped)
+    elif pattern is not None:
+        lines = (line for _, line in iter_mapped_lines(
+            path, start, end, pattern, skipped))
+    else:
+        lines = iter_lines(path, start, end)
+    if metrics is not None:
+        lines = metrics.timed_lines(lines)
+        decode = metrics.timed_decode(decode)
+    for line in tqdm(lines,
+                     total=None if shard else line_count(path),
+                     initial=0 if checkpoint is None else first_line,
+                     desc="Line",
+                     disable=shard):
+        if line is None:
+            continue
+        j = decode(line)
+        review_id, year = get_review_id(j, line_counts)
+        for sink in sinks:
+            sink.consume(j, review_id, year)
+        line_counts[year - 1996] += 1
+    if shard:
+        return [sink.finish_shard() for sink in sinks]
+    close_sinks(sinks, metrics)
+    if checkpoint is not None:
+        checkpoint.remove()
+    return None
+
+
+def process_meta(path, sinks, start=0, end=None, first_linenum=0):
+    """
+    Parse each line of the meta file once and feed the record to all sinks.
+
+    @param start, end The byte range of a shard of the meta file.
+    @param first_linenum The line number of the first line in the shard.
+    @returns The shard sinks to merge if a byte range is given.
+    """
+    shard = start != 0 or end is not None
+    checkpoint = None if shard else get_pass_checkpoint(path, sinks)
+    pattern = get_prefilter_pattern(path, sinks)
+    if checkpoint is not None:
+        start, first_linenum, _ = checkpoint.restore()
+        lines = checkpoint.iter_lines(start, first_linenum, None, pattern)
+    elif pattern is not None:
+        lines = (line for _, line in iter_mapped_lines(path, start, end,
+                                                       pattern))
+    else:
+        lines = iter_lines(path, start, end)
+    metrics = instrument.start_pass(path, sinks, shard)
+    for sink in sinks:
+        sink.shard = shard
+        sink.open()
+    decode = get_decoder(merge_fields(sink.fields for sink in sinks))
+    if metrics is not None:
+        lines = metrics.timed_lines(lines)
+        decode = metrics.timed_decode(decode)
+    for linenum, line in tqdm(enumerate(lines, first_linenum),
+                              total=None if shard else line_count(path),
+                              initial=first_linenum,
+                              desc="Line",
+                              disable=shard):
+        if line is None:
+            continue
+        targets = [
+            sink for sink in sinks
+            if sink.prefilter is None or sink.prefilter in line
+        ]
+        if len(targets) == 0:
+            continue
+        j = decode(line)
+        for sink in targets:
+            sink.consume(j, linenum)
+    if shard:
+        return [sink.finish_shard() for sink in sinks]
+    close_sinks(sinks, metrics)
+    if checkpoint is not None:
+        checkpoint.remove()
+    return None
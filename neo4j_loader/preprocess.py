@@ -2,22 +2,295 @@
 """ Preprocess Amazon product review data into node and relationship files"""
 
 import os
+from functools import partial
 
+import columnar
+import compress
 import nodes
 import relationships
-from utils import root, neo4j_import_dir
+from checkpoint import CHECKPOINT_BYTES, Manifest
+from pipeline import process_reviews
+from sharding import process_sharded
+from utils import BRAND_REPLACE_PATTERNS, root, neo4j_import_dir
+
+# outputs computed from the review file, in the order of dependency
+REVIEW_OUTPUTS = ["style", "reviewer", "review", "isWrittenBy", "refersTo", "rates"]
+# the files and directories of the review outputs in the import dir
+REVIEW_FILES = {
+    "style": ["style.csv"],
+    "reviewer": ["reviewers.csv"],
+    "review": ["review"],
+    "isWrittenBy": [
+        "Review_isWrittenBy_Reviewer.csv",
+        "Review_isWrittenBy_Reviewer_2018.csv"
+    ],
+    "refersTo":
+    ["Review_refersTo_Style.csv", "Review_refersTo_Style_2018.csv"],
+    "rates": ["Review_rates_Product.csv", "Review_rates_Product_2018.csv"],
+}
+PRODUCT_TO_PRODUCT_FILES = [
+    "Product_alsoBuy_Product.csv", "Product_alsoView_Product.csv",
+    "Product_isSimilarTo_Product.csv"
+]
+
+
+def get_review_sinks(outputs=None,
+                     memory_budget=None,
+                     output_dir=neo4j_import_dir):
+    """
+    @param outputs A list of REVIEW_OUTPUTS to produce. None for all.
+    @param memory_budget If set, the estimated bytes of reviewers to hold in
+           memory per process before spilling sorted runs to disk.
+    @param output_dir The directory to write the outputs to.
+    @returns The review sinks for the outputs.
+    """
+    if outputs is None:
+        outputs = REVIEW_OUTPUTS
+    unknown = set(outputs) - set(REVIEW_OUTPUTS)
+    assert len(unknown) == 0, f"unknown review outputs {sorted(unknown)}"
+    sink_types = {
+        "style": nodes.StyleKeyCollector,
+        "reviewer": nodes.ReviewerCollector,
+        "review": nodes.ReviewWriter,
+        "isWrittenBy": relationships.IsWrittenByWriter,
+        "rates": relationships.RatesWriter,
+    }
+    sinks = []
+    for output in REVIEW_OUTPUTS:
+        if output not in outputs:
+            continue
+        if output == "refersTo":
+            # resolve style ids after the Style node file is written
+            sinks.append(
+                relationships.RefersToWriter(deferred="style" in outputs,
+                                             output_dir=output_dir))
+        elif output == "reviewer":
+            sinks.append(
+                nodes.ReviewerCollector(memory_budget, output_dir=output_dir))
+        else:
+            sinks.append(sink_types[output](output_dir=output_dir))
+    return sinks
+
+
+def generate_review_files(review_path,
+                          outputs=None,
+                          workers=1,
+                          memory_budget=None):
+    """
+    Generate the node and relationship files of the review file in one pass.
+    @param outputs A list of REVIEW_OUTPUTS to produce. None for all.
+    @param workers If more than 1, process shards of the review file in
+           parallel on this number of worker processes.
+    @param memory_budget See `get_review_sinks`.
+    """
+    print(f'review_path={review_path}')
+    print(f"Generate review files {outputs or REVIEW_OUTPUTS}")
+    make_sinks = partial(get_review_sinks, outputs, memory_budget)
+    if workers > 1:
+        process_sharded(review_path, make_sinks, workers)
+    else:
+        process_reviews(review_path, make_sinks())
+
+
+def get_meta_node_sinks(output_dir=neo4j_import_dir):
+    """ The sinks of the Brand, Category and Product node files. """
+    return [
+        nodes.BrandCollector(word_frequency=False,
+                             replace=BRAND_REPLACE_PATTERNS,
+                             output_dir=output_dir),
+        nodes.CategoryCollector(output_dir=output_dir),
+        nodes.ProductWriter(output_dir=output_dir)
+    ]
+
+
+def get_meta_relationship_sinks(output_dir=neo4j_import_dir):
+    """ The sinks of the relationship files of the meta file. """
+    return [
+        relationships.HasBrandWriter(output_dir=output_dir),
+        relationships.BelongsToWriter(output_dir=output_dir),
+        relationships.ProductToProductWriter(
+            ['also_buy', 'also_view', 'similar_item'], output_dir=output_dir)
+    ]
+
+
+def generate_files_parallel(meta_path,
+                            review_path,
+                            workers,
+                            memory_budget=None):
+    """
+    Generate all node and relationship files, processing shards of the input
+    files on worker processes. The outputs are identical to the serial passes.
+    """
+    print(f'meta_path={meta_path}')
+    print("Generate node files of the meta file")
+    process_sharded(meta_path, get_meta_node_sinks, workers, review=False)
+    print("Generate relationship files of the meta file")
+    process_sharded(meta_path,
+                    get_meta_relationship_sinks,
+                    workers,
+                    review=False)
+    generate_review_files(review_path,
+                          workers=workers,
+                          memory_budget=memory_budget)
+
+
+def import_files(names):
+    """ The paths of files in the import dir. """
+    return [os.path.join(neo4j_import_dir, name) for name in names]
+
+
+def get_steps(meta_path, review_path, fused=True, workers=1,
+              memory_budget=None):
+    """
+    The preprocessing steps of `main`.
+    @returns A list of (name, function, inputs, outputs) of the steps.
+    """
+    brand_step = ("brand",
+                  partial(nodes.get_brands,
+                          meta_path,
+                          word_frequency=False,
+                          replace=BRAND_REPLACE_PATTERNS), [meta_path],
+                  import_files(["brand.csv"]))
+    category_step = ("category", partial(nodes.get_categories, meta_path),
+                     [meta_path], import_files(["category.csv"]))
+    product_step = ("product", partial(nodes.get_product, meta_path),
+                    [meta_path], import_files(["product.csv"]))
+    has_brand_step = ("hasBrand", partial(relationships.has_brand, meta_path),
+                      [meta_path] + import_files(["brand.csv"]),
+                      import_files(["Product_hasBrand_Brand.csv"]))
+    belongs_to_step = ("belongsTo",
+                       partial(relationships.belongs_to, meta_path),
+                       [meta_path] + import_files(["category.csv"]),
+                       import_files(["Product_belongsTo_Category.csv"]))
+    product_to_product_step = (
+        "productToProduct",
+        partial(relationships.product_to_product, meta_path,
+                ['also_buy', 'also_view', 'similar_item']), [meta_path],
+        import_files(PRODUCT_TO_PRODUCT_FILES))
+    review_outputs = import_files(
+        [name for output in REVIEW_OUTPUTS for name in REVIEW_FILES[output]])
+    if workers > 1:
+        steps = [
+            ("metaNodes",
+             partial(process_sharded,
+                     meta_path,
+                     get_meta_node_sinks,
+                     workers,
+                     review=False), [meta_path],
+             import_files(["brand.csv", "category.csv", "product.csv"])),
+            ("metaRelationships",
+             partial(process_sharded,
+                     meta_path,
+                     get_meta_relationship_sinks,
+                     workers,
+                     review=False),
+             [meta_path] + import_files(["brand.csv", "category.csv"]),
+             import_files(["Product_hasBrand_Brand.csv",
+                           "Product_belongsTo_Category.csv"] +
+                          PRODUCT_TO_PRODUCT_FILES)),
+            ("reviewFiles",
+             partial(generate_review_files,
+                     review_path,
+                     workers=workers,
+                     memory_budget=memory_budget), [review_path],
+             review_outputs),
+        ]
+    elif fused:
+        steps = [
+            brand_step, category_step, product_step,
+            ("reviewFiles",
+             partial(generate_review_files,
+                     review_path,
+                     memory_budget=memory_budget), [review_path],
+             review_outputs), has_brand_step, belongs_to_step,
+            product_to_product_step
+        ]
+    else:
+        review_steps = [
+            ("style", partial(nodes.get_style_keys, review_path), []),
+            ("reviewer",
+             partial(nodes.get_reviewers,
+                     review_path,
+                     memory_budget=memory_budget), []),
+            ("review", partial(nodes.get_reviews, review_path), []),
+            ("isWrittenBy", partial(relationships.is_written_by,
+                                    review_path), []),
+            ("refersTo", partial(relationships.refers_to, review_path),
+             ["style.csv"]),
+            ("rates", partial(relationships.rates, review_path), []),
+        ]
+        review_steps = {
+            name: (name, func, [review_path] + import_files(inputs),
+                   import_files(REVIEW_FILES[name]))
+            for name, func, inputs in review_steps
+        }
+        steps = [
+            brand_step, category_step, review_steps["style"],
+            review_steps["reviewer"], product_step, review_steps["review"],
+            has_brand_step, review_steps["isWrittenBy"],
+            review_steps["refersTo"], review_steps["rates"], belongs_to_step,
+            product_to_product_step
+        ]
+    rates_file, product_file = import_files(
+        ["Review_rates_Product.csv", "product.csv"])
+    steps.append(("missingProduct",
+                  partial(nodes.get_missing_products, rates_file,
+                          [product_file]), [rates_file, product_file],
+                  import_files(["missing_product.csv"])))
+    return steps
 
 
 def main(meta_path=os.path.join(root, "All_Amazon_Meta.json"),
-         review_path=os.path.join(root, "All_Amazon_Review.json")):
-    """ main function """
-    nodes.generate_node_files(meta_path, review_path)
-    relationships.generate_relationship_files(meta_path, review_path)
-    nodes.get_missing_products(
-        os.path.join(neo4j_import_dir, 'Review_rates_Product.csv'), [
-            os.path.join(neo4j_import_dir, 'product.csv'),
-            os.path.join(neo4j_import_dir, 'extended_product.csv')
-        ])
+         review_path=os.path.join(root, "All_Amazon_Review.json"),
+         fused=True,
+         workers=1,
+         memory_budget=None,
+         resume=False,
+         checkpoint_bytes=None,
+         output_format="csv",
+         compress_output=False):
+    """
+    main function
+    @param fused If true, generate all review files in a single pass over the
+           review file. Otherwise, read the review file once per output.
+    @param workers If more than 1, process shards of the input files in
+           parallel on this number of worker processes.
+    @param memory_budget If set, the estimated bytes of reviewers to hold in
+           memory per process before spilling sorted runs to disk.
+    @param resume If true, skip the steps completed by a previous run with the
+           same input and output files, and resume an interrupted pass from
+           its last checkpoint.
+    @param checkpoint_bytes The input bytes between the checkpoints of a
+           pass. By default, CHECKPOINT_BYTES with resume, and no checkpoints
+           otherwise, since a checkpoint of the fused review pass spills the
+           reviewers to a run file.
+    @param output_format One of columnar.FORMATS. With "parquet" or "arrow",
+           the tables are also written in that format from the CSVs, which
+           the later steps and the import read.
+    @param compress_output If true, compress the CSV files to .csv.gz files
+           once all steps are complete, on `workers` threads. The compressed
+           files are imported as they are, but the steps cannot resume from
+           them.
+    """
+    assert output_format in columnar.FORMATS, \
+        f"output_format must be one of {columnar.FORMATS}"
+    if checkpoint_bytes is None and resume:
+        checkpoint_bytes = CHECKPOINT_BYTES
+    manifest = Manifest(resume, checkpoint_bytes)
+    for name, func, inputs, outputs in get_steps(meta_path, review_path,
+                                                 fused, workers,
+                                                 memory_budget):
+        manifest.run(name, func, inputs, outputs)
+    if output_format != "csv":
+        inputs = import_files(
+            path for groups in columnar.table_groups().values()
+            for paths in groups for path in paths)
+        outputs = list(columnar.output_paths(output_format).values())
+        manifest.run("columnar",
+                     partial(columnar.write_tables, output_format), inputs,
+                     outputs)
+    if compress_output:
+        compress.compress_files(neo4j_import_dir, workers)
 
 
 if __name__ == "__main__":
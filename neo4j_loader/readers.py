@@ -0,0 +1,203 @@
+#! /usr/bin/env python3
+"""
+Readers of the JSON input files.
+
+Inputs ending with .gz are decompressed on the fly, by a pigz or gzip process
+when available or else by a background thread, so that decompression overlaps
+with JSON parsing and the files need not be decompressed to disk.
+
+If NEO4J_LOADER_MAPPED is set, the passes whose sinks only use the lines
+containing some byte strings, e.g. '"brand"', read an uncompressed input with
+`iter_mapped_lines`. The file is mapped into memory, and the byte strings are
+searched for in the map, so that the other lines are skipped without being
+copied or decoded.
+"""
+
+import gzip
+import io
+import mmap
+import os
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import threading
+
+BLOCK_SIZE = 1 << 22
+DECOMPRESSORS = ["pigz", "gzip", "thread"]
+
+
+def is_gzip(path):
+    """ Check if the path is a gzip file by its suffix. """
+    return path.endswith(".gz")
+
+
+class ThreadDecompressor(io.RawIOBase):
+    """ Raw stream of the blocks of a gzip file decompressed by a background thread. """
+
+    def __init__(self, path, queue_size=8):
+        super().__init__()
+        self.blocks = queue.Queue(queue_size)
+        self.pending = memoryview(b"")
+        self.eof = False
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._decompress,
+                                       args=(path, ),
+                                       daemon=True)
+        self.thread.start()
+
+    def _decompress(self, path):
+        try:
+            with gzip.open(path, "rb") as inf:
+                while not self.stopped.is_set():
+                    block = inf.read(BLOCK_SIZE)
+                    self.blocks.put(block)
+                    if len(block) == 0:
+                        return
+        except Exception as e:  # reported to the reader
+            self.error = e
+            self.blocks.put(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.pending) == 0:
+            if self.eof:
+                return 0
+            block = self.blocks.get()
+            if len(block) == 0:
+                self.eof = True
+                if self.error is not None:
+                    raise self.error
+                return 0
+            self.pending = memoryview(block)
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            # unblock the decompression thread
+            while self.thread.is_alive():
+                try:
+                    self.blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        super().close()
+
+
+class ProcessDecompressor(io.RawIOBase):
+    """ Raw stream of the output of a decompression process. """
+
+    def __init__(self, command, path):
+        super().__init__()
+        self.command = command
+        self.process = subprocess.Popen([command, "-dc", path],
+                                        stdout=subprocess.PIPE,
+                                        bufsize=BLOCK_SIZE)
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = self.process.stdout.readinto(b)
+        if size == 0 and not self.eof:
+            self.eof = True
+            if self.process.wait() != 0:
+                raise OSError(
+                    f"{self.command} exited with code {self.process.returncode}"
+                )
+        return size
+
+    def close(self):
+        if not self.closed:
+            if not self.eof:
+                self.process.send_signal(signal.SIGTERM)
+            self.process.stdout.close()
+            self.process.wait()
+        super().close()
+
+
+def open_input(path, decompressor=None):
+    """
+    Open an input file for reading text lines.
+    @param decompressor One of DECOMPRESSORS for .gz files. By default, use
+           the first available one.
+    """
+    if not is_gzip(path):
+        return open(path, "r")
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if decompressor is None:
+        decompressor = next(x for x in DECOMPRESSORS
+                            if x == "thread" or shutil.which(x) is not None)
+    assert decompressor in DECOMPRESSORS, f"unknown decompressor {decompressor}"
+    if decompressor == "thread":
+        raw = ThreadDecompressor(path)
+    else:
+        raw = ProcessDecompressor(decompressor, path)
+    return io.TextIOWrapper(io.BufferedReader(raw, BLOCK_SIZE))
+
+
+def iter_lines(path, start=0, end=None):
+    """
+    Iterate over the lines of a text file.
+    @param start The byte offset of the first line.
+    @param end The byte offset to stop at, which must be a line boundary. None
+           for the end of the file.
+    """
+    if start == 0 and end is None:
+        with open_input(path) as inf:
+            yield from inf
+        return
+    assert not is_gzip(path), "cannot read a byte range of a gzip file"
+    with open(path, "rb") as inf:
+        inf.seek(start)
+        pos = start
+        for line in inf:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line.decode("utf-8")
+
+
+def prefilter_pattern(prefilters):
+    """ A bytes pattern matching the lines that contain any of the strings. """
+    return re.compile(b"|".join(
+        re.escape(prefilter.encode("utf-8")) for prefilter in prefilters))
+
+
+def iter_mapped_lines(path, start=0, end=None, pattern=None, skipped=None):
+    """
+    Iterate over the lines of an uncompressed file mapped into memory.
+    @param start, end The byte range to read, as in `iter_lines`.
+    @param pattern A compiled bytes pattern, see `prefilter_pattern`. The lines
+           it does not match are given as None.
+    @param skipped If set, called with the map and the start and end offsets
+           of each line given as None, which it can read without copying.
+    @returns An iterator of the byte offset after each line and the line.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as inf, mmap.mmap(inf.fileno(), 0,
+                                            access=mmap.ACCESS_READ) as data:
+        end = len(data) if end is None else end
+        find = data.find
+        search = None if pattern is None else pattern.search
+        pos = start
+        while pos < end:
+            eol = find(b"\n", pos, end)
+            eol = end if eol < 0 else eol + 1
+            if search is None or search(data, pos, eol) is not None:
+                yield eol, data[pos:eol].decode("utf-8")
+            else:
+                if skipped is not None:
+                    skipped(data, pos, eol)
+                yield eol, None
+            pos = eol
@@ -2,230 +2,335 @@
 """ Generate relationship files for Amazon product review data. """
 
 import os
-import json
-from datetime import datetime
-import pandas as pd
-from tqdm import tqdm
 
+from node_index import load_brand_index, load_category_index, load_style_index
+from pipeline import MetaSink, ReviewSink, process_meta, process_reviews
 from utils import *
 
 
+class HasBrandWriter(MetaSink):
+    """ Writes Product_hasBrand_Brand.csv. """
+    prefilter = '"brand"'
+    fields = ("asin", "brand")
+    resumable = True
+
+    def __init__(self, brand_file_name="brand.csv",
+                 output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.brand_file_name = brand_file_name
+        self.brands = None
+        self.outf = None
+
+    def open(self):
+        # load brand signature to id index
+        self.brands = load_brand_index(self.brand_file_name)
+        self.outf = self.open_file("Product_hasBrand_Brand.csv",
+                                   header=":START_ID,:END_ID(brand_id)\n")
+
+    def consume(self, j, linenum):
+        if 'brand' in j:
+            value = clean_brand_values(j['brand'].strip(),
+                                       BRAND_REPLACE_PATTERNS)
+            if value is None:
+                return
+            signature, value = simplify_value(value)
+            assert len(j['asin']) > 0
+            brand_id = self.brands.get_id(
+                signature, f"line {linenum}, brand {j['brand']!r}")
+            self.outf.write(f"{j['asin']},{brand_id}\n")
+
+    def close(self):
+        self.close_files()
+        print(
+            f"output to {os.path.join(self.output_dir, 'Product_hasBrand_Brand.csv')}"
+        )
+
+    def finish_shard(self):
+        self.brands = None
+        return super().finish_shard()
+
+
 def has_brand(meta_path, brand_file_name="brand.csv"):
     """
     Generate Product_hasBrand_Brand relationship file.
     """
-    brand_path = os.path.join(neo4j_import_dir, brand_file_name)
-    output_path = os.path.join(neo4j_import_dir, "Product_hasBrand_Brand.csv")
-
-    # load brand id to name dict
-    print(f"read brands {brand_path}")
-    name_col = 'name:string'
-    brands = pd.read_csv(brand_path,
-                         converters={
-                             'name:string': str,
-                             'id:ID(brand_id)': str
-                         })
-    brands[name_col] = brands[name_col].apply(lambda x: simplify_value(x)[0])
-    brands = brands.set_index(name_col)
-    # compute edges
-    with open(meta_path, "r") as inf:
-        with open(output_path, 'w') as outf:
-            outf.write(":START_ID,:END_ID(brand_id)\n")
-            for linenum, line in tqdm(enumerate(inf),
-                                      total=META_COUNT,
-                                      desc="Line"):
-                j = json.loads(line.strip())
-                if 'brand' in j:
-                    value = clean_brand_values(j['brand'].strip(),
-                                               BRAND_REPLACE_PATTERNS)
-                    if value is None:
-                        continue
-                    signature, value = simplify_value(value)
-                    assert len(j['asin']) > 0
-                    assert signature in brands.index, f"{linenum},{j['brand']},{value},{signature}."
-                    brand_id = brands.loc[signature]["id:ID(brand_id)"]
-                    outf.write(f"{j['asin']},{brand_id}\n")
-        print(f"output to {output_path}")
+    process_meta(meta_path, [HasBrandWriter(brand_file_name)])
+
+
+class IncrementalEdgeWriter(ReviewSink):
+    """
+    Writes a relationship file of reviews, with the edges of 2018 in a
+    separate increment file.
+    """
+    resumable = True
+
+    def __init__(self, name, header, output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.name = name
+        self.header = header
+        self.outf = None
+        self.incf = None
+
+    def open(self):
+        self.outf = self.open_file(f"{self.name}.csv", header=self.header)
+        self.incf = self.open_file(f"{self.name}_2018.csv",
+                                   header=self.header)
+
+    def write(self, year, row):
+        """ Write an edge row to the static or increment file by year. """
+        if year == 2018:
+            self.incf.write(row)
+        else:
+            self.outf.write(row)
+
+    def close(self):
+        self.close_files()
+        print(
+            f"static data output to {os.path.join(self.output_dir, self.name)}.csv"
+        )
+        print(
+            f"increment data output to {os.path.join(self.output_dir, self.name)}_2018.csv"
+        )
 
 
-def get_review_id(j, line_counts):
-    """ Get review id by year and line count. """
-    time = j['unixReviewTime'] if 'unixReviewTime' in j else ''
-    try:
-        year = datetime.fromtimestamp(int(time)).year
-    except ValueError:
-        year = 1996
-    return f"R{year}{line_counts[year-1996]}", year
+class IsWrittenByWriter(IncrementalEdgeWriter):
+    """ Writes Review_isWrittenBy_Reviewer.csv. """
+    fields = ("reviewerID", )
+
+    def __init__(self, output_dir=neo4j_import_dir):
+        super().__init__("Review_isWrittenBy_Reviewer",
+                         ":START_ID(review_id),:END_ID\n", output_dir)
+
+    def consume(self, j, review_id, year):
+        if "reviewerID" in j and len(j["reviewerID"]) > 0:
+            self.write(year, f"{review_id},{j['reviewerID']}\n")
 
 
 def is_written_by(data_path):
     """ Generate relationship file Review_isWrittenBy_Reviewer.csv. """
-    output_path = os.path.join(neo4j_import_dir,
-                               "Review_isWrittenBy_Reviewer.csv")
-    inc_path = os.path.join(neo4j_import_dir,
-                            "Review_isWrittenBy_Reviewer_2018.csv")
-    line_counts = [0 for year in range(1996, 2019)]  # line count per year
-    with open(output_path, "w") as outf, open(inc_path, "w") as incf:
-        outf.write(":START_ID(review_id),:END_ID\n")
-        incf.write(":START_ID(review_id),:END_ID\n")
-        with open(data_path, "r") as inf:
-            for line in tqdm(inf, total=REVIEW_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                review_id, year = get_review_id(j, line_counts)
-                if "reviewerID" in j and len(j["reviewerID"]) > 0:
-                    reviewer_id = j["reviewerID"]
-                    if year == 2018:
-                        incf.write(f"{review_id},{reviewer_id}\n")
+    process_reviews(data_path, [IsWrittenByWriter()])
+
+
+class RefersToWriter(IncrementalEdgeWriter):
+    """
+    Writes Review_refersTo_Style.csv.
+
+    If deferred, the edges are spooled with their style keys and resolved to
+    style ids on close, so that the Style node file can be produced in the
+    same pass over the review file.
+    """
+    prefilter = '"style"'
+    fields = ("style", )
+
+    def __init__(self,
+                 style_file_name='style.csv',
+                 deferred=False,
+                 output_dir=neo4j_import_dir):
+        super().__init__(
+            "Review_refersTo_Style",
+            ":START_ID(review_id),value:string,:END_ID(style_id)\n",
+            output_dir)
+        self.style_file_name = style_file_name
+        self.deferred = deferred
+        self.styles = None
+        self.spool = None
+        self.key_codes = {}
+
+    @property
+    def spool_path(self):
+        """ The file of edges waiting for style ids. """
+        return os.path.join(self.output_dir, f"{self.name}.spool")
+
+    def open(self):
+        if self.deferred:
+            self.spool = self.open_file(f"{self.name}.spool")
+        else:
+            super().open()
+            self.styles = load_style_index(self.style_file_name)
+
+    def consume(self, j, review_id, year):
+        if "style" in j:
+            if isinstance(j["style"], dict):
+                for key in j["style"]:
+                    # edge weight and dst node
+                    value = escape_comma_newline(j["style"][key].strip())
+                    key = clean_style_key(key)
+                    if self.deferred:
+                        code = self.key_codes.setdefault(
+                            key, len(self.key_codes))
+                        self.spool.write(
+                            f"{int(year == 2018)}{code},{review_id},{value}\n")
                     else:
-                        outf.write(f"{review_id},{reviewer_id}\n")
-                line_counts[year - 1996] += 1
-    print(f"static data output to {output_path}")
-    print(f"increment data output to {inc_path}")
+                        style_id = self.styles.get_id(
+                            key, f"review {review_id}")
+                        self.write(year, f"{review_id},{value},{style_id}\n")
+
+    def get_checkpoint(self):
+        return self.key_codes
+
+    def restore_checkpoint(self, state):
+        self.key_codes = state
+
+    def resolve_spool(self, spool_path, key_codes):
+        """ Write the spooled edges with the style ids of their keys. """
+        style_ids = [None] * len(key_codes)
+        for key, code in key_codes.items():
+            style_ids[code] = self.styles.get_id(key)
+        with open(spool_path, "r") as spool:
+            for line in spool:
+                code, row = line.split(',', 1)
+                year = 2018 if code[0] == '1' else None
+                self.write(year, f"{row[:-1]},{style_ids[int(code[1:])]}\n")
+
+    def close(self):
+        if self.deferred:
+            self.close_files()
+            super().open()
+            self.styles = load_style_index(self.style_file_name)
+            self.resolve_spool(self.spool_path, self.key_codes)
+            os.remove(self.spool_path)
+        super().close()
+
+    def finish_shard(self):
+        self.styles = None
+        return super().finish_shard()
+
+    @classmethod
+    def merge(cls, shards):
+        if not shards[0].deferred:
+            return super().merge(shards)
+        merged = cls(shards[0].style_file_name)
+        merged.open()
+        for shard in shards:
+            merged.resolve_spool(shard.spool_path, shard.key_codes)
+        merged.close()
+        return None
 
 
 def refers_to(data_path, style_file_name='style.csv'):
     """ Generate relationship file Review_refersTo_Style.csv """
-    # load style id to key dict
-    styles = pd.read_csv(os.path.join(neo4j_import_dir, style_file_name),
-                         converters={
-                             'key:string': str,
-                             'id:ID(style_id)': str
-                         },
-                         index_col='key:string')
-
-    # prepare output files
-    output_path = os.path.join(neo4j_import_dir, "Review_refersTo_Style.csv")
-    inc_path = os.path.join(neo4j_import_dir, "Review_refersTo_Style_2018.csv")
-    line_counts = [0 for year in range(1996, 2019)]  # line count per year
-    with open(output_path, 'w') as outf, open(inc_path, 'w') as incf:
-        outf.write(":START_ID(review_id),value:string,:END_ID(style_id)\n")
-        incf.write(":START_ID(review_id),value:string,:END_ID(style_id)\n")
-
-        # compute edges
-        with open(data_path, "r") as inf:
-            for line in tqdm(inf, total=REVIEW_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                review_id, year = get_review_id(j, line_counts)
-                if "style" in j:
-                    if isinstance(j["style"], dict):
-                        for key in j["style"]:
-                            # edge weight and dst node
-                            value = escape_comma_newline(
-                                j["style"][key].strip())
-                            style_id = styles.loc[clean_style_key(
-                                key)]['id:ID(style_id)']
-                            if year == 2018:
-                                incf.write(f"{review_id},{value},{style_id}\n")
-                            else:
-                                outf.write(f"{review_id},{value},{style_id}\n")
-                line_counts[year - 1996] += 1
-    print(f"static data output to {output_path}")
-    print(f"increment data output to {inc_path}")
+    process_reviews(data_path, [RefersToWriter(style_file_name)])
+
+
+class RatesWriter(IncrementalEdgeWriter):
+    """ Writes Review_rates_Product.csv. """
+    fields = ("asin", )
+
+    def __init__(self, output_dir=neo4j_import_dir):
+        super().__init__("Review_rates_Product",
+                         ":START_ID(review_id),:END_ID\n", output_dir)
+
+    def consume(self, j, review_id, year):
+        if "asin" in j:
+            self.write(year, f"{review_id},{j['asin']}\n")
 
 
 def rates(data_path):
     """ Generate relationship file Review_rates_Product.csv """
-    # prepare output files
-    output_path = os.path.join(neo4j_import_dir, "Review_rates_Product.csv")
-    inc_path = os.path.join(neo4j_import_dir, "Review_rates_Product_2018.csv")
-    line_counts = [0 for year in range(1996, 2019)]  # line count per year
-    with open(output_path, 'w') as outf, open(inc_path, 'w') as incf:
-        outf.write(":START_ID(review_id),:END_ID\n")
-        incf.write(":START_ID(review_id),:END_ID\n")
-
-        # compute edges
-        with open(data_path, "r") as inf:
-            for line in tqdm(inf, total=REVIEW_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                review_id, year = get_review_id(j, line_counts)
-                if "asin" in j:
-                    if year == 2018:
-                        incf.write(f"{review_id},{j['asin']}\n")
-                    else:
-                        outf.write(f"{review_id},{j['asin']}\n")
-                line_counts[year - 1996] += 1
-    print(f"static data output to {output_path}")
-    print(f"increment data output to {inc_path}")
+    process_reviews(data_path, [RatesWriter()])
+
+
+class BelongsToWriter(MetaSink):
+    """ Writes Product_belongsTo_Category.csv. """
+    fields = ("asin", "category")
+    resumable = True
+
+    def __init__(self,
+                 category_file_name='category.csv',
+                 output_dir=neo4j_import_dir):
+        super().__init__(output_dir)
+        self.category_file_name = category_file_name
+        self.categories = None
+        self.outf = None
+
+    def open(self):
+        # load category name to id index
+        self.categories = load_category_index(self.category_file_name)
+        self.outf = self.open_file("Product_belongsTo_Category.csv",
+                                   header=":START_ID,:END_ID(category_id)\n")
+
+    def consume(self, j, linenum):
+        if "category" in j:
+            # we only use the first category and force the first category
+            # to be in the category list
+            value = j["category"][0].replace(",", " &")
+            category_id = self.categories.get_id(
+                value, f"line {linenum}, asin {j['asin']}")
+            self.outf.write(f"{j['asin']},{category_id}\n")
+
+    def close(self):
+        self.close_files()
+        print(
+            f"output to {os.path.join(self.output_dir, 'Product_belongsTo_Category.csv')}"
+        )
+
+    def finish_shard(self):
+        self.categories = None
+        return super().finish_shard()
 
 
 def belongs_to(data_path, category_file_name='category.csv'):
     """ Generate relationship file Product_belongsTo_Category.csv """
-    # load category id to name dict
-    name_col, id_col = 'name:string', 'id:ID(category_id)'
-    categories = pd.read_csv(os.path.join(neo4j_import_dir,
-                                          category_file_name),
-                             converters={
-                                 name_col: str,
-                                 id_col: str
-                             })
-    categories[name_col] = categories[name_col].str.strip()
-    categories = categories.set_index(name_col)
-
-    # compute edges
-    output_path = os.path.join(neo4j_import_dir,
-                               "Product_belongsTo_Category.csv")
-    with open(data_path, "r") as inf:
-        with open(output_path, 'w') as outf:
-            outf.write(":START_ID,:END_ID(category_id)\n")
-            for line in tqdm(inf, total=META_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                if "category" in j:
-                    # we only use the first category and force the first category
-                    # to be in the category list
-                    value = j["category"][0].replace(",", " &")
-                    assert value in categories.index, "category not in category list"
-                    category_id = categories.loc[value][id_col]
-                    outf.write(f"{j['asin']},{category_id}\n")
-    print(f"output to {output_path}")
+    process_meta(data_path, [BelongsToWriter(category_file_name)])
 
 
-def product_to_product(data_path, key="also_buy"):
-    """ Generate relationship files for product-product relations.
-        @param key Can be a key string or a list of keys.
-    """
+class ProductToProductWriter(MetaSink):
+    """ Writes the relationship files for product-product relations. """
+    resumable = True
     edge_map = {
         "similar_item": "isSimilarTo",
         "also_buy": "alsoBuy",
         "also_view": "alsoView"
     }
-    if not isinstance(key, list):
-        key = [key]
-    out_files = [f"Product_{edge_map[k]}_Product.csv" for k in key]
-    with [open(os.path.join(neo4j_import_dir, x), 'r')
-          for x in out_files] as out_files:
-        for outf in out_files:
-            outf.write(":START_ID,:END_ID\n")
-
-        with open(data_path, "r") as inf:
-            for line in tqdm(inf, total=META_COUNT, desc="Line"):
-                j = json.loads(line.strip())
-                for k, out_file in zip(key, out_files):
-                    if k in j:
-                        data_list = j[k]
-                        if k == "similar_item":
-                            data_list = [
-                                subj["asin"] for subj in data_list
-                                if "asin" in subj
-                            ]
-                        for dst_asin in data_list:
-                            if len(dst_asin
-                                   ) == 0 or dst_asin == "new-releases":
-                                continue
-                            out_file.write(f"{j['asin']},{dst_asin}\n")
-
-
-def generate_relationship_files(meta_path, review_path):
+
+    def __init__(self, key="also_buy", output_dir=neo4j_import_dir):
+        """ @param key Can be a key string or a list of keys. """
+        super().__init__(output_dir)
+        self.key = key if isinstance(key, list) else [key]
+        self.fields = tuple(self.key) + ("asin", )
+        self.out_files = []
+
+    def open(self):
+        self.out_files = [
+            self.open_file(f"Product_{self.edge_map[k]}_Product.csv",
+                           header=":START_ID,:END_ID\n") for k in self.key
+        ]
+
+    def consume(self, j, linenum):
+        for k, out_file in zip(self.key, self.out_files):
+            if k in j:
+                data_list = j[k]
+                if k == "similar_item":
+                    data_list = [
+                        subj["asin"] for subj in data_list if "asin" in subj
+                    ]
+                for dst_asin in data_list:
+                    if len(dst_asin) == 0 or dst_asin == "new-releases":
+                        continue
+                    out_file.write(f"{j['asin']},{dst_asin}\n")
+
+
+def product_to_product(data_path, key="also_buy"):
+    """ Generate relationship files for product-product relations.
+        @param key Can be a key string or a list of keys.
+    """
+    process_meta(data_path, [ProductToProductWriter(key)])
+
+
+def generate_relationship_files(meta_path, review_path, review=True):
     """
     Generate the relationship files.
+    @param review If false, skip the relationship files of the review file.
     """
     print(f'meta_path={meta_path}')
     print(f'review_path={review_path}')
 
     print("Generate relationship files")
     has_brand(meta_path)
-    is_written_by(review_path)
-    refers_to(review_path)
-    rates(review_path)
+    if review:
+        is_written_by(review_path)
+        refers_to(review_path)
+        rates(review_path)
     belongs_to(meta_path)
     product_to_product(meta_path, ['also_buy', 'also_view', 'similar_item'])
 
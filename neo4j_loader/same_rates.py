@@ -0,0 +1,110 @@
+"""
+The sameRates (usu) edges of a category, between the reviewers who gave a
+product the same rating.
+
+The reviews of the category are grouped by (product, overall), and a groups
+file holds the reviewer ids of a group per line. Each ordered pair of the
+reviews of a group, including the pairs of two reviews by the same reviewer,
+gives an edge (reviewer1, reviewer2), written once to User_usu_User.csv.
+
+The edges are quadratic in the size of a group, so the groups can be capped to
+a sample of max_group_size reviews, which is seeded by the group for the same
+output across runs. The distinct edges are found in shards by the hash of
+reviewer1, so that a shard only holds its own edges in memory and the shards
+of the groups files run in parallel. With one shard, the edges are written in
+the order of the groups.
+"""
+
+import os
+import random
+import zlib
+from multiprocessing import Pool
+
+
+def write_groups(groups, path):
+    """
+    Write a groups file, leaving out the groups of one review, which have no
+    edges.
+    @param groups The lists of reviewer ids of the groups.
+    @returns The number of groups written.
+    """
+    count = 0
+    with open(path, "w") as outf:
+        for reviewers in groups:
+            if len(reviewers) > 1:
+                outf.write(",".join(reviewers) + "\n")
+                count += 1
+    return count
+
+
+def sample_group(line, max_group_size=None):
+    """ The reviewer ids of a line of a groups file, sampled down to max_group_size. """
+    reviewers = line.rstrip("\n").split(",")
+    if max_group_size is not None and len(reviewers) > max_group_size:
+        reviewers = random.Random(zlib.crc32(line.encode())).sample(
+            reviewers, max_group_size)
+    return reviewers
+
+
+def shard_path(output_path, shard):
+    return f"{output_path}.{shard}"
+
+
+def write_shard(groups_path, output_path, shard=0, shards=1,
+                max_group_size=None):
+    """
+    Write the distinct edges of a shard of a groups file, without header.
+    @returns The number of edges written.
+    """
+    distinct = set()
+    with open(groups_path, "r") as inf, open(output_path, "w") as outf:
+        for line in inf:
+            reviewers = sample_group(line, max_group_size)
+            for idx1, user1 in enumerate(reviewers):
+                if shards > 1 and zlib.crc32(user1.encode()) % shards != shard:
+                    continue
+                for idx2, user2 in enumerate(reviewers):
+                    if idx1 != idx2 and (user1, user2) not in distinct:
+                        distinct.add((user1, user2))
+                        outf.write(f"{user1},{user2}\n")
+    return len(distinct)
+
+
+def shard_tasks(groups_path, output_path, shards=1, max_group_size=None):
+    """ The arguments of write_shard for each shard of a groups file. """
+    return [(groups_path, shard_path(output_path, shard), shard, shards,
+             max_group_size) for shard in range(shards)]
+
+
+def merge_shards(groups_path, output_path, shards=1):
+    """ Write User_usu_User.csv from its shards, and remove them and the groups file. """
+    with open(output_path, "w") as outf:
+        outf.write(":START_ID,:END_ID\n")
+        for shard in range(shards):
+            path = shard_path(output_path, shard)
+            with open(path, "r") as inf:
+                while True:
+                    chunk = inf.read(1 << 24)
+                    if not chunk:
+                        break
+                    outf.write(chunk)
+            os.remove(path)
+    os.remove(groups_path)
+
+
+def write_same_rates(groups_path,
+                     output_path,
+                     workers=1,
+                     max_group_size=None):
+    """
+    Write User_usu_User.csv from a groups file, in a shard per worker.
+    @returns The number of edges written.
+    """
+    tasks = shard_tasks(groups_path, output_path, workers, max_group_size)
+    if workers > 1:
+        with Pool(workers) as pool:
+            counts = pool.starmap(write_shard, tasks)
+    else:
+        counts = [write_shard(*task) for task in tasks]
+    merge_shards(groups_path, output_path, workers)
+    return sum(counts)
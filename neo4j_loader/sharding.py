@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+"""
+Process the review and meta files in byte-range shards on worker processes.
+
+The review ids R{year}{line count of the year} depend on the position of a
+review in the file. Before processing, a cheap pass counts the reviews per
+year in each shard, and the prefix sums give the line counts per year at the
+start of each shard, so the shards produce the same ids as a serial pass.
+The line numbers of the meta records at the start of the shards are given by
+the `line_index.LineIndex` of the meta file.
+"""
+
+import os
+import shutil
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+
+from line_index import get_line_index
+from pipeline import process_meta, process_reviews
+from readers import is_gzip
+from utils import neo4j_import_dir, review_year
+
+SHARD_DIR = os.path.join(neo4j_import_dir, ".shards")
+
+
+def find_shards(path, num_shards):
+    """
+    Split a file into byte ranges that start and end at line boundaries.
+    @returns A list of (start, end) byte offsets.
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, "rb") as inf:
+        for idx in range(1, num_shards):
+            pos = max(size * idx // num_shards, offsets[-1], 1)
+            if pos >= size:
+                break
+            # move to the start of the next line
+            inf.seek(pos - 1)
+            inf.readline()
+            pos = inf.tell()
+            if offsets[-1] < pos < size:
+                offsets.append(pos)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def count_review_years(path, shard):
+    """ Count the reviews per year in a shard, indexed like the review line counts. """
+    start, end = shard
+    counts = [0 for year in range(1996, 2019)]
+    with open(path, "rb") as inf:
+        inf.seek(start)
+        pos = start
+        for line in inf:
+            if pos >= end:
+                break
+            pos += len(line)
+            counts[review_year(line) - 1996] += 1
+    return counts
+
+
+def _process_review_shard(path, make_sinks, task):
+    idx, (start, end), line_counts = task
+    output_dir = os.path.join(SHARD_DIR, f"shard{idx}")
+    os.makedirs(output_dir, exist_ok=True)
+    return process_reviews(path, make_sinks(output_dir=output_dir), start,
+                           end, line_counts)
+
+
+def _process_meta_shard(path, make_sinks, task):
+    idx, (start, end), first_linenum = task
+    output_dir = os.path.join(SHARD_DIR, f"shard{idx}")
+    os.makedirs(output_dir, exist_ok=True)
+    return process_meta(path, make_sinks(output_dir=output_dir), start, end,
+                        first_linenum)
+
+
+def process_sharded(path, make_sinks, workers, review=True, num_shards=None):
+    """
+    Process the review or meta file in shards on worker processes.
+
+    @param make_sinks A picklable callable that takes the keyword argument
+           output_dir and returns the sinks to feed, in the order of close.
+    @param workers The number of worker processes.
+    @param review If true, process the review file, else the meta file.
+    @param num_shards The number of shards, by default the number of workers.
+    """
+    if is_gzip(path):
+        # a gzip stream cannot be split by byte offsets
+        print(f"process {path} serially")
+        if review:
+            process_reviews(path, make_sinks())
+        else:
+            process_meta(path, make_sinks())
+        return
+    shards = find_shards(path, num_shards or workers)
+    shutil.rmtree(SHARD_DIR, ignore_errors=True)
+    with Pool(workers) as pool:
+        if review:
+            counts = pool.map(partial(count_review_years, path), shards)
+            # line counts per year at the start of each shard
+            starts = [[0 for year in range(1996, 2019)]]
+            for shard_counts in counts[:-1]:
+                starts.append(
+                    [x + y for x, y in zip(starts[-1], shard_counts)])
+            worker = partial(_process_review_shard, path, make_sinks)
+        else:
+            index = get_line_index(path)
+            starts = [index.line_number(start) for start, _ in shards]
+            worker = partial(_process_meta_shard, path, make_sinks)
+        results = list(
+            tqdm(pool.imap(worker,
+                           [(idx, shard, start) for idx, (shard, start) in
+                            enumerate(zip(shards, starts))]),
+                 total=len(shards),
+                 desc="Shard"))
+    for shard_sinks in zip(*results):
+        type(shard_sinks[0]).merge(list(shard_sinks))
+    shutil.rmtree(SHARD_DIR, ignore_errors=True)
@@ -0,0 +1,221 @@
+#! /usr/bin/env python3
+"""
+Seeded generator of synthetic Amazon meta and review files.
+
+The records follow the schema of the 2018 dumps and include the dirty values
+the cleaning code handles: HTML and "Visit Amazon's ... Page" brands, brands of
+only special characters, categories with commas, nested similar items, empty
+and "new-releases" asins, comma-formatted votes, style dicts, line breaks and
+quotes in the text fields, missing fields, repeated products, reviews of
+products without metadata, and review times out of the range of datetime.
+
+    ./neo4j_loader/synthetic.py meta.json review.json --products 100000 --reviews 1000000
+"""
+
+import argparse
+import json
+import random
+import string
+import sys
+
+CATEGORIES = [
+    "Books", "Electronics", "Home & Kitchen", "Clothing, Shoes & Jewelry",
+    "Toys & Games", "Sports & Outdoors", "Automotive",
+    "Tools & Home Improvement", "Grocery & Gourmet Food", "Movies & TV",
+    "Cell Phones & Accessories", "Arts, Crafts & Sewing"
+]
+BRAND_WORDS = [
+    "Acme", "Nestlé", "Globex", "Initech", "Umbrella", "Stark", "Wayne",
+    "Hooli", "Vandelay", "Soylent", "Tyrell", "Cyberdyne", "Wonka", "Gringotts"
+]
+BRAND_SUFFIXES = ["", " Inc.", ", Inc", " Co.", " LLC", " & Sons", " USA"]
+STYLE_KEYS = [
+    "Size:", "Color:", "Format:", "Style:", "Size Name:", "size name:",
+    "Color Name:", "Package Quantity:", "Edition:", "Platform:"
+]
+STYLE_VALUES = [
+    " Small", "Medium", "Large ", "XL", "Red", "Blue, Navy", "Kindle Edition",
+    "Paperback", "Hardcover", "Pack of 2", "1\nPack", "8\" x 10\""
+]
+NAMES = [
+    "Amazon Customer", "John", "Mary Smith", "J. Doe", "Smith, Jr.",
+    "<b>Bold</b> Reviewer", "Q&amp;A", "Line\nBreak", "\"Quoted\"",
+    "Kindle Customer", "Zoë", "Renée, M."
+]
+WORDS = ("the a great product works well not bad love it quality price "
+         "would buy again returned broke after week recommend").split()
+# the range of review times in the 2018 dumps
+FIRST_REVIEW_TIME = 832550400  # 1996-05-20
+LAST_REVIEW_TIME = 1538697600  # 2018-10-05
+
+
+def make_asin(rng):
+    return "B0" + "".join(
+        rng.choice(string.digits + string.ascii_uppercase) for _ in range(8))
+
+
+def make_reviewer_id(rng):
+    return "A" + "".join(
+        rng.choice(string.digits + string.ascii_uppercase) for _ in range(13))
+
+
+def skewed_choice(rng, items, alpha=1.2, skew=0.5):
+    """
+    Pick an item, with a power law over the list positions for a skew
+    fraction of the picks and uniformly for the others.
+    """
+    if rng.random() >= skew:
+        return rng.choice(items)
+    idx = int(rng.paretovariate(alpha)) - 1
+    return items[idx % len(items)]
+
+
+def make_text(rng, max_words=60):
+    """ A text with the occasional comma, quote and line break. """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, max_words))]
+    text = " ".join(words)
+    r = rng.random()
+    if r < 0.1:
+        text = text.replace(" ", ", ", 1)
+    elif r < 0.15:
+        text = text.replace(" ", "\n", 1)
+    elif r < 0.18:
+        text = text.replace(" ", "\r\n", 1)
+    elif r < 0.2:
+        text = f'"{text}"'
+    return text
+
+
+def make_brand(rng):
+    """ A brand value, with the dirty forms of the meta file. """
+    name = rng.choice(BRAND_WORDS) + rng.choice(BRAND_SUFFIXES)
+    r = rng.random()
+    if r < 0.05:
+        return f"Visit Amazon's {name} Page"
+    if r < 0.08:
+        return f"<span>{name}</span>"
+    if r < 0.1:
+        return f"({name})"
+    if r < 0.12:
+        return f'"{name}"'
+    if r < 0.13:
+        return rng.choice(["*", "-", "!!!", "...", "&amp;"])
+    if r < 0.15:
+        return name.upper()
+    if r < 0.17:
+        return f"  {name}  "
+    return name
+
+
+def make_meta(rng, asin, asins):
+    """ A product metadata record. """
+    j = {"asin": asin}
+    if rng.random() < 0.95:
+        j["category"] = [skewed_choice(rng, CATEGORIES)] + [
+            rng.choice(CATEGORIES) for _ in range(rng.randint(0, 3))
+        ]
+    if rng.random() < 0.7:
+        j["brand"] = make_brand(rng)
+    if rng.random() < 0.6:
+        j["description"] = [
+            make_text(rng) for _ in range(rng.randint(1, 3))
+        ] + rng.choice([[], [" "], [""]])
+    if rng.random() < 0.5:
+        price = rng.uniform(1, 2000)
+        j["price"] = rng.choice(
+            [f"${price:,.2f}", f"${price:.2f} - ${price * 2:.2f}"])
+    if rng.random() < 0.6:
+        rank = f"{rng.randint(1, 5000000):,} in {rng.choice(CATEGORIES)} ("
+        j["rank"] = rng.choice([rank, [rank], [rank, "#2 in Books"]])
+    for key in ["also_buy", "also_view"]:
+        if rng.random() < 0.5:
+            j[key] = [
+                rng.choice(asins) if rng.random() < 0.8 else make_asin(rng)
+                for _ in range(rng.randint(0, 10))
+            ] + rng.choice([[], [""], ["new-releases"]])
+    if rng.random() < 0.2:
+        j["similar_item"] = [{
+            "asin": rng.choice(asins),
+            "title": make_text(rng, 8)
+        } for _ in range(rng.randint(1, 4))] + rng.choice(
+            [[], [{"title": "no asin"}]])
+    return j
+
+
+def make_review(rng, asins, reviewers):
+    """ A review record. """
+    reviewer, name = skewed_choice(rng, reviewers, skew=0.2)
+    j = {
+        "overall": float(rng.randint(1, 5)),
+        "verified": rng.random() < 0.7,
+        "reviewerID": reviewer,
+        "asin":
+        skewed_choice(rng, asins) if rng.random() < 0.98 else make_asin(rng),
+    }
+    r = rng.random()
+    if r < 0.998:
+        # more reviews in the recent years
+        span = LAST_REVIEW_TIME - FIRST_REVIEW_TIME
+        j["unixReviewTime"] = FIRST_REVIEW_TIME + int(
+            span * rng.random()**0.3)
+    elif r < 0.999:
+        # after the year 9999
+        j["unixReviewTime"] = rng.randint(10**12, 10**13)
+    if rng.random() < 0.15:
+        j["vote"] = f"{rng.randint(2, 20000):,}"
+    if rng.random() < 0.4:
+        j["style"] = {
+            rng.choice(STYLE_KEYS): rng.choice(STYLE_VALUES)
+            for _ in range(rng.randint(1, 2))
+        }
+    if name is not None:
+        j["reviewerName"] = name
+    if rng.random() < 0.98:
+        j["reviewText"] = make_text(rng, 150)
+    if rng.random() < 0.98:
+        j["summary"] = make_text(rng, 8)
+    if rng.random() < 0.05:
+        j["image"] = [f"https://images/{rng.randint(0, 10**9)}.jpg"]
+    return j
+
+
+def generate(meta_path, review_path, products=10000, reviews=100000, seed=0):
+    """
+    Write a synthetic meta file and review file.
+    @param products The number of distinct products in the meta file.
+    @param reviews The number of lines of the review file.
+    @param seed The random seed; the same arguments give the same files.
+    """
+    rng = random.Random(seed)
+    asins = sorted({make_asin(rng) for _ in range(products)})
+    rng.shuffle(asins)
+    with open(meta_path, "w", encoding="utf-8") as outf:
+        for asin in asins:
+            # 1% of the products have a repeated entry
+            for _ in range(1 if rng.random() >= 0.01 else 2):
+                j = make_meta(rng, asin, asins)
+                outf.write(json.dumps(j, ensure_ascii=False) + "\n")
+    reviewers = [(make_reviewer_id(rng),
+                  rng.choice(NAMES) if rng.random() < 0.95 else None)
+                 for _ in range(max(1, reviews // 4))]
+    with open(review_path, "w", encoding="utf-8") as outf:
+        for _ in range(reviews):
+            j = make_review(rng, asins, reviewers)
+            outf.write(json.dumps(j, ensure_ascii=False) + "\n")
+    print(f"output to {meta_path} and {review_path}")
+
+
+def main(argv=None):
+    """ Parse the command line and generate the files. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("meta", help="the meta JSON file to write")
+    parser.add_argument("review", help="the review JSON file to write")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate(args.meta, args.review, args.products, args.reviews, args.seed)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
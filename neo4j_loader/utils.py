@@ -1,20 +1,23 @@
 #! /usr/bin/env python3
 """ Common utility functions. """
 
+import gzip
+import json
 import os
+from bisect import bisect_right
+from datetime import datetime
 from math import floor, log10
 import re
 import html
 
+from extsort import parallel_sorted
+
 root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 assert os.getenv(
     "NEO4J_HOME"
 ) is not None, "Please set your NEO4J_HOME environment variable"
 neo4j_import_dir = os.path.join(os.getenv("NEO4J_HOME"), "import")
 
-REVIEW_COUNT = 233055327
-META_COUNT = 15454958
-
 TAG_CLEANER = re.compile('<.*?>')
 SPECIAL_CHARACTER_CHECKER = re.compile("[^a-zA-Z0-9]+$")
 SPECIAL_CHARACTERS = re.compile('[^a-zA-Z0-9]+')
@@ -22,6 +25,32 @@ SPECIAL_CHARACTERS_EXCEPT_DOT = re.compile('[^a-zA-Z0-9.]+')
 
 BRAND_REPLACE_PATTERNS = [("Visit Amazon's", "Page"), ("(", ")"), ("\"", "\""),
                           ("{", "}")]
+# the number of records whose values are escaped together by the batch kernel
+BATCH_SIZE = 10000
+# the review time as written in the review file, for counting reviews per year
+# without parsing the whole record
+REVIEW_TIME_KEY = b'"unixReviewTime"'
+REVIEW_TIME_PATTERN = re.compile(rb'"unixReviewTime": ?(\d+) ?[,}]')
+# the local times at which the years of the reviews start
+YEAR_STARTS = [datetime(year, 1, 1).timestamp() for year in range(1996, 2020)]
+
+
+def csv_path(path):
+    """ The path of a CSV file, or of its .gz file if compress.py compressed it. """
+    if not os.path.exists(path) and os.path.exists(f"{path}.gz"):
+        return f"{path}.gz"
+    return path
+
+
+def open_csv(path, newline=""):
+    """
+    Open a CSV file, or its .gz file if compressed, decompressing it on the fly.
+    @param newline As for open, "" for csv.reader.
+    """
+    path = csv_path(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline=newline)
+    return open(path, "r", newline=newline)
 
 
 def clean_html(raw_html):
@@ -68,6 +97,25 @@ def escape_comma_newline(value):
     return escape_comma_quote(value)
 
 
+def escape_comma_newline_batch(values):
+    """
+    escape_comma_newline of each value, inlined to save the calls per value,
+    and skipping the replacements of the characters a value does not contain.
+    """
+    escaped = []
+    for value in values:
+        if '\n' in value or '\r' in value:
+            value = value.replace('\n', '\\n').replace('\r', '\\n')
+        if '"' in value:
+            value = value.replace('\\"', '"').replace('""', '"')
+            value = value.replace('"', '""')
+            value = f'"{value}"'
+        elif "," in value:
+            value = f'"{value}"'
+        escaped.append(value)
+    return escaped
+
+
 def output_node_file(distinct, label, col='name'):
     """
     Output node file following NEO4J CSV format
@@ -78,7 +126,7 @@ def output_node_file(distinct, label, col='name'):
         outf.write(f"id:ID({label}_id),{col}:string\n")
         if isinstance(distinct, dict):
             distinct = distinct.values()
-        for idx, value in enumerate(sorted(distinct)):
+        for idx, value in enumerate(parallel_sorted(distinct)):
             idx = str(idx).zfill(n_digits)
             value = escape_comma_quote(value)
             outf.write(f"{idx},{value}\n")
@@ -116,6 +164,44 @@ def clean_brand_values(value, replace):
     return value.strip()
 
 
+def get_review_year(j):
+    """ Get review year by review time, 1996 if the time is invalid. """
+    time = j['unixReviewTime'] if 'unixReviewTime' in j else ''
+    try:
+        return datetime.fromtimestamp(int(time)).year
+    except ValueError:
+        return 1996
+
+
+def review_year(line, start=0, end=None):
+    """
+    Get the review year of a raw line, parsing the JSON only if needed.
+    @param line The bytes of the line, or a buffer holding it, e.g. a mapped
+           file, if start and end give its byte range.
+    """
+    end = len(line) if end is None else end
+    first = line.find(REVIEW_TIME_KEY, start, end)
+    if first >= 0 and line.find(REVIEW_TIME_KEY, first + 1, end) < 0:
+        match = REVIEW_TIME_PATTERN.match(line, first, end)
+        if match is not None:
+            time = int(match.group(1))
+            # the year by the year starts, without converting the time
+            idx = bisect_right(YEAR_STARTS, time)
+            if 0 < idx < len(YEAR_STARTS):
+                return 1995 + idx
+            try:
+                return datetime.fromtimestamp(time).year
+            except ValueError:
+                return 1996
+    return get_review_year(json.loads(line[start:end]))
+
+
+def get_review_id(j, line_counts):
+    """ Get review id by year and line count. """
+    year = get_review_year(j)
+    return f"R{year}{line_counts[year-1996]}", year
+
+
 def clean_style_key(key):
     """ Removes the trailing colon and apply title format. """
     if key.endswith(':'):